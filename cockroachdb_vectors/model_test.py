@@ -1,12 +1,33 @@
 import click
 import importlib
 import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from typing import Iterable, Tuple, Any
 from operations.model import is_valid_model
+from operations.bench import synthetic_text, text_lengths, percentile
+from operations.metrics import _rss_bytes
 
 
 _model = None
 
+# opclass -> operator, see "Embedding Models" in README.md
+INDEX_OPS = {
+    "vector_l2_ops": "<->",
+    "vector_cosine_ops": "<=>",
+    "vector_ip_ops": "<#>"
+}
+
+SAMPLE_TEXT = "CockroachDB is a source-available distributed SQL database management system developed by Cockroach Labs."
+
+
 
 def test_embedding_label():
     global _model
@@ -25,64 +46,354 @@ def test_embedding_dim():
 
 def test_embedding_encode(input_text: str):
     global _model
-    return _model.embedding_encode(input_text, True)
+    return _model.embedding_encode(input_text, False)
 
 
 def test_embedding_encode_batch(batch: Iterable[Tuple[Any, Any]]):
     global _model
-    return _model.embedding_encode_batch(0, batch, True)
+    return _model.embedding_encode_batch(0, batch, False)
+
+
+
+def cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def is_vector(v, dim) -> bool:
+    return (
+        isinstance(v, (list, tuple))
+        and len(v) == dim
+        and all(isinstance(x, (int, float)) and math.isfinite(x) for x in v)
+    )
+
+
+
+class Checks:
+    def __init__(self):
+        self.results = []
+
+    def check(self, name: str, ok: bool, detail: str = ""):
+        self.results.append({"check": name, "ok": bool(ok), "detail": detail})
+        status = "PASS" if ok else "FAIL"
+        print(f"[{status}] {name}" + (f": {detail}" if detail else ""))
+
+    def run(self, name: str, fn):
+        """Runs fn, which returns (ok, detail). An exception is a failure."""
+        try:
+            ok, detail = fn()
+        except Exception as e:
+            ok, detail = False, f"{type(e).__name__}: {e}"
+        self.check(name, ok, detail)
+
+    @property
+    def failed(self) -> int:
+        return sum(1 for r in self.results if not r['ok'])
+
+
+
+def run_conformance(tolerance: float) -> Checks:
+    checks = Checks()
+
+    checks.run("embedding_label() is a non-empty string", lambda: (
+        isinstance(test_embedding_label(), str) and test_embedding_label().strip() != "", repr(test_embedding_label())[:60]
+    ))
+    checks.run("embedding_description() is a non-empty string", lambda: (
+        isinstance(test_embedding_description(), str) and test_embedding_description().strip() != "", ""
+    ))
+
+    dim = test_embedding_dim()
+    checks.check("embedding_dim() is a positive int", isinstance(dim, int) and not isinstance(dim, bool) and dim > 0, repr(dim))
+    if not isinstance(dim, int):
+        try:
+            dim = int(dim)
+        except (TypeError, ValueError):
+            return checks
+
+    def _index_ops():
+        opclass, operator = _model.embedding_index_opclass(), _model.embedding_index_operator()
+        return INDEX_OPS.get(opclass) == operator, f"{opclass} / {operator}"
+    checks.run("embedding_index_opclass() matches embedding_index_operator()", _index_ops)
+
+    def _encode():
+        v = test_embedding_encode(SAMPLE_TEXT)
+        return is_vector(v, dim), f"{len(v)} values" if isinstance(v, (list, tuple)) else type(v).__name__
+    checks.run(f"embedding_encode() returns {dim} finite floats", _encode)
+
+    def _deterministic():
+        similarity = cosine(test_embedding_encode(SAMPLE_TEXT), test_embedding_encode(SAMPLE_TEXT))
+        return similarity >= tolerance, f"cosine {similarity:.6f}"
+    checks.run("embedding_encode() is deterministic", _deterministic)
+
+    # Non-contiguous, unsorted ids: a plugin that re-orders or re-numbers
+    # the rows would write the vectors to the wrong rows.
+    rng = random.Random(7)
+    batch = [(row_id, synthetic_text(rng.randint(20, 400), rng)) for row_id in (907, 13, 500, 2, 77, 31, 1024, 8)]
+
+    result = None
+    def _batch_shape():
+        nonlocal result
+        result = test_embedding_encode_batch(batch)
+        ok = len(result) == len(batch) and all(is_vector(v, dim) for _, v in result)
+        return ok, f"{len(result)} rows for {len(batch)}"
+    checks.run(f"embedding_encode_batch() returns one {dim}-float vector per row", _batch_shape)
+
+    if result is None:
+        return checks
+
+    checks.check(
+        "embedding_encode_batch() preserves the row ids and their order",
+        [row_id for row_id, _ in result] == [row_id for row_id, _ in batch],
+        str([row_id for row_id, _ in result])
+    )
+
+    def _consistent():
+        single = [test_embedding_encode(text) for _, text in batch]
+        similarity = min(cosine(a, b) for a, (_, b) in zip(single, result))
+        return similarity >= tolerance, f"min cosine {similarity:.6f} (tolerance {tolerance})"
+    checks.run("embedding_encode() and embedding_encode_batch() agree", _consistent)
+
+    def _single_row_batch():
+        r = test_embedding_encode_batch(batch[:1])
+        return len(r) == 1 and r[0][0] == batch[0][0] and is_vector(r[0][1], dim), ""
+    checks.run("embedding_encode_batch() handles a single-row batch", _single_row_batch)
+
+    return checks
+
+
+
+def bench_throughput(batch_sizes: list[int], rows: int, min_chars: int, max_chars: int) -> list[dict]:
+    rng = random.Random(42)
+    texts = [synthetic_text(n, rng) for n in text_lengths("lognormal", min_chars, max_chars, rows, rng)]
+
+    results = []
+    for batch_size in batch_sizes:
+        batches = [list(enumerate(texts[i:i + batch_size], i)) for i in range(0, len(texts), batch_size)]
+
+        # Warm-up: lazy initialization, connection setup, ...
+        test_embedding_encode_batch(batches[0])
+
+        latencies = []
+        start = time.perf_counter()
+        for batch in batches:
+            t = time.perf_counter()
+            test_embedding_encode_batch(batch)
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            "batch_size": batch_size,
+            "rows": len(texts),
+            "seconds": round(elapsed, 4),
+            "rows_per_sec": round(len(texts) / elapsed, 1) if elapsed > 0 else 0.0,
+            "p95_batch_seconds": round(percentile(latencies, 95), 5)
+        })
+        print(f"[INFO] batch size {batch_size:>5}: {results[-1]['rows_per_sec']:>10.1f} rows/sec")
+
+    return results
+
+
+
+def bench_latency(queries: int, min_chars: int, max_chars: int) -> dict:
+    rng = random.Random(43)
+    texts = [synthetic_text(n, rng) for n in text_lengths("lognormal", min_chars, max_chars, queries, rng)]
+
+    test_embedding_encode(texts[0])
+
+    latencies = []
+    for text in texts:
+        t = time.perf_counter()
+        test_embedding_encode(text)
+        latencies.append(time.perf_counter() - t)
+
+    result = {
+        "queries": queries,
+        "p50_ms": round(percentile(latencies, 50) * 1e3, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1e3, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1e3, 3),
+        "max_ms": round(max(latencies) * 1e3, 3)
+    }
+    print(f"[INFO] embedding_encode() latency: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms")
+
+    return result
+
+
+
+_COLD_START = """
+import importlib, json, resource, time
+t0 = time.perf_counter()
+m = importlib.import_module({module!r}) if {module!r} else None
+t1 = time.perf_counter()
+if m is not None:
+    m.embedding_encode({text!r})
+t2 = time.perf_counter()
+print(json.dumps({{
+    "import_seconds": t1 - t0,
+    "first_encode_seconds": t2 - t1,
+    "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+}}))
+"""
+
+def _run_cold(module: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get("PYTHONPATH")])))
+    out = subprocess.run(
+        [sys.executable, "-c", _COLD_START.format(module=module, text=SAMPLE_TEXT)],
+        capture_output=True, text=True, env=env, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def bench_cold_start(model: str) -> dict:
+    """Imports the plugin and encodes one text in a fresh interpreter.
+
+    The footprint is the peak RSS of that interpreter minus the peak RSS of
+    an interpreter that imports nothing.
+    """
+    baseline = _run_cold("")
+    cold = _run_cold(f"models.{model}")
+
+    result = {
+        "import_seconds": round(cold['import_seconds'], 3),
+        "first_encode_seconds": round(cold['first_encode_seconds'], 3),
+        "peak_rss_bytes": cold['peak_rss_bytes'],
+        "footprint_bytes": cold['peak_rss_bytes'] - baseline['peak_rss_bytes']
+    }
+    print(f"[INFO] Cold start: import {result['import_seconds']}s, first encode {result['first_encode_seconds']}s, "
+          f"footprint {result['footprint_bytes'] / 2**20:.0f} MiB")
+
+    return result
+
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Serves the plugin API over HTTP, like the plugins' nuclio handler()."""
+
+    backend = None
+    latency = 0.0
+
+    def _reply(self, body: str, content_type: str = "text/plain", status: int = 200):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        name = self.path.strip("/")
+        if name in ("embedding_label", "embedding_description", "embedding_dim",
+                    "embedding_index_opclass", "embedding_index_operator"):
+            self._reply(str(getattr(self.backend, name)()))
+        else:
+            self._reply("not found", status=404)
+
+    def do_POST(self):
+        time.sleep(self.latency)
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        name = self.path.strip("/")
+        if name == "embedding_encode":
+            self._reply(json.dumps(self.backend.embedding_encode(body["text"])), "application/json")
+        elif name == "embedding_encode_batch":
+            self._reply(json.dumps(self.backend.embedding_encode_batch(body["index"], body["batch"])), "application/json")
+        else:
+            self._reply("not found", status=404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(model: str, backend: str, latency_ms: float) -> str:
+    """Starts a local stub of the plugin's remote (nuclio) endpoint, and
+    switches to a directory with a config.yaml that points the plugin at it.
+
+    Returns the stub's URL.
+    """
+    _StubHandler.backend = importlib.import_module(f"models.{backend}")
+    _StubHandler.latency = latency_ms / 1e3
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, name="stub", daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    config_dir = tempfile.mkdtemp(prefix="model-test-")
+    with open(os.path.join(config_dir, "config.yaml"), "w") as f:
+        f.write(f"models:\n  - {model}:\n    nuclio:\n      url: {url}\n")
+    os.chdir(config_dir)
+
+    return url
 
 
 
 
 @click.command()
 @click.argument("model")
-def main(model: str):
+@click.option("--bench", is_flag=True, help="Also run the performance benchmarks")
+@click.option("--batch-sizes", default="1,8,32,128", show_default=True,
+              help="Comma-separated batch sizes for the throughput curve")
+@click.option("--rows", default=256, type=int, show_default=True, help="Rows encoded per batch size")
+@click.option("--queries", default=50, type=int, show_default=True, help="Single-text encodes for the latency percentiles")
+@click.option("--text-length", default="50:1000", show_default=True, help="MIN:MAX length of the texts, in characters")
+@click.option("--tolerance", default=0.999, type=float, show_default=True,
+              help="Minimum cosine similarity between embedding_encode() and embedding_encode_batch() results")
+@click.option("--stub", is_flag=True,
+              help="Run the plugin in remote (nuclio) mode against a local stub server")
+@click.option("--stub-backend", default="hash_bench", show_default=True, help="Local model serving the stub")
+@click.option("--stub-latency", default=0.0, type=float, show_default=True, help="Added stub latency per request, in ms")
+@click.option("--json", "json_path", type=click.Path(dir_okay=False), help="Write the results to a JSON file")
+def main(
+        model: str,
+        bench: bool,
+        batch_sizes: str,
+        rows: int,
+        queries: int,
+        text_length: str,
+        tolerance: float,
+        stub: bool,
+        stub_backend: str,
+        stub_latency: float,
+        json_path: str | None
+):
     if not is_valid_model(model):
         raise RuntimeError(f"Invalid embedding model {model}")
 
+    if json_path:
+        json_path = os.path.abspath(json_path)
+
+    min_chars, max_chars = (int(n) for n in text_length.split(':'))
+
     print(f"Testing model: {model}")
+    if stub:
+        print(f"Stub server:   {start_stub(model, stub_backend, stub_latency)} ({stub_backend})")
     print()
 
     global _model
     _model = importlib.import_module(f"models.{model}")
 
-    
-    print("embedding_label()")
-    print("-----------------")
-    print(test_embedding_label())
+    print(f"{test_embedding_label()} ({test_embedding_dim()} dimensions)")
     print()
 
+    report = {"model": model, "stub": stub_backend if stub else None}
 
-    print("embedding_description()")
-    print("-----------------------")
-    print(test_embedding_description())
+    checks = run_conformance(tolerance)
+    report['checks'] = checks.results
     print()
 
+    if bench:
+        report['throughput'] = bench_throughput([int(b) for b in batch_sizes.split(',')], rows, min_chars, max_chars)
+        report['latency'] = bench_latency(queries, min_chars, max_chars)
+        report['cold_start'] = bench_cold_start(model)
+        report['rss_bytes'] = _rss_bytes(os.getpid())
+        print()
 
-    print("embedding_dim()")
-    print("---------------")
-    print(test_embedding_dim())
-    print()
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {json_path}")
 
-
-    input_text = "CockroachDB is a source-available distributed SQL database management system developed by Cockroach Labs."
-    print(f"embedding_encode(\"{input_text}\")")
-    print("------------------")
-    print(test_embedding_encode(input_text))
-    print()
-
-
-    input_batch: Iterable[Tuple[int, str]] = (
-        (0, "zero zero zero zero zero"),
-        (1, "one one one one one one"),
-        (2, "two two two two two two")
-    )
-    print(f"embedding_encode_batch(\"{input_batch}\")")
-    print("--------------------------------")
-    for b in test_embedding_encode_batch(input_batch):
-        print(b)
-    print()
+    print(f"{len(checks.results) - checks.failed} passed, {checks.failed} failed")
+    sys.exit(1 if checks.failed else 0)
 
 
 if __name__ == "__main__":
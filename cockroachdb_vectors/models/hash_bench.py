@@ -0,0 +1,99 @@
+import re
+import math
+import hashlib
+import textwrap
+from typing import Iterable, List, Tuple, Any
+import yaml
+from pathlib import Path
+
+
+#
+# Deterministic stand-in model for benchmarks and tests: no weights to
+# download, no GPU, no API key. Vectors are a signed feature hash of the
+# input tokens, so the cost grows with the text length like a real model's
+# and texts that share words end up close to each other.
+#
+DEFAULT_DIM = 384
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+# The configuration is optional: without a config.yaml (or without a
+# hash_bench entry in it) the defaults apply.
+model_settings = {}
+
+config_path = Path.cwd().joinpath("config.yaml")
+if config_path.exists():
+    with open(config_path, "r") as file:
+        config = yaml.safe_load(file) or {}
+
+    model_settings = next(
+        (
+            item[Path(__file__).stem] or {k: v for k, v in item.items() if k != Path(__file__).stem}
+            for item in config.get('models') or []
+            if isinstance(item, dict) and 'hash_bench' in item
+        ),
+        {}
+    )
+
+_DIM = int(model_settings.get('dim', DEFAULT_DIM))
+
+
+
+def embedding_label() -> str:
+    return "Hash-based benchmark stand-in model"
+
+
+def embedding_description() -> str:
+    return textwrap.dedent(
+        f"""
+        Deterministic feature-hashing embedding, for benchmarks and tests.
+        Produces {_DIM}-dimensional normalized float vectors from the words
+        of the input text. No model weights or network access required.
+        Not suitable for semantic search.
+        """
+    ).strip()
+
+
+def embedding_dim() -> int:
+    return _DIM
+
+
+def embedding_index_opclass() -> str:
+    return "vector_cosine_ops"
+
+
+def embedding_index_operator() -> str:
+    return "<=>"
+
+
+
+def _hash_vector(input_text: str) -> List[float]:
+    vector = [0.0] * _DIM
+
+    for token in _TOKEN_RE.findall(input_text.lower()):
+        h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[h % _DIM] += 1.0 if (h >> 63) & 1 else -1.0
+
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0.0:
+        # Empty text: cosine distance is undefined for the zero vector
+        vector[0] = 1.0
+        return vector
+
+    return [v / norm for v in vector]
+
+
+
+def embedding_encode(input_text: str, verbose: bool = False) -> List[float]:
+    return _hash_vector(input_text or "")
+
+
+
+def embedding_encode_batch(
+        batch_index: int,
+        batch: Iterable[Tuple[Any, Any]],
+        verbose: bool = False
+    ) -> List[Tuple[Any, List[float]]]:
+
+    return [[row_id, _hash_vector(row_text or "")] for row_id, row_text in batch]
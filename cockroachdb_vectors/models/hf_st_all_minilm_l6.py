@@ -22,7 +22,7 @@ if not os.getenv("NUCLIO"):
         config = yaml.safe_load(file)
 
     model_settings = next(
-        item[Path(__file__).stem] 
+        item[Path(__file__).stem] or {k: v for k, v in item.items() if k != Path(__file__).stem}
         for item in config['models'] 
         if isinstance(item, dict) and 'hf_st_all_minilm_l6' in item
     )
@@ -51,6 +51,7 @@ if not os.getenv("NUCLIO"):
 
 
 if exec_local:
+    import numpy as np
     from sentence_transformers import SentenceTransformer
     from huggingface_hub import snapshot_download
 
@@ -94,7 +95,7 @@ def embedding_label() -> str:
     if 'nuclio' in model_settings:
         response = requests.get(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.local"}
                     )
@@ -118,7 +119,7 @@ def embedding_description() -> str:
     if 'nuclio' in model_settings:
         response = requests.get(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.local"}
                     )
@@ -135,12 +136,12 @@ def embedding_dim() -> int:
     if 'nuclio' in model_settings:
         response = requests.get(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.local"}
                     )
         response.raise_for_status()  # raises on non-200
-        return response.text
+        return int(response.text)
 
 
 
@@ -151,7 +152,7 @@ def embedding_index_opclass() -> str:
     if 'nuclio' in model_settings:
         response = requests.get(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.local"}
                     )
@@ -166,7 +167,7 @@ def embedding_index_operator() -> str:
     if 'nuclio' in model_settings:
         response = requests.get(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.local"}
                     )
@@ -175,6 +176,13 @@ def embedding_index_operator() -> str:
 
 
 
+# all-MiniLM-L6-v2 only reads the first 256 word pieces of its input. At 8
+# characters per word piece (English text averages about 4), that's all of it.
+def embedding_max_input_chars() -> int:
+    return 256 * 8
+
+
+
 def embedding_encode(input_text: str, verbose: bool = False) -> List[float]:
     if exec_local:
         model = _MODEL_CACHE.get(huggingface_path)
@@ -184,7 +192,7 @@ def embedding_encode(input_text: str, verbose: bool = False) -> List[float]:
     if 'nuclio' in model_settings:
         response = requests.post(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.local"},
                         json = {"text": input_text}
@@ -213,7 +221,7 @@ def embedding_encode_batch(
     if 'nuclio' in model_settings:
         response = requests.post(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.local"},
                         json = {
@@ -226,6 +234,20 @@ def embedding_encode_batch(
 
 
 
+# embed --shm: the float32 vectors as they come out of the model, one row per
+# input, without converting them to lists
+if exec_local:
+    def embedding_encode_batch_array(
+            batch_index: int,
+            batch: Iterable[Tuple[Any, Any]],
+            verbose: bool = False
+      ) -> np.ndarray:
+
+        model = _MODEL_CACHE.get(huggingface_path)
+        return model.encode([row_text for _, row_text in batch], batch_size=128, show_progress_bar=False)
+
+
+
 
 if os.getenv("NUCLIO"):
     def handler(context, event):
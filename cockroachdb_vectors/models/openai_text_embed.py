@@ -27,7 +27,7 @@ with open(config_path, "r") as file:
     config = yaml.safe_load(file)
 
 openai_settings = next(
-    item[Path(__file__).stem] 
+    item[Path(__file__).stem] or {k: v for k, v in item.items() if k != Path(__file__).stem}
     for item in config['models'] 
     if isinstance(item, dict) and 'openai_text_embed' in item
 )
@@ -74,6 +74,12 @@ def embedding_index_operator() -> str:
     return "<=>"
     
 
+# In practice, a text this long is over PER_STRING_TOKEN_LIMIT and the API
+# rejects it: there's no point fetching more of it.
+def embedding_max_input_chars() -> int:
+    return PER_STRING_TOKEN_LIMIT * 8
+
+
 def embedding_encode(input_text: str, verbose: bool = False) -> List[float]:
     global _encoding
     token_integers = _encoding.encode(input_text)
@@ -25,7 +25,7 @@ if not os.getenv("NUCLIO"):
         config = yaml.safe_load(file)
 
     model_settings = next(
-        item[Path(__file__).stem] 
+        item[Path(__file__).stem] or {k: v for k, v in item.items() if k != Path(__file__).stem}
         for item in config['models'] 
         if isinstance(item, dict) and Path(__file__).stem in item
     )
@@ -80,7 +80,7 @@ def embedding_label() -> str:
     if 'nuclio' in model_settings:
         response = requests.get(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.takara"}
                     )
@@ -101,7 +101,7 @@ def embedding_description() -> str:
     if 'nuclio' in model_settings:
         response = requests.get(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.takara"}
                     )
@@ -117,12 +117,12 @@ def embedding_dim() -> int:
     if 'nuclio' in model_settings:
         response = requests.get(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.takara"}
                     )
         response.raise_for_status()  # raises on non-200
-        return response.text
+        return int(response.text)
 
 
 
@@ -133,7 +133,7 @@ def embedding_index_opclass() -> str:
     if 'nuclio' in model_settings:
         response = requests.get(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.takara"}
                     )
@@ -149,7 +149,7 @@ def embedding_index_operator() -> str:
     if 'nuclio' in model_settings:
         response = requests.get(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.takara"}
                     )
@@ -170,7 +170,7 @@ def embedding_encode(input_text: str, verbose: bool = False) -> List[float]:
     if 'nuclio' in model_settings:
         response = requests.post(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.takara"},
                         json = {"text": input_text}
@@ -208,7 +208,7 @@ def embedding_encode_batch(
     if 'nuclio' in model_settings:
         response = requests.post(
                         urljoin(model_settings['nuclio']['url'], inspect.currentframe().f_code.co_name),
-                        auth = model_settings['nuclio']['auth'],
+                        auth = model_settings['nuclio'].get('auth'),
                         verify = False,
                         headers = {"Host": "nuclio.takara"},
                         json = {
@@ -1,20 +1,31 @@
 # operations/__init__.py
 
-from .embed import run_embed
+from .embed import run_embed, run_replay_spool
 from .search import run_search, run_emit
 from .model import is_valid_model, run_model_list, run_model_desc
-from .instrument import run_instrument, run_cleanup
+from .instrument import run_instrument, run_build_index, run_cleanup
 from .size import run_size
+from .bench import run_bench_embed, run_bench_trigger
+from .backfill import run_backfill
+from .orchestrator import run_embed_all
+from .migrate import run_migrate_model
 
 
 __all__ = [
     "run_embed",
+    "run_embed_all",
+    "run_replay_spool",
     "run_search",
     "run_emit",
     "run_instrument",
+    "run_build_index",
+    "run_migrate_model",
     "run_size",
     "run_cleanup",
     "is_valid_model",
     "run_model_list",
-    "run_model_desc"
+    "run_model_desc",
+    "run_bench_embed",
+    "run_bench_trigger",
+    "run_backfill"
 ]
@@ -0,0 +1,106 @@
+import math
+from datetime import datetime
+
+
+class BatchSizeController:
+    """AIMD (additive increase, multiplicative decrease) controller for the
+    embed batch size and the per-worker chunk size.
+
+    The batch size follows the database side: it backs off sharply when
+    batch_update() needs retries or the UPDATE gets slower than the target,
+    and grows slowly while writes are clean and fast.
+
+    The chunk size follows the model side: a chunk that takes longer than
+    the encode target, or fails, halves the chunk size. The chunk size never
+    exceeds an even split of the batch across the workers.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        workers: int,
+        min_batch_size: int,
+        max_batch_size: int,
+        update_target: float = 2.0,
+        encode_target: float = 10.0,
+        log: bool = True
+    ):
+        self.min_batch_size = max(1, min_batch_size)
+        self.max_batch_size = max(self.min_batch_size, max_batch_size)
+        self.batch_size = min(max(batch_size, self.min_batch_size), self.max_batch_size)
+
+        self.workers = max(1, workers)
+        self.chunk_size = self._max_chunk_size()
+
+        self.update_target = update_target
+        self.encode_target = encode_target
+        self.log = log
+
+        # Additive increase steps
+        self._batch_step = max(1, self.batch_size // 10)
+        self._chunk_step = max(1, self.chunk_size // 10)
+
+
+    def _max_chunk_size(self) -> int:
+        return max(1, math.ceil(self.batch_size / self.workers))
+
+
+    def _log(self, what, before, after, reason):
+        if self.log and before != after:
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            print(f"[{timestamp}] [INFO] Adaptive: {what} {before} -> {after} ({reason})", flush=True)
+
+
+    def observe(
+        self,
+        rows: int,
+        encode_secs: float,
+        update_secs: float,
+        retries: int,
+        failures: int = 0
+    ):
+        """Adjusts the sizes after a batch.
+
+        Args:
+            rows: Rows embedded in the batch.
+            encode_secs: Slowest chunk, from submission to result.
+            update_secs: Time spent in batch_update().
+            retries: Retries batch_update() needed (serialization errors,
+                     contention, ...).
+            failures: Chunks or writes that failed outright.
+        """
+        if rows <= 0:
+            return
+
+        # Database side: batch size
+        before = self.batch_size
+        if retries > 0 or failures > 0:
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+            reason = f"{retries} retries, {failures} failures"
+        elif update_secs > self.update_target:
+            self.batch_size = max(self.min_batch_size, int(self.batch_size * 0.75))
+            reason = f"update {update_secs:.2f}s > {self.update_target:.2f}s"
+        elif rows >= self.batch_size:
+            # Only grow if the batch was full: a short batch says nothing
+            # about how a bigger one would do.
+            self.batch_size = min(self.max_batch_size, self.batch_size + self._batch_step)
+            reason = f"update {update_secs:.2f}s, no retries"
+        else:
+            reason = None
+
+        if reason:
+            self._log("batch size", before, self.batch_size, reason)
+
+        # Model side: chunk size
+        before = self.chunk_size
+        if failures > 0 or encode_secs > self.encode_target:
+            self.chunk_size = max(1, self.chunk_size // 2)
+        else:
+            self.chunk_size = self.chunk_size + self._chunk_step
+        reason = f"encode {encode_secs:.2f}s"
+
+        if self.chunk_size > self._max_chunk_size():
+            self.chunk_size = self._max_chunk_size()
+            reason = f"batch size {self.batch_size}, {self.workers} workers"
+
+        self._log("chunk size", before, self.chunk_size, reason)
@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import random
+import atexit
+import threading
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from .model import is_valid_model
+from .common import (
+    ThreadedSpreadConnectionPool,
+    parse_gateways,
+    main_get_conn,
+    healthy_get_conn,
+    get_primary_key_column,
+    get_range_boundaries,
+    write_json_atomic
+)
+from .instrument import (
+    is_vector_column,
+    is_chunked,
+    vector_table_name,
+    vector_column_model,
+    queue_table_name,
+    is_queued
+)
+from .chunking import model_max_tokens, DEFAULT_OVERLAP_TOKENS
+from .throttle import throttle_from_args
+from . import embed
+from . import metrics
+
+
+
+def plan_spans(boundaries: list) -> list[dict]:
+    """Turns the range boundaries into contiguous [start, end) primary key
+    spans covering the whole table. None is unbounded.
+    """
+    edges = [None] + boundaries + [None]
+    return [
+        {"start": edges[i], "end": edges[i + 1], "after": None, "done": False, "rows": 0}
+        for i in range(len(edges) - 1)
+    ]
+
+
+
+def _jsonable(value):
+    # Key values come back as int, str, UUID, Decimal, ...
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+
+
+class FileCheckpoint:
+    """Keeps the backfill progress in a local JSON file."""
+
+    def __init__(self, path: str, table_name: str, column: str):
+        self.path = path
+        self.table_name = table_name
+        self.column = column
+        self.spans = None
+        self._lock = threading.Lock()
+
+    def load(self) -> list[dict] | None:
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path, "r") as f:
+            state = json.load(f)
+
+        if state.get('table') != self.table_name or state.get('column') != self.column:
+            raise RuntimeError(
+                f"Checkpoint {self.path} is for {state.get('table')}.{state.get('column')}, "
+                f"not {self.table_name}.{self.column}"
+            )
+
+        self.spans = state['spans']
+        return self.spans
+
+    def init(self, spans: list[dict]):
+        self.spans = spans
+        self._write()
+
+    def save(self, i: int, span: dict):
+        with self._lock:
+            self.spans[i] = span
+            self._write()
+
+    def _write(self):
+        write_json_atomic(self.path, {"table": self.table_name, "column": self.column, "spans": self.spans})
+
+
+
+class TableCheckpoint:
+    """Keeps the backfill progress in a tracking table, one row per span, so
+    that it survives the loss of the machine running the backfill.
+    """
+
+    def __init__(self, pool, tracking_table: str, table_name: str, column: str):
+        self.pool = pool
+        self.tracking_table = tracking_table
+        self.table_name = table_name
+        self.column = column
+
+        conn = main_get_conn(pool)
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {tracking_table} (
+                    table_name STRING NOT NULL,
+                    column_name STRING NOT NULL,
+                    span_id INT8 NOT NULL,
+                    start_key JSONB,
+                    end_key JSONB,
+                    after_key JSONB,
+                    done BOOL NOT NULL DEFAULT false,
+                    rows INT8 NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (table_name, column_name, span_id)
+                )
+            """)
+        pool.putconn(conn)
+
+    def load(self) -> list[dict] | None:
+        conn = main_get_conn(self.pool)
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT start_key, end_key, after_key, done, rows
+                FROM {self.tracking_table}
+                WHERE table_name = %s AND column_name = %s
+                ORDER BY span_id
+            """, (self.table_name, self.column))
+            rows = cur.fetchall()
+        self.pool.putconn(conn)
+
+        if not rows:
+            return None
+
+        return [
+            {"start": start, "end": end, "after": after, "done": done, "rows": n}
+            for start, end, after, done, n in rows
+        ]
+
+    def init(self, spans: list[dict]):
+        conn = main_get_conn(self.pool)
+        with conn.cursor() as cur:
+            cur.execute(
+                f"DELETE FROM {self.tracking_table} WHERE table_name = %s AND column_name = %s",
+                (self.table_name, self.column)
+            )
+        self.pool.putconn(conn)
+
+        for i, span in enumerate(spans):
+            self.save(i, span)
+
+    def save(self, i: int, span: dict):
+        conn = healthy_get_conn(self.pool)
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                UPSERT INTO {self.tracking_table}
+                    (table_name, column_name, span_id, start_key, end_key, after_key, done, rows, updated_at)
+                VALUES (%s, %s, %s, %s::JSONB, %s::JSONB, %s::JSONB, %s, %s, now())
+            """, (
+                self.table_name, self.column, i,
+                json.dumps(span['start']), json.dumps(span['end']), json.dumps(span['after']),
+                span['done'], span['rows']
+            ))
+        self.pool.putconn(conn)
+
+
+
+def fetch_span_null_ids(
+        pool,
+        schema_name, table_name,
+        output_column,
+        primary_key, primary_key_type,
+        span: dict,
+        limit: int
+    ) -> list:
+    """Next batch of NULL rows in the span, in primary key order, after the
+    span's checkpoint.
+    """
+    label = metrics.table_label(schema_name, table_name)
+
+    if schema_name is not None:
+        table_name = f"{schema_name}.{table_name}"
+
+    conditions = [f"{output_column} IS NULL"]
+    params = []
+
+    if span['after'] is not None:
+        conditions.append(f"{primary_key} > %s::{primary_key_type}")
+        params.append(span['after'])
+    elif span['start'] is not None:
+        conditions.append(f"{primary_key} >= %s::{primary_key_type}")
+        params.append(span['start'])
+
+    if span['end'] is not None:
+        conditions.append(f"{primary_key} < %s::{primary_key_type}")
+        params.append(span['end'])
+
+    query = f"""
+        SELECT {primary_key} FROM {table_name}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {primary_key}
+        LIMIT %s
+    """
+
+    max_retries = 10
+    start = time.time()
+
+    for attempt in range(1, max_retries + 1):
+        conn = None
+        try:
+            conn = healthy_get_conn(pool, attempt > 1)
+            with conn.cursor() as cur:
+                cur.execute(query, params + [limit])
+                ids = [row[0] for row in cur.fetchall()]
+            pool.putconn(conn)
+            break
+
+        except Exception as e:
+            if conn is not None:
+                pool.putconn(conn, close=conn.closed != 0)
+
+            if attempt < max_retries:
+                print(f"[WARN] Retry {attempt}/{max_retries} on fetch_span_null_ids: {e}", flush=True)
+                time.sleep(0.5 * attempt + random.uniform(0, 0.3))
+            else:
+                raise
+
+    metrics.STAGE_SECONDS.observe(time.time() - start, table=label, column=output_column, stage="fetch")
+
+    return ids
+
+
+
+def run_backfill(args: dict):
+    if not is_valid_model(args['model']):
+        raise RuntimeError(f"Invalid embedding model {args['model']}")
+
+    schema_name, table_name = args['schema'], args['table']
+    full_table_name = table_name
+    if schema_name is not None:
+        full_table_name = f"{schema_name}.{table_name}"
+
+    # The forked workers inherit the model loaded here
+    embed.model = importlib.import_module(f"{__package__.split('.')[0]}.models.{args['model']}")
+
+    # Shared by the lanes: one connection per lane, plus one for checkpoints.
+    # The lanes' connections, and their writes, are spread over the gateways.
+    conn_pool = ThreadedSpreadConnectionPool(0, args['lanes'] + 2, args['url'])
+    atexit.register(conn_pool.closeall)
+
+    primary_key, primary_key_type = get_primary_key_column(conn_pool, schema_name, table_name)
+
+    # With side table storage, the NULL scans, the spans, and the writes are
+    # all on the side table
+    vector_table = vector_table_name(conn_pool, schema_name, table_name, args['output'])
+    if vector_table != table_name:
+        embed._VECTOR_TABLE = vector_table
+
+    if not is_vector_column(conn_pool, schema_name, vector_table, args['output'], embed.model.embedding_dim(), args['verbose']):
+        raise RuntimeError(f"Column {args['output']} doesn't exist. Run 'instrument' first.")
+
+    recorded_model = vector_column_model(conn_pool, schema_name, vector_table, args['output'])
+    if recorded_model is not None and recorded_model != args['model']:
+        raise RuntimeError(f"Column {args['output']} is embedded with {recorded_model}, not {args['model']}")
+    embed._COLUMN_MODEL = args['model']
+
+    # The rows embedded here leave the queue too
+    if vector_table == table_name and is_queued(conn_pool, schema_name, table_name, args['output']):
+        embed._QUEUE_TABLE = queue_table_name(table_name, args['output'])
+
+    if is_chunked(conn_pool, schema_name, table_name, args['output']):
+        embed._CHUNKING = {"max_tokens": model_max_tokens(embed.model), "overlap_tokens": DEFAULT_OVERLAP_TOKENS}
+    else:
+        embed._MAX_INPUT_CHARS = embed.input_char_limit(conn_pool, schema_name, table_name, args['input'])
+
+    if args['checkpoint_table']:
+        store = TableCheckpoint(conn_pool, args['checkpoint_table'], full_table_name, args['output'])
+    else:
+        checkpoint = args['checkpoint'] or f"backfill_{full_table_name}_{args['output']}.json"
+        store = FileCheckpoint(checkpoint, full_table_name, args['output'])
+
+    spans = None if args['restart'] else store.load()
+
+    if spans is None:
+        # The spans are planned once and kept in the checkpoint: ranges
+        # split and merge while the backfill runs, the spans must not.
+        boundaries = get_range_boundaries(conn_pool, schema_name, vector_table, args['verbose'])
+        spans = plan_spans(boundaries)
+        store.init(spans)
+        print(f"[INFO] Planned {len(spans)} spans from the table's range boundaries")
+    else:
+        done = sum(1 for s in spans if s['done'])
+        print(f"[INFO] Resuming: {done}/{len(spans)} spans done, {sum(s['rows'] for s in spans)} rows embedded")
+
+    gateways = parse_gateways(args['url'])
+    executor = ProcessPoolExecutor(
+        max_workers=min(args['workers'], multiprocessing.cpu_count()),
+        initializer=embed.worker_init,
+        initargs=(args['url'], gateways, len(gateways), multiprocessing.Value('i', 0), None)
+    )
+
+    # Shared by the lanes
+    embed._THROTTLE = throttle_from_args(conn_pool, args)
+
+    if args['metrics_port']:
+        metrics.start_metrics_server(args['metrics_port'])
+
+    stop = threading.Event()
+    batch_lock = threading.Lock()
+    batch_counter = 0
+
+    def _backfill_span(i: int):
+        nonlocal batch_counter
+        span = dict(spans[i])
+
+        while not stop.is_set():
+            ids = fetch_span_null_ids(
+                conn_pool, schema_name, vector_table, args['output'],
+                primary_key, primary_key_type,
+                span, args['batch_size']
+            )
+            if not ids:
+                span['done'] = True
+                store.save(i, span)
+                return span
+
+            with batch_lock:
+                batch_counter += 1
+                batch = batch_counter
+
+            update_count, worker_errors, worker_warnings = embed.process_single_batch(
+                executor,
+                conn_pool,
+                args['url'], schema_name, table_name,
+                primary_key, primary_key_type,
+                args['input'], args['output'],
+                ids,
+                args['workers'],
+                batch,
+                args['verbose']
+            )
+
+            for msg in worker_warnings + worker_errors:
+                print(msg, flush=True)
+
+            # Rows that failed stay NULL behind the checkpoint; a regular
+            # 'embed' run picks them up.
+            span['after'] = _jsonable(ids[-1])
+            span['rows'] += update_count
+            store.save(i, span)
+
+        return span
+
+
+    pending = [i for i, s in enumerate(spans) if not s['done']]
+    start = time.time()
+
+    lanes = ThreadPoolExecutor(max_workers=args['lanes'], thread_name_prefix="lane")
+    try:
+        futures = {lanes.submit(_backfill_span, i): i for i in pending}
+        for n, fut in enumerate(as_completed(futures), 1):
+            span = fut.result()
+            spans[futures[fut]] = span
+            print(f"[INFO] Span {futures[fut] + 1}/{len(spans)} done: {span['rows']} rows ({n}/{len(pending)} this run)", flush=True)
+
+    except BaseException as e:
+        # Let the other lanes finish their batch in flight, then stop
+        stop.set()
+        if isinstance(e, KeyboardInterrupt):
+            print("[WARN] Interrupted: finishing the batches in flight. Progress is saved, re-run to resume.", flush=True)
+        raise
+
+    finally:
+        lanes.shutdown(wait=True, cancel_futures=True)
+        executor.shutdown(wait=True)
+
+    total = sum(s['rows'] for s in spans)
+    print(f"[INFO] Backfill complete: {total} rows embedded across {len(spans)} spans in {time.time() - start:.1f} seconds")
+
+    return None
@@ -0,0 +1,593 @@
+import os
+import math
+import json
+import time
+import random
+import atexit
+import platform
+import threading
+import importlib
+import multiprocessing
+from datetime import datetime, timezone
+from importlib.metadata import version, PackageNotFoundError
+from concurrent.futures import ProcessPoolExecutor
+from psycopg2.pool import SimpleConnectionPool
+from psycopg2.extras import execute_values
+from rich.console import Console
+from rich.table import Table
+from .model import is_valid_model
+from .common import build_conn_kwargs, parse_gateways, main_get_conn, get_primary_key_column
+from .instrument import (
+    run_instrument,
+    read_trigger_function,
+    update_trigger_sql,
+    set_trigger_strategy,
+    install_trigger
+)
+from . import embed
+from . import metrics
+
+
+# Marks the tables created by the benchmark. Seeding drops and re-creates
+# the table, so it refuses to touch a table without this comment.
+BENCH_TABLE_COMMENT = "vectorize bench embed"
+
+_WORDS = (
+    "cockroach database distributed sql vector embedding index range replica "
+    "lease raft node cluster region zone latency throughput transaction commit "
+    "retry batch worker model encode update query search similarity cosine "
+    "the a of and to in is for on with as by at from that this it be are was "
+    "river mountain city market energy history music garden ocean science "
+    "language network signal memory storage engine schema column table row"
+).split()
+
+
+
+def text_lengths(distribution: str, min_chars: int, max_chars: int, rows: int, rng: random.Random):
+    if distribution == "lognormal":
+        # Median at the geometric mean, MIN and MAX at about two sigmas
+        mu = math.log(math.sqrt(min_chars * max_chars))
+        sigma = max(math.log(max_chars / min_chars) / 4, 1e-9)
+        for _ in range(rows):
+            yield min(max_chars, max(min_chars, round(rng.lognormvariate(mu, sigma))))
+    else:
+        for _ in range(rows):
+            yield rng.randint(min_chars, max_chars)
+
+
+
+def synthetic_text(length: int, rng: random.Random) -> str:
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(_WORDS)
+        words.append(word)
+        size += len(word) + 1
+
+    return " ".join(words)[:length]
+
+
+
+def is_bench_table(pool, table_name) -> bool | None:
+    """None if the table doesn't exist, otherwise whether the benchmark
+    created it.
+    """
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s)::OID", (table_name,))
+        oid = cur.fetchone()[0]
+        if oid is None:
+            pool.putconn(conn)
+            return None
+
+        cur.execute("SELECT obj_description(%s)", (oid,))
+        comment = cur.fetchone()[0]
+    pool.putconn(conn)
+
+    return comment == BENCH_TABLE_COMMENT
+
+
+
+def seed_table(
+        pool,
+        table_name: str,
+        rows: int,
+        distribution: str,
+        min_chars: int, max_chars: int,
+        seed: int,
+        verbose: bool = False
+    ) -> dict:
+
+    if is_bench_table(pool, table_name) is False:
+        raise RuntimeError(f"Table {table_name} exists and was not created by the benchmark. Use another --table.")
+
+    print(f"[INFO] Seeding {table_name} with {rows} rows ({distribution} text length, {min_chars}-{max_chars} chars)...")
+
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {table_name} CASCADE")
+        cur.execute(f"""
+            CREATE TABLE {table_name} (
+                id INT8 PRIMARY KEY,
+                body STRING NOT NULL
+            )
+        """)
+        cur.execute(f"COMMENT ON TABLE {table_name} IS '{BENCH_TABLE_COMMENT}'")
+
+    rng = random.Random(seed)
+    total_chars = 0
+    page = []
+
+    with conn.cursor() as cur:
+        for row_id, length in enumerate(text_lengths(distribution, min_chars, max_chars, rows, rng), 1):
+            text = synthetic_text(length, rng)
+            total_chars += len(text)
+            page.append((row_id, text))
+
+            if len(page) >= 1000:
+                execute_values(cur, f"INSERT INTO {table_name} (id, body) VALUES %s", page)
+                page = []
+                if verbose:
+                    print(f"[INFO] Seeded {row_id} rows")
+
+        if page:
+            execute_values(cur, f"INSERT INTO {table_name} (id, body) VALUES %s", page)
+
+    pool.putconn(conn)
+
+    return {
+        "rows": rows,
+        "distribution": distribution,
+        "min_chars": min_chars,
+        "max_chars": max_chars,
+        "mean_chars": round(total_chars / rows, 1) if rows else 0,
+        "seed": seed
+    }
+
+
+
+def reset_vector_column(pool, table_name: str, vector_column: str):
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        while True:
+            cur.execute(f"""
+                UPDATE {table_name}
+                SET {vector_column} = NULL
+                WHERE {vector_column} IS NOT NULL
+                LIMIT 5000
+            """)
+            if cur.rowcount <= 0:
+                break
+    pool.putconn(conn)
+
+
+
+class PeakRSS:
+    """Samples the RSS of this process and of its worker processes in the
+    background, and keeps the peaks.
+    """
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.peak_total = 0
+        self.peak_worker = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="peak-rss", daemon=True)
+
+
+    def _run(self):
+        while not self._stop.is_set():
+            total = metrics._rss_bytes(os.getpid()) or 0
+            for p in multiprocessing.active_children():
+                rss = metrics._rss_bytes(p.pid) or 0
+                self.peak_worker = max(self.peak_worker, rss)
+                total += rss
+            self.peak_total = max(self.peak_total, total)
+            self._stop.wait(self.interval)
+
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+
+def bench_embed_once(
+        url: str,
+        conn_pool,
+        schema: str | None, table: str,
+        primary_key: str, primary_key_type: str,
+        source_column: str, vector_column: str,
+        rows: int,
+        batch_size: int,
+        workers: int,
+        verbose: bool = False
+    ) -> dict:
+
+    gateways = parse_gateways(url)
+
+    executor = ProcessPoolExecutor(
+        max_workers=min(workers, multiprocessing.cpu_count()),
+        initializer=embed.worker_init,
+        initargs=(url, gateways, len(gateways), multiprocessing.Value('i', 0), None)
+    )
+
+    try:
+        with PeakRSS() as rss:
+            stats = embed.run_embed_n_batches(
+                executor,
+                conn_pool,
+                url, schema, table,
+                primary_key, primary_key_type,
+                source_column, vector_column,
+                batch_size, math.ceil(rows / batch_size) + 1,
+                workers,
+                verbose
+            )
+    finally:
+        executor.shutdown(wait=True)
+
+    return {
+        "rows": stats['rows'],
+        "batches": stats['batches'],
+        "seconds": round(stats['seconds'], 3),
+        "rows_per_sec": round(stats['rows'] / stats['seconds'], 1) if stats['seconds'] > 0 else 0.0,
+        "p50_batch_seconds": round(percentile(stats['batch_seconds'], 50), 4),
+        "p95_batch_seconds": round(percentile(stats['batch_seconds'], 95), 4),
+        "peak_rss_bytes": rss.peak_total,
+        "peak_worker_rss_bytes": rss.peak_worker,
+        "retries": stats['retries'],
+        "errors": stats['errors']
+    }
+
+
+
+def print_results(results: list[dict]):
+    report = Table(title="Embed benchmark", show_lines=False)
+    report.add_column("Model")
+    report.add_column("Batch", justify="right")
+    report.add_column("Workers", justify="right")
+    report.add_column("Rows/sec", justify="right")
+    report.add_column("p95 batch (s)", justify="right")
+    report.add_column("Peak RSS (MiB)", justify="right")
+    report.add_column("Retries", justify="right")
+    report.add_column("Errors", justify="right")
+
+    for r in results:
+        report.add_row(
+            r['model'],
+            str(r['batch_size']),
+            str(r['workers']),
+            f"{r['rows_per_sec']:.1f}",
+            f"{r['p95_batch_seconds']:.3f}",
+            f"{r['peak_rss_bytes'] / 2**20:.0f}",
+            str(r['retries']),
+            str(r['errors'])
+        )
+
+    Console().print(report)
+
+
+
+def run_bench_embed(args: dict):
+    for name in args['models']:
+        if not is_valid_model(name):
+            raise RuntimeError(f"Invalid embedding model {name}")
+
+    schema_name, table_name = args['schema'], args['table']
+    full_table_name = table_name
+    if schema_name is not None:
+        full_table_name = f"{schema_name}.{table_name}"
+
+    conn_pool = SimpleConnectionPool(minconn=0, maxconn=max(2, max(args['workers'])), **build_conn_kwargs(args['url']))
+    atexit.register(conn_pool.closeall)
+
+    if args['reuse']:
+        if not is_bench_table(conn_pool, full_table_name):
+            raise RuntimeError(f"Table {full_table_name} was not seeded by the benchmark. Run without --reuse first.")
+        dataset = {"rows": args['rows'], "reused": True}
+    else:
+        dataset = seed_table(
+            conn_pool, full_table_name,
+            args['rows'],
+            args['distribution'], args['min_chars'], args['max_chars'],
+            args['seed'],
+            args['verbose']
+        )
+
+    primary_key, primary_key_type = get_primary_key_column(conn_pool, schema_name, table_name)
+
+    conn = main_get_conn(conn_pool)
+    with conn.cursor() as cur:
+        cur.execute("SELECT version()")
+        cluster_version = cur.fetchone()[0]
+        cur.execute(f"SELECT count(*) FROM {full_table_name}")
+        dataset['rows'] = cur.fetchone()[0]
+    conn_pool.putconn(conn)
+
+    try:
+        package_version = version(__package__.split('.')[0])
+    except PackageNotFoundError:
+        package_version = None
+
+    report = {
+        "version": package_version,
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "cluster": cluster_version,
+        "dataset": dataset,
+        "results": []
+    }
+
+    for name in args['models']:
+        vector_column = f"vec_{name}"
+
+        # One vector column per model, instrumented like a real table
+        run_instrument({
+            "url": args['url'],
+            "schema": schema_name,
+            "table": table_name,
+            "source": "body",
+            "embedding": vector_column,
+            "model": name,
+            "chunked": False,
+            "storage": "column",
+            "migrate_family": False,
+            "defer_index": False,
+            "track_changes": False,
+            "queue": False,
+            "trigger_strategy": None,
+            "hash_buckets": None,
+            "verbose": args['verbose']
+        })
+
+        # The forked workers inherit the model loaded here
+        embed.model = importlib.import_module(f"{__package__.split('.')[0]}.models.{name}")
+
+        for batch_size in args['batch_sizes']:
+            for workers in args['workers']:
+                for repeat in range(1, args['repeat'] + 1):
+                    reset_vector_column(conn_pool, full_table_name, vector_column)
+
+                    print(f"[INFO] model={name} batch_size={batch_size} workers={workers} run={repeat}")
+                    result = bench_embed_once(
+                        args['url'],
+                        conn_pool,
+                        schema_name, table_name,
+                        primary_key, primary_key_type,
+                        "body", vector_column,
+                        dataset['rows'],
+                        batch_size,
+                        workers,
+                        args['verbose']
+                    )
+
+                    report['results'].append(dict(
+                        model=name,
+                        batch_size=batch_size,
+                        workers=workers,
+                        run=repeat,
+                        **result
+                    ))
+
+                    # Written after every run, so an interrupted matrix
+                    # still leaves usable results behind
+                    with open(args['output'], "w") as f:
+                        json.dump(report, f, indent=2)
+
+    print_results(report['results'])
+    print(f"[INFO] Results written to {args['output']}")
+
+    if not args['keep'] and not args['reuse']:
+        conn = main_get_conn(conn_pool)
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {full_table_name} CASCADE")
+        conn_pool.putconn(conn)
+
+    return None
+
+
+
+# bench trigger: the update trigger variants, against no trigger at all
+TRIGGER_VARIANTS = ("none", "neq", "distinct")
+
+# The single-row updates timed: one that changes the input (without
+# changing its length), one that leaves it alone
+TRIGGER_WORKLOADS = {
+    "input": "UPDATE {table} SET body = reverse(body) WHERE id = %s",
+    "other": "UPDATE {table} SET touched = touched + 1 WHERE id = %s"
+}
+
+
+def bench_updates(pool, statement: str, ids: list, warmup: int) -> dict:
+    """Runs the statement once per id, one at a time, and times each
+    execution. The first warmup ones aren't counted.
+    """
+    latencies = []
+
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        for i, row_id in enumerate(ids):
+            start = time.perf_counter()
+            cur.execute(statement, (row_id,))
+            if i >= warmup:
+                latencies.append(time.perf_counter() - start)
+    pool.putconn(conn)
+
+    seconds = sum(latencies)
+
+    return {
+        "updates": len(latencies),
+        "updates_per_sec": round(len(latencies) / seconds, 1) if seconds > 0 else 0.0,
+        "mean_ms": round(1000 * seconds / len(latencies), 3) if latencies else 0.0,
+        "p50_ms": round(1000 * percentile(latencies, 50), 3),
+        "p95_ms": round(1000 * percentile(latencies, 95), 3),
+        "p99_ms": round(1000 * percentile(latencies, 99), 3)
+    }
+
+
+
+def print_trigger_results(results: list[dict]):
+    report = Table(title="Update trigger benchmark", show_lines=False)
+    report.add_column("Trigger")
+    report.add_column("Update")
+    report.add_column("Updates/sec", justify="right")
+    report.add_column("p50 (ms)", justify="right")
+    report.add_column("p95 (ms)", justify="right")
+    report.add_column("p99 (ms)", justify="right")
+    report.add_column("Overhead", justify="right")
+
+    for r in results:
+        report.add_row(
+            r['trigger'],
+            r['workload'],
+            f"{r['updates_per_sec']:.1f}",
+            f"{r['p50_ms']:.3f}",
+            f"{r['p95_ms']:.3f}",
+            f"{r['p99_ms']:.3f}",
+            f"{r['overhead']:+.1%}" if r['overhead'] is not None else ""
+        )
+
+    Console().print(report)
+
+
+
+def run_bench_trigger(args: dict):
+    if not is_valid_model(args['model']):
+        raise RuntimeError(f"Invalid embedding model {args['model']}")
+
+    schema_name, table_name = args['schema'], args['table']
+    full_table_name = table_name
+    if schema_name is not None:
+        full_table_name = f"{schema_name}.{table_name}"
+
+    conn_pool = SimpleConnectionPool(minconn=0, maxconn=2, **build_conn_kwargs(args['url']))
+    atexit.register(conn_pool.closeall)
+
+    if args['reuse']:
+        if not is_bench_table(conn_pool, full_table_name):
+            raise RuntimeError(f"Table {full_table_name} was not seeded by the benchmark. Run without --reuse first.")
+        dataset = {"reused": True}
+    else:
+        dataset = seed_table(
+            conn_pool, full_table_name,
+            args['rows'],
+            args['distribution'], args['min_chars'], args['max_chars'],
+            args['seed'],
+            args['verbose']
+        )
+
+    primary_key, _ = get_primary_key_column(conn_pool, schema_name, table_name)
+
+    conn = main_get_conn(conn_pool)
+    with conn.cursor() as cur:
+        # The column the "other" updates write
+        cur.execute(f"ALTER TABLE {full_table_name} ADD COLUMN IF NOT EXISTS touched INT8 NOT NULL DEFAULT 0")
+        cur.execute("SELECT version()")
+        cluster_version = cur.fetchone()[0]
+        cur.execute(f"SELECT count(*) FROM {full_table_name}")
+        dataset['rows'] = cur.fetchone()[0]
+    conn_pool.putconn(conn)
+
+    if not dataset['rows']:
+        raise RuntimeError(f"Table {full_table_name} is empty")
+
+    # The vector column the trigger resets, as instrumented
+    vector_column = f"vec_{args['model']}"
+    run_instrument({
+        "url": args['url'],
+        "schema": schema_name,
+        "table": table_name,
+        "source": "body",
+        "embedding": vector_column,
+        "model": args['model'],
+        "chunked": False,
+        "storage": "column",
+        "migrate_family": False,
+        "defer_index": False,
+        "track_changes": False,
+        "queue": False,
+        "trigger_strategy": None,
+        "hash_buckets": None,
+        "verbose": args['verbose']
+    })
+    config = read_trigger_function(conn_pool, schema_name, table_name)
+
+    try:
+        package_version = version(__package__.split('.')[0])
+    except PackageNotFoundError:
+        package_version = None
+
+    report = {
+        "version": package_version,
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cluster": cluster_version,
+        "dataset": dataset,
+        "results": []
+    }
+
+    rng = random.Random(args['seed'])
+    warmup = min(100, args['updates'] // 10)
+
+    for repeat in range(1, args['repeat'] + 1):
+        for variant in args['triggers']:
+            if variant == "none":
+                install_trigger(conn_pool, update_trigger_sql([], schema_name, table_name, primary_key, drop=True))
+            else:
+                config = set_trigger_strategy(config, variant)
+                install_trigger(conn_pool, update_trigger_sql(config, schema_name, table_name, primary_key))
+
+            for workload, statement in TRIGGER_WORKLOADS.items():
+                ids = [rng.randint(1, dataset['rows']) for _ in range(args['updates'] + warmup)]
+
+                print(f"[INFO] trigger={variant} update={workload} run={repeat}")
+                result = bench_updates(conn_pool, statement.format(table=full_table_name), ids, warmup)
+
+                report['results'].append(dict(
+                    trigger=variant,
+                    workload=workload,
+                    run=repeat,
+                    **result
+                ))
+
+                with open(args['output'], "w") as f:
+                    json.dump(report, f, indent=2)
+
+    # The p50 latency over the one with no trigger, same update and run
+    baseline = {(r['workload'], r['run']): r['p50_ms'] for r in report['results'] if r['trigger'] == "none"}
+    for r in report['results']:
+        base = baseline.get((r['workload'], r['run']))
+        r['overhead'] = r['p50_ms'] / base - 1 if base and r['trigger'] != "none" else None
+
+    with open(args['output'], "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_trigger_results(report['results'])
+    print(f"[INFO] Results written to {args['output']}")
+
+    if not args['keep'] and not args['reuse']:
+        # The trigger function outlives the table
+        install_trigger(conn_pool, update_trigger_sql([], schema_name, table_name, primary_key, drop=True))
+
+        conn = main_get_conn(conn_pool)
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {full_table_name} CASCADE")
+        conn_pool.putconn(conn)
+
+    return None
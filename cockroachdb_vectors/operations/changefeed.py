@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import random
+import psycopg
+import psycopg2
+from concurrent.futures import ProcessPoolExecutor
+from psycopg2.pool import SimpleConnectionPool
+from .common import build_conn_kwargs, main_get_conn, healthy_get_conn, write_json_atomic, get_column_families
+from . import metrics
+
+
+def read_checkpoint(path: str | None) -> str | None:
+    if not path or not os.path.exists(path):
+        return None
+
+    with open(path, "r") as f:
+        checkpoint = json.load(f)
+
+    return checkpoint.get('resolved')
+
+
+
+def write_checkpoint(path: str | None, resolved: str):
+    if not path:
+        return
+
+    write_json_atomic(path, {'resolved': resolved})
+
+
+
+def cluster_timestamp(pool) -> str:
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        cur.execute("SELECT cluster_logical_timestamp()")
+        ts = cur.fetchone()[0]
+    pool.putconn(conn)
+
+    return str(ts)
+
+
+
+def filter_null_vector_ids(pool, schema_name, table_name, output_column, primary_key, primary_key_type, ids, quarantine=None) -> list:
+    """Keeps only the rows that still need an embedding.
+
+    Change events describe the row as of the event time. Replayed events
+    (after a restart from a checkpoint) and rows embedded by another process
+    are no longer NULL and are dropped here, before they reach the model.
+    """
+    if not ids:
+        return []
+
+    if schema_name is not None:
+        table_name = f"{schema_name}.{table_name}"
+
+    conn = healthy_get_conn(pool)
+    with conn.cursor() as cur:
+        placeholders = ','.join([f'%s::{primary_key_type}'] * len(ids))
+        cur.execute(
+            f'''
+                SELECT {primary_key}
+                FROM {table_name}
+                WHERE {primary_key} IN ({placeholders})
+                    AND {output_column} IS NULL
+                    {"AND " + quarantine.exclude_sql(table_name) if quarantine is not None else ""}
+            ''', ids)
+        ids = [row[0] for row in cur.fetchall()]
+    pool.putconn(conn)
+
+    return ids
+
+
+
+def source_family(pool, schema_name, table_name, source_column) -> str | None:
+    """The column family of source_column, None if the table only has its
+    default family.
+
+    A changefeed on a table with several families has to name the one it
+    follows. Following the input's family also leaves out the vector's,
+    when it has its own: the embeddings written don't come back as events.
+    """
+    for family, columns in get_column_families(pool, schema_name, table_name).items():
+        if source_column in columns:
+            return family
+
+    return None
+
+
+
+def changefeed_statement(table_name: str, cursor: str, resolved: int, family: str | None = None) -> str:
+    target = f'TABLE {table_name} FAMILY "{family}"' if family is not None else table_name
+
+    return f"""
+        EXPERIMENTAL CHANGEFEED FOR {target}
+        WITH
+            resolved = '{resolved}s',
+            min_checkpoint_frequency = '{resolved}s',
+            cursor = '{cursor}'
+    """
+
+
+
+def needs_embedding(after: dict | None, vector_column: str) -> bool:
+    """True if a change event may leave the row without its vector.
+
+    after has the columns of the family followed: without the vector when
+    it's in a family of its own, or in a side table, any insert or update
+    of the input's family is a candidate, checked by filter_null_vector_ids.
+    With the vector in the same family, our own writes come back with it
+    set, and are skipped.
+    """
+    return after is not None and after.get(vector_column) is None
+
+
+
+def changefeed_events(
+    url: str, schema: str | None, table: str,
+    cursor: str,
+    resolved: int,
+    family: str | None = None
+):
+    """Yields ('row', key, after) and ('resolved', timestamp, None) events
+    from a sinkless changefeed on the table, or on one of its families.
+    """
+    table_name = table if schema is None else f"{schema}.{table}"
+
+    stmt = changefeed_statement(table_name, cursor, resolved, family)
+
+    with psycopg.connect(**build_conn_kwargs(url), autocommit=True) as conn:
+        with conn.cursor() as cur:
+            for _, key, value in cur.stream(stmt):
+                message = json.loads(value)
+
+                if key is None:
+                    yield 'resolved', message['resolved'], None
+                else:
+                    yield 'row', json.loads(key), message.get('after')
+
+
+
+# This is called when --follow --changefeed options are in effect
+def run_embed_changefeed(
+    executor: ProcessPoolExecutor,
+    conn_pool: SimpleConnectionPool,
+    url: str, schema: str | None, table: str,
+    primary_key: str, primary_key_type: str,
+    source_column: str, vector_column: str,
+    batch_size,
+    workers: int,
+    max_idle: int,
+    checkpoint: str | None,
+    resolved: int,
+    verbose: bool = False,
+    controller = None
+):
+    from .embed import fetch_null_vector_ids, process_single_batch
+    from . import embed
+
+    batch_counter = 1
+
+    def _embed(ids) -> int:
+        nonlocal batch_counter
+
+        ids = filter_null_vector_ids(
+            conn_pool, schema, embed._VECTOR_TABLE or table, vector_column,
+            primary_key, primary_key_type, ids,
+            embed._QUARANTINE
+        )
+        if not ids:
+            return 0
+
+        update_count, worker_errors, worker_warnings = process_single_batch(
+            executor,
+            conn_pool,
+            url, schema, table,
+            primary_key, primary_key_type,
+            source_column, vector_column,
+            ids,
+            workers,
+            batch_counter,
+            verbose,
+            False,
+            False,
+            controller=controller
+        )
+
+        for msg in worker_warnings + worker_errors:
+            print(msg, flush=True)
+
+        batch_counter += 1
+
+        return update_count
+
+
+    def _embed_backlog():
+        nonlocal batch_size
+
+        while True:
+            if controller is not None:
+                batch_size = controller.batch_size
+            ids = fetch_null_vector_ids(conn_pool, schema, table, vector_column, primary_key, batch_size)
+            if not ids:
+                return
+
+            # Rows the model keeps failing on come back with every scan:
+            # stop at a pass that writes nothing. They stay NULL until their
+            # input changes.
+            if _embed(ids) == 0:
+                print(f"[WARN] None of the next {len(ids)} backlog rows written. Following the changes.", flush=True)
+                return
+
+
+    family = source_family(conn_pool, schema, table, source_column)
+    if verbose and family is not None:
+        print(f"[INFO] Following the changes of column family {family} ({source_column})")
+
+    cursor = read_checkpoint(checkpoint)
+
+    if cursor is None:
+        # No checkpoint: catch up on the existing backlog with the partial
+        # index scan, then follow the changes made since we started.
+        cursor = cluster_timestamp(conn_pool)
+
+        if verbose:
+            print(f"[INFO] No checkpoint found. Embedding the backlog as of {cursor}...")
+
+        _embed_backlog()
+        write_checkpoint(checkpoint, cursor)
+
+    elif verbose:
+        print(f"[INFO] Resuming from checkpoint {cursor}")
+
+
+    max_idle_secs = max_idle * 60
+    last_work = time.time()
+
+    max_retries = 10
+    failures = 0
+
+    while True:
+        # Rows that need an embedding, in arrival order
+        pending = {}
+
+        try:
+            for kind, key, after in changefeed_events(url, schema, table, cursor, resolved, family):
+                if kind == 'row':
+                    row_id = key[0]
+                    if needs_embedding(after, vector_column):
+                        pending[row_id] = True
+                    else:
+                        # Deleted, or already embedded (e.g. our own UPDATE)
+                        pending.pop(row_id, None)
+
+                    if controller is not None:
+                        batch_size = controller.batch_size
+
+                    if len(pending) >= batch_size:
+                        _embed(list(pending))
+                        pending = {}
+                        last_work = time.time()
+
+                    continue
+
+                # Resolved: every change up to this timestamp has been seen
+                if pending:
+                    _embed(list(pending))
+                    pending = {}
+                    last_work = time.time()
+
+                cursor = key
+                write_checkpoint(checkpoint, cursor)
+                failures = 0
+
+                metrics.IDLE_SECONDS.set(
+                    round(time.time() - last_work),
+                    table = metrics.table_label(schema, table),
+                    column = vector_column
+                )
+                metrics.refresh_backlog(conn_pool, schema, table, primary_key, vector_column, scan_table=embed._VECTOR_TABLE)
+                metrics.sample_rss()
+
+                if time.time() - last_work >= max_idle_secs:
+                    if verbose:
+                        print(f"[INFO] Max idle reached ({max_idle} minutes). Exiting.")
+                    return
+
+        except (psycopg.Error, psycopg2.Error) as e:
+            # psycopg: the changefeed. psycopg2: the writes, from _embed().
+            failures += 1
+            if failures > max_retries:
+                raise
+
+            msg = str(e)
+            print(f"[WARN] Retry {failures}/{max_retries}: changefeed interrupted: {msg}", flush=True)
+
+            if "rangefeed" in msg:
+                print("[WARN] Rangefeeds must be enabled: SET CLUSTER SETTING kv.rangefeed.enabled = true", flush=True)
+
+            if "GC threshold" in msg:
+                # The checkpoint is older than the garbage collection window.
+                # Everything we missed is still NULL, so re-scan the backlog.
+                print("[WARN] Checkpoint has been garbage collected. Re-scanning the backlog...", flush=True)
+                cursor = cluster_timestamp(conn_pool)
+                _embed_backlog()
+                write_checkpoint(checkpoint, cursor)
+
+            # Rows received since the last resolved timestamp are replayed
+            # when the changefeed restarts from the cursor.
+            time.sleep(0.5 * failures + random.uniform(0, 0.3))
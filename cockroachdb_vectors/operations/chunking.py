@@ -0,0 +1,100 @@
+import re
+import math
+
+
+# Used when the model plugin doesn't implement embedding_max_tokens()
+DEFAULT_MAX_TOKENS = 256
+DEFAULT_OVERLAP_TOKENS = 32
+
+_WORD_RE = re.compile(r"\S+")
+
+
+def chunk_table_name(table_name: str, output_column: str) -> str:
+    """The child table holding the per-chunk vectors of table.output_column.
+
+    The name is unqualified: it lives in the parent table's schema.
+    """
+    return f"{table_name}_{output_column}_chunks"
+
+
+
+def model_max_tokens(model) -> int:
+    """The model's input limit, from the optional embedding_max_tokens()
+    plugin function.
+    """
+    if hasattr(model, "embedding_max_tokens"):
+        return int(model.embedding_max_tokens())
+    return DEFAULT_MAX_TOKENS
+
+
+
+def _estimate_tokens(word: str) -> int:
+    # About 4 characters per token for English text with BPE/WordPiece
+    # tokenizers; punctuation and rare words count for more.
+    return max(1, math.ceil(len(word) / 4))
+
+
+
+def chunk_text(
+        text: str,
+        max_tokens: int,
+        overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+        count_tokens = None
+    ) -> list[tuple[int, int, str]]:
+    """Splits text into overlapping chunks of at most max_tokens tokens.
+
+    Chunks break between words. Token counts come from count_tokens (the
+    optional embedding_count_tokens() plugin function) if given, and are
+    estimated otherwise.
+
+    Returns:
+        (start, end, chunk) tuples, start and end being character offsets
+        into text. A text that fits yields a single chunk.
+    """
+    words = [(m.start(), m.end()) for m in _WORD_RE.finditer(text or "")]
+    if not words:
+        return [(0, len(text or ""), text or "")]
+
+    count = count_tokens or _estimate_tokens
+    tokens = [count(text[s:e]) for s, e in words]
+
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+
+    chunks = []
+    i = 0
+    while i < len(words):
+        # Grow the chunk up to the token budget (always at least one word)
+        j = i
+        size = 0
+        while j < len(words) and (j == i or size + tokens[j] <= max_tokens):
+            size += tokens[j]
+            j += 1
+
+        start, end = words[i][0], words[j - 1][1]
+        chunks.append((start, end, text[start:end]))
+
+        if j >= len(words):
+            break
+
+        # Step back over the overlap, but always move forward
+        k = j
+        back = 0
+        while k - 1 > i and back + tokens[k - 1] <= overlap_tokens:
+            k -= 1
+            back += tokens[k]
+        i = k
+
+    return chunks
+
+
+
+def mean_vector(vectors: list[list[float]]) -> list[float]:
+    """The normalized mean of the chunk vectors: the parent row's vector."""
+    dim = len(vectors[0])
+    mean = [sum(v[d] for v in vectors) / len(vectors) for d in range(dim)]
+
+    norm = math.sqrt(sum(x * x for x in mean))
+    if norm == 0.0:
+        return mean
+
+    return [x / norm for x in mean]
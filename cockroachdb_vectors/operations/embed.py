@@ -8,41 +8,179 @@ import textwrap
 import click
 from psycopg2.pool import SimpleConnectionPool
 from psycopg2.extras import execute_values
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 import multiprocessing
+import threading
 from datetime import datetime
+from decimal import Decimal
 import jinja2
+import pickle
+import bisect
 import importlib
 from .model import is_valid_model
 from .common import (
     build_conn_kwargs,
-    main_get_conn,
+    parse_gateways,
+    spread_gateways,
+    discover_gateways,
+    healthy_get_conn,
     get_primary_key_column,
-    get_column_type
+    get_column_type,
+    get_range_boundaries,
+    shard_column_name,
+    SpreadConnectionPool,
+    ThreadedSpreadConnectionPool
 )
-from .instrument import is_vector_column
-
+from .instrument import (
+    is_vector_column,
+    is_chunked,
+    vector_table_name,
+    vector_column_model,
+    change_column_name,
+    is_change_tracked,
+    queue_table_name,
+    is_queued,
+    vector_index_buckets
+)
+from .chunking import (
+    chunk_table_name,
+    chunk_text,
+    mean_vector,
+    model_max_tokens
+)
+from .changefeed import run_embed_changefeed
+from .adaptive import BatchSizeController
+from .quarantine import Quarantine
+from .spool import Spool, jsonable_key
+from .throttle import throttle_from_args
+from .shm import ResultRing, adapt_vector
+from . import metrics
+from . import profile
+
+
+# backfill calls process_single_batch() from several lane threads, all
+# sharing the settings below. model, _VECTOR_TABLE, _COLUMN_MODEL,
+# _QUEUE_TABLE, _CHUNKING and _MAX_INPUT_CHARS are set once before the lanes
+# start, and only read by them. _THROTTLE and _SPOOL lock their own state,
+# and _UPDATE_RETRIES is added to under _UPDATE_RETRIES_LOCK. The others
+# (--range-writes, --shm, --spec, ...) are not set by backfill, and are not
+# safe to share across lanes.
 
 _WORKER_POOL = None
 model = None
 
+# --range-writes: number of range groups written concurrently (0: off), and
+# the cached range boundaries per table
+_RANGE_WRITERS = 0
+_RANGE_BOUNDARIES = {}
+RANGE_BOUNDARIES_TTL = 60
+
+# --quarantine: rows the model keeps failing on, skipped by the NULL scans
+_QUARANTINE = None
+
+# Chunked output column (instrument --chunked): the chunk settings passed to
+# the workers, None otherwise
+_CHUNKING = None
+
+# --max-input-chars: the input is cut to this many characters by the fetch
+# query (None: fetched whole). --fetch-rows: rows per server-side cursor
+# fetch (0: the worker's rows are fetched at once)
+_MAX_INPUT_CHARS = None
+_FETCH_ROWS = 0
+
+# --spool: local log of the computed vectors, replayed when their write fails
+_SPOOL = None
+
+# Side table storage (instrument --storage side-table): the table the vectors
+# are scanned for and written to, None when they are in the source table
+_VECTOR_TABLE = None
+
+# --spec: the (input, output, model, dim) columns embedded together, from one
+# fetch of each row and with one UPDATE per batch; the first one is -i/-o/-m.
+# Empty with a single output column. The models are loaded by name before the
+# workers fork, and inherited by them.
+_SPECS = []
+_MODELS = {}
+
+# embed --all-instrumented: the model of the column being embedded, looked up
+# in _MODELS by the workers. None: the run's model.
+_MODEL_NAME = None
+
+# --throttle, --max-rows-per-sec: admits the batches, main process only
+_THROTTLE = None
+
+# instrument --track-changes: the column the trigger stamps with the time the
+# input changed. The changed rows are fetched first, oldest change first, and
+# the cold backlog fills the rest of the batch. None: primary key order only.
+_CHANGED_COLUMN = None
+
+# instrument --queue: the queue table the rows to embed are read from, in
+# the order they were queued, instead of the NULL scan. main process only.
+_QUEUE_TABLE = None
+
+# instrument --hash-buckets: the bucket count of the NULL index. The NULL
+# scan starts from a random bucket, so that the fetches spread over its
+# ranges instead of all reading the first one. main process only.
+_HASH_BUCKETS = 0
+
+# The model the output column was recorded with when the run started:
+# checked again before each write, since a migrate-model swap may put
+# another model's column under the name meanwhile. None: not checked.
+# main process only.
+_COLUMN_MODEL = None
+
+# --shm: the shared memory ring the workers write the vectors to, main
+# process only. The workers attach to it by name, once.
+_RESULT_RING = None
+_WORKER_RINGS = {}
+
+# Write attempts retried by process_single_batch() since the run started
+_UPDATE_RETRIES = 0
+_UPDATE_RETRIES_LOCK = threading.Lock()
+
 
-def worker_init(db_url):
+class ColumnModelChanged(RuntimeError):
+    """The output column is now recorded with another model."""
+
+
+
+def check_column_model(pool, schema_name, table_name, output_column):
+    """Raises ColumnModelChanged if output_column is no longer recorded
+    with _COLUMN_MODEL: the vectors of the batch must not be written.
+    """
+    if _COLUMN_MODEL is None:
+        return
+
+    recorded_model = vector_column_model(pool, schema_name, table_name, output_column)
+    if recorded_model is not None and recorded_model != _COLUMN_MODEL:
+        raise ColumnModelChanged(f"Column {output_column} is now embedded with {recorded_model}, not {_COLUMN_MODEL}")
+
+
+
+def worker_init(db_url, gateways=None, preferred=0, worker_seq=None, profile_settings=None):
     global _WORKER_POOL
+    profile.worker_enable(profile_settings)
+
     if _WORKER_POOL is None:
+        # Each worker starts on the next gateway, so that the reads are
+        # spread across the cluster instead of funneling through one node.
+        if gateways and worker_seq is not None:
+            with worker_seq.get_lock():
+                n = worker_seq.value
+                worker_seq.value += 1
+            gateways = spread_gateways(gateways, preferred, n)
+
         _WORKER_POOL = SimpleConnectionPool(
             minconn=1,
             maxconn=2,
-            **build_conn_kwargs(db_url)
+            **build_conn_kwargs(db_url, gateways)
         )
         atexit.register(_WORKER_POOL.closeall)
 
 
 def worker_get_conn(db_url):
     global _WORKER_POOL
-    conn = _WORKER_POOL.getconn()
-    conn.autocommit = True
-    return conn
+    return healthy_get_conn(_WORKER_POOL)
 
 
 def worker_put_conn(conn):
@@ -55,74 +193,382 @@ def fetch_null_vector_ids(pool, schema_name, table_name, output_column, primary_
     max_retries = 10
     ids = None
 
+    label = metrics.table_label(schema_name, table_name)
+
+    table_name = _VECTOR_TABLE or table_name
     if schema_name is not None:
         table_name = f"{schema_name}.{table_name}"
 
+    start = time.time()
+
     for attempt in range(1, max_retries + 1):
+        conn = None
         try:
-            conn = main_get_conn(pool)
-            with conn.cursor() as cur:
-                cur.execute(f"""
-                            SELECT {primary_key} FROM {table_name}
-                            WHERE {output_column} IS NULL
-                            LIMIT %s
-                            """,
-                            (limit,))
-                ids = [row[0] for row in cur.fetchall()]
+            conn = healthy_get_conn(pool, attempt > 1)
+            with conn.cursor() as cur, profile.span("fetch_ids") as span_args:
+                if _SPECS:
+                    # Rows with any output NULL: one scan of each column's
+                    # NULL index, rather than an OR no index covers
+                    scans = " UNION ".join(
+                        f"(SELECT {primary_key} FROM {table_name} WHERE {spec['output']} IS NULL LIMIT {int(limit)})"
+                        for spec in _SPECS
+                    )
+                    cur.execute(f"SELECT {primary_key} FROM ({scans}) AS n LIMIT %s", (limit,))
+                    ids = [row[0] for row in cur.fetchall()]
+                elif _QUEUE_TABLE is not None:
+                    queue_table = _QUEUE_TABLE
+                    if schema_name is not None:
+                        queue_table = f"{schema_name}.{queue_table}"
+
+                    cur.execute(f"""
+                                SELECT {primary_key}, extract(epoch FROM now() - queued_at)::FLOAT8
+                                FROM {queue_table}
+                                {"WHERE " + _QUARANTINE.exclude_sql(queue_table) if _QUARANTINE is not None else ""}
+                                ORDER BY queued_at
+                                LIMIT %s
+                                """,
+                                (limit,))
+                    rows = cur.fetchall()
+                    ids = [row[0] for row in rows]
+
+                    metrics.FRESHNESS_LAG_SECONDS.set(rows[0][1] if rows else 0.0, table=label, column=output_column)
+                else:
+                    exclude = "AND " + _QUARANTINE.exclude_sql(table_name) if _QUARANTINE is not None else ""
+
+                    ids = []
+                    if _CHANGED_COLUMN is not None:
+                        # The hot lane: rows whose input changed, oldest first
+                        cur.execute(f"""
+                                    SELECT {primary_key}, extract(epoch FROM now() - {_CHANGED_COLUMN})::FLOAT8
+                                    FROM {table_name}
+                                    WHERE {output_column} IS NULL AND {_CHANGED_COLUMN} IS NOT NULL
+                                    {exclude}
+                                    ORDER BY {_CHANGED_COLUMN}
+                                    LIMIT %s
+                                    """,
+                                    (limit,))
+                        rows = cur.fetchall()
+                        ids = [row[0] for row in rows]
+
+                        lag = rows[0][1] if rows else 0.0
+                        metrics.FRESHNESS_LAG_SECONDS.set(lag, table=label, column=output_column)
+                        if verbose and rows:
+                            print(f"[INFO] {len(rows)} changed rows, the oldest {lag:.1f} seconds ago")
+
+                    # The cold backlog, with the capacity left: from a random
+                    # bucket to the last one, then from the first one
+                    bucket_ranges = [""]
+                    if _HASH_BUCKETS > 0:
+                        shard = shard_column_name(primary_key, _HASH_BUCKETS)
+                        start_bucket = random.randrange(_HASH_BUCKETS)
+                        bucket_ranges = [f"AND {shard} >= {start_bucket}", f"AND {shard} < {start_bucket}"]
+
+                    hot = set(ids)
+                    for bucket_range in bucket_ranges:
+                        if len(ids) >= limit:
+                            break
+                        cur.execute(f"""
+                                    SELECT {primary_key} FROM {table_name}
+                                    WHERE {output_column} IS NULL
+                                    {bucket_range}
+                                    {exclude}
+                                    LIMIT %s
+                                    """,
+                                    (limit,))
+                        ids += [row[0] for row in cur.fetchall() if row[0] not in hot][:limit - len(ids)]
+                span_args['rows'] = len(ids)
 
             pool.putconn(conn)
+            break
 
         except Exception as e:
+            if conn is not None:
+                pool.putconn(conn, close=conn.closed != 0)
+
             if attempt < max_retries:
                 print(f"[WARN] Retry {attempt}/{max_retries} on fetch_null_vector_ids: {e}", flush=True)
                 time.sleep(0.5 * attempt + random.uniform(0, 0.3))
             else:
                 raise
 
+    metrics.STAGE_SECONDS.observe(time.time() - start, table=label, column=output_column, stage="fetch")
+
     return ids
 
 
 
+def encode_isolating(batch_index, batch, verbose=False, encoder=None, arrays=False) -> tuple[list, list]:
+    """Encodes the batch, bisecting it when the model fails on it.
+
+    One bad row (too long for the model, unexpected input, ...) only costs
+    the rows it shares a half with, down to the row itself.
+
+    encoder is the model plugin to use, the run's model by default. With
+    arrays, its optional embedding_encode_batch_array() is used if it has
+    one, and the embeddings are rows of the NumPy array it returns.
+
+    Returns:
+        The [row_id, embedding] pairs, and the (row_id, error) pairs of the
+        rows the model failed on.
+    """
+    encoder = encoder or model
+    try:
+        if arrays and hasattr(encoder, "embedding_encode_batch_array"):
+            embeddings = encoder.embedding_encode_batch_array(batch_index, batch, verbose)
+            return [[row[0], embedding] for row, embedding in zip(batch, embeddings)], []
+        return encoder.embedding_encode_batch(batch_index, batch, verbose), []
+    except Exception as e:
+        if len(batch) == 1:
+            return [], [(batch[0][0], f"{type(e).__name__}: {e}")]
+
+    mid = len(batch) // 2
+    left_values, left_failed = encode_isolating(batch_index, batch[:mid], verbose, encoder, arrays)
+    right_values, right_failed = encode_isolating(batch_index, batch[mid:], verbose, encoder, arrays)
+
+    return left_values + right_values, left_failed + right_failed
+
+
+
+def encode_chunked(batch_index, batch, chunking, verbose=False) -> tuple[list, list, list]:
+    """Splits the rows into chunks and encodes the chunks of the whole batch
+    in one model call.
+
+    A row's vector is the normalized mean of its chunk vectors. A row fails
+    if any of its chunks does.
+
+    Returns:
+        The [row_id, embedding] pairs, the (row_id, error) pairs of the rows
+        the model failed on, and the (row_id, chunk_no, start, end, embedding)
+        chunks of the other rows.
+    """
+    count_tokens = getattr(model, "embedding_count_tokens", None)
+
+    owners = []
+    flat = []
+    for row_id, row_text in batch:
+        for chunk_no, (start, end, chunk) in enumerate(
+                chunk_text(row_text, chunking['max_tokens'], chunking['overlap_tokens'], count_tokens)):
+            owners.append((row_id, chunk_no, start, end))
+            flat.append((len(flat), chunk))
+
+    if verbose and len(flat) > len(batch):
+        print(f"[INFO] (batch {batch_index}) Encoding {len(batch)} rows as {len(flat)} chunks")
+
+    chunk_values, chunk_failed = encode_isolating(batch_index, flat, verbose)
+
+    failed = {}
+    for k, error in chunk_failed:
+        failed.setdefault(owners[k][0], error)
+
+    vectors = {}
+    chunks = []
+    for k, embedding in chunk_values:
+        row_id, chunk_no, start, end = owners[k]
+        if row_id in failed:
+            continue
+        vectors.setdefault(row_id, []).append(embedding)
+        chunks.append((row_id, chunk_no, start, end, embedding))
+
+    values = [[row_id, mean_vector(v)] for row_id, v in vectors.items()]
+
+    return values, list(failed.items()), chunks
+
+
+
+def encode_specs(batch_index, rows, specs, inputs, verbose=False) -> tuple[list, list]:
+    """Encodes the rows once per (input, output, model) spec, with the spec's
+    model, for the rows whose output is NULL.
+
+    rows are (row_id, *inputs, *output IS NULL flags), one flag per spec.
+
+    Returns:
+        The [row_id, embedding, ...] rows, one embedding per spec (None where
+        the output was not NULL, or the model failed), and the (row_id, error)
+        pairs of the rows a model failed on.
+    """
+    vectors = {}
+    failed = []
+
+    for k, (input_column, output_column, model_name) in enumerate(specs):
+        text_at = 1 + inputs.index(input_column)
+        todo = [(row[0], row[text_at]) for row in rows if row[1 + len(inputs) + k]]
+        if not todo:
+            continue
+
+        values, spec_failed = encode_isolating(batch_index, todo, verbose, _MODELS[model_name])
+        for row_id, embedding in values:
+            vectors.setdefault(row_id, [None] * len(specs))[k] = embedding
+        failed.extend((row_id, f"{output_column}: {error}") for row_id, error in spec_failed)
+
+    return [[row_id] + embeddings for row_id, embeddings in vectors.items()], failed
+
+
+
+def input_char_limit(pool, schema_name, table_name, input_column, requested=None) -> int | None:
+    """How many characters of the input column to fetch: requested if set
+    (0: all of them), otherwise the model's optional embedding_max_input_chars()
+    hint. Only text columns are cut.
+    """
+    limit = requested
+    if limit is None and hasattr(model, "embedding_max_input_chars"):
+        limit = model.embedding_max_input_chars()
+
+    if not limit:
+        return None
+
+    column_type = get_column_type(pool, schema_name, table_name, input_column) or ""
+    if not column_type.startswith(("text", "character")):
+        return None
+
+    return int(limit)
+
+
+
 def batch_embed(
                 db_url,
                 schema_name, table_name,
                 input_column,
                 primary_key, ids,
-                dry_run, verbose, batch_index=0
+                dry_run, verbose, batch_index=0,
+                chunking=None,
+                max_input_chars=None,
+                fetch_rows=0,
+                specs=None,
+                model_name=None,
+                ring=None
                 ):
 
+    # The workers serve all the columns of embed --all-instrumented
+    global model
+    if model_name is not None:
+        model = _MODELS[model_name]
+
     if schema_name is not None:
         table_name = f"{schema_name}.{table_name}"
     
     if not ids:
-        return None
+        return [], [], [], None
+
+    # Don't ship what the model would throw away anyway
+    select_column = input_column
+    if max_input_chars:
+        select_column = f"substring({input_column}, 1, {int(max_input_chars)}) AS {input_column}"
+
+    # --spec: each input once, and which outputs need a vector
+    if specs:
+        inputs = list(dict.fromkeys(input_column for input_column, _, _ in specs))
+        select_column = ", ".join(inputs + [f"{output_column} IS NULL" for _, output_column, _ in specs])
+
+    placeholders = ','.join(['%s'] * len(ids))
+    query = f'''
+        SELECT {primary_key}, {select_column}
+        FROM {table_name}
+        WHERE {primary_key} IN ({placeholders})
+    '''
+
+    values, failed, chunks = [], [], []
+    fetched = 0
+
+    # The cluster's timestamp of the read, taken in its transaction: the
+    # spool replay and the dequeue skip the rows changed since
+    read_at = None
+
+    def _encode(batch):
+        nonlocal fetched
+
+        if verbose:
+            for i, row in enumerate(batch, fetched + 1):
+                input_column_text = (row[1] or "")[:40].replace('\n', '').replace('\r', '')
+                print(f"[INFO] (batch {batch_index}, {i}/{len(ids)}) Updating vector {row[0]}: '{input_column_text}'")
+        fetched += len(batch)
+
+        with profile.span("encode", batch=batch_index, rows=len(batch)) as span_args:
+            if specs:
+                batch_values, batch_failed = encode_specs(batch_index, batch, specs, inputs, verbose)
+            elif chunking is not None:
+                batch_values, batch_failed, batch_chunks = encode_chunked(batch_index, batch, chunking, verbose)
+                span_args['chunks'] = len(batch_chunks)
+                chunks.extend(batch_chunks)
+            else:
+                batch_values, batch_failed = encode_isolating(batch_index, batch, verbose, arrays=ring is not None)
+            if batch_failed:
+                span_args['failed'] = len(batch_failed)
 
-    batch = None
-
-    conn = worker_get_conn(db_url)
-    with conn.cursor() as cur:
-        placeholders = ','.join(['%s'] * len(ids))
-        cur.execute(
-            f'''
-                SELECT {primary_key}, {input_column}
-                FROM {table_name}
-                WHERE {primary_key} IN ({placeholders})
-            ''', ids)
-        batch = cur.fetchall()
-    
-    worker_put_conn(conn)
+        values.extend(batch_values)
+        failed.extend(batch_failed)
 
-    if not batch:
-        return None
 
-    if verbose:
-        for i, (row_id, row_text) in enumerate(batch, 1):
-            input_column_text = row_text[:40].replace('\n', '').replace('\r', '')
-            print(f"[INFO] (batch {batch_index}, {i}/{len(batch)}) Updating vector {row_id}: '{input_column_text}'")
+    with profile.worker_cprofile():
+        conn = worker_get_conn(db_url)
+
+        if fetch_rows > 0:
+            # Server-side cursor: only fetch_rows rows are held in memory at
+            # a time, each piece being encoded before the next one is read.
+            conn.autocommit = False
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT cluster_logical_timestamp()")
+                    read_at = cur.fetchone()[0]
+                with conn.cursor(name=f"batch_embed_{batch_index}_{os.getpid()}") as cur:
+                    cur.itersize = fetch_rows
+                    cur.execute(query, ids)
+                    while True:
+                        with profile.span("fetch_rows", batch=batch_index, rows=fetch_rows):
+                            batch = cur.fetchmany(fetch_rows)
+                        if not batch:
+                            break
+                        _encode(batch)
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                if not conn.closed:
+                    conn.autocommit = True
 
+            worker_put_conn(conn)
 
-    values = model.embedding_encode_batch(batch_index, batch, verbose)
-    return values
+        else:
+            with profile.span("fetch_rows", batch=batch_index, rows=len(ids)):
+                conn.autocommit = False
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT cluster_logical_timestamp()")
+                        read_at = cur.fetchone()[0]
+                        cur.execute(query, ids)
+                        batch = cur.fetchall()
+                    conn.commit()
+                except Exception:
+                    if not conn.closed:
+                        conn.rollback()
+                    raise
+                finally:
+                    if not conn.closed:
+                        conn.autocommit = True
+
+            worker_put_conn(conn)
+
+            if batch:
+                _encode(batch)
+
+    # --shm: the vectors go to the rows reserved for the chunk, only their
+    # row IDs back through the pipe
+    if ring is not None:
+        name, rows, dim, offset = ring
+        if name not in _WORKER_RINGS:
+            _WORKER_RINGS[name] = ResultRing(rows, dim, name)
+        _WORKER_RINGS[name].write(offset, [embedding for _, embedding in values])
+        values = [row_id for row_id, _ in values]
+
+    # The results are pickled again on their way back to the main process:
+    # measure what that costs for this chunk.
+    if profile.enabled():
+        with profile.span("pickle", batch=batch_index, rows=len(values)) as span_args:
+            span_args['bytes'] = len(pickle.dumps(values)) + len(pickle.dumps(chunks))
+        profile.worker_flush()
+
+    return values, failed, chunks, read_at
     
 
 
@@ -139,24 +585,54 @@ def batch_update(
     warnings = []
     errors = []
 
-    conn = main_get_conn(pool)
+    conn = None
 
     if not dry_run:
         max_retries = 10
         for attempt in range(1, max_retries + 1):
             try:
+                if conn is None:
+                    conn = healthy_get_conn(pool, attempt > 1)
+
                 with conn.cursor() as cur:
-                    sql = f'''
-                        UPDATE {table_name} AS t
-                        SET {output_column} = v.embedding
-                        FROM (VALUES %s) AS v({primary_key}, embedding)
-                        WHERE t.{primary_key} = v.{primary_key}::{primary_key_type}
-                    '''
-                    execute_values(cur, sql, values, template="(%s, %s)")
+                    if _SPECS:
+                        # All the output columns in one write; a column keeps
+                        # its value in the rows it had no new vector for
+                        set_clause = ", ".join(
+                            f"{spec['output']} = COALESCE(v.e{k}::VECTOR({spec['dim']}), t.{spec['output']})"
+                            for k, spec in enumerate(_SPECS)
+                        )
+                        sql = f'''
+                            UPDATE {table_name} AS t
+                            SET {set_clause}
+                            FROM (VALUES %s) AS v({primary_key}, {", ".join(f"e{k}" for k in range(len(_SPECS)))})
+                            WHERE t.{primary_key} = v.{primary_key}::{primary_key_type}
+                        '''
+                        execute_values(cur, sql, values, template=f"({', '.join(['%s'] * (len(_SPECS) + 1))})")
+                    else:
+                        sql = f'''
+                            UPDATE {table_name} AS t
+                            SET {output_column} = v.embedding
+                            FROM (VALUES %s) AS v({primary_key}, embedding)
+                            WHERE t.{primary_key} = v.{primary_key}::{primary_key_type}
+                        '''
+                        execute_values(
+                            cur, sql,
+                            [(row_id, adapt_vector(embedding)) for row_id, embedding in values],
+                            template="(%s, %s)"
+                        )
                 conn.commit()
                 break
             except Exception as e:
-                conn.rollback()
+                # A drained or restarted gateway leaves us with a dead
+                # connection: drop it and reconnect on the next attempt.
+                if conn is not None:
+                    if conn.closed:
+                        pool.putconn(conn, close=True)
+                        conn = None
+                    else:
+                        conn.rollback()
+
                 timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 if attempt < max_retries:
                     warnings.append(f"[{timestamp}] [WARN] (batch {batch_index}) Retry {attempt}/{max_retries} after failure: {e}")
@@ -164,8 +640,355 @@ def batch_update(
                 else:
                     errors.append(f"[{timestamp}] [ERROR] Failed after {max_retries} retries: {e}")
 
-    pool.putconn(conn)
-    return len(values), errors, warnings
+    if conn is not None:
+        pool.putconn(conn)
+
+    # Rows written: none if the batch failed. One warning per retry.
+    return (0 if errors else len(values)), errors, warnings
+
+
+
+def batch_update_chunks(
+                pool, schema_name, table_name, output_column,
+                primary_key, primary_key_type,
+                values, chunks,
+                dry_run, verbose, batch_index=0
+                ):
+    """Replaces the chunks of the rows in values, in one transaction, before
+    their parent vector is written: the parent is never newer than its chunks.
+
+    Rows whose text got shorter lose their extra chunks, hence the delete.
+    """
+    chunk_table = chunk_table_name(table_name, output_column)
+    if schema_name is not None:
+        chunk_table = f"{schema_name}.{chunk_table}"
+
+    warnings = []
+    errors = []
+
+    if dry_run or not values:
+        return errors, warnings
+
+    conn = None
+    ids = [row_id for row_id, _ in values]
+
+    max_retries = 10
+    for attempt in range(1, max_retries + 1):
+        try:
+            if conn is None:
+                conn = healthy_get_conn(pool, attempt > 1)
+
+            with conn.cursor() as cur:
+                placeholders = ','.join(['%s'] * len(ids))
+                cur.execute(
+                    f'''
+                        DELETE FROM {chunk_table}
+                        WHERE {primary_key} IN ({placeholders})
+                    ''', ids)
+
+                sql = f'''
+                    INSERT INTO {chunk_table} ({primary_key}, chunk_no, chunk_start, chunk_end, embedding)
+                    VALUES %s
+                '''
+                execute_values(cur, sql, chunks, template=f"(%s::{primary_key_type}, %s, %s, %s, %s)")
+            conn.commit()
+            break
+        except Exception as e:
+            if conn is not None:
+                if conn.closed:
+                    pool.putconn(conn, close=True)
+                    conn = None
+                else:
+                    conn.rollback()
+
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            if attempt < max_retries:
+                warnings.append(f"[{timestamp}] [WARN] (batch {batch_index}) Retry {attempt}/{max_retries} on chunks after failure: {e}")
+                time.sleep(0.5 * attempt + random.uniform(0, 0.3))
+            else:
+                errors.append(f"[{timestamp}] [ERROR] Failed to write chunks after {max_retries} retries: {e}")
+
+    if conn is not None:
+        pool.putconn(conn)
+
+    return errors, warnings
+
+
+
+def write_spooled(pool, entry: dict, verbose=False) -> tuple[set, list, list]:
+    """Writes a batch from the spool, with its chunks, in one transaction.
+
+    Only the rows still NULL and not changed since they were read are
+    written: the others have a newer vector, or an input the spooled vector
+    is not for.
+
+    Returns:
+        The keys of the rows written, the errors, and the warnings.
+    """
+    table_name = entry['table']
+    chunk_table = chunk_table_name(table_name, entry['column'])
+    if entry['schema'] is not None:
+        table_name = f"{entry['schema']}.{table_name}"
+        chunk_table = f"{entry['schema']}.{chunk_table}"
+
+    primary_key, primary_key_type = entry['primary_key'], entry['primary_key_type']
+
+    changed_since = ""
+    if isinstance(entry['read_at'], str):
+        # The cluster timestamp of the read, as spooled
+        changed_since = f"AND t.crdb_internal_mvcc_timestamp < {Decimal(entry['read_at'])}"
+    elif entry['read_at'] is not None:
+        # Spooled by an older version, from the client's clock in seconds:
+        # MVCC timestamps are in nanoseconds
+        changed_since = f"AND t.crdb_internal_mvcc_timestamp < {int(entry['read_at'] * 1e9)}"
+
+    warnings = []
+    errors = []
+    written = set()
+
+    conn = None
+
+    max_retries = 10
+    for attempt in range(1, max_retries + 1):
+        try:
+            if conn is None:
+                conn = healthy_get_conn(pool, attempt > 1)
+
+            with conn.cursor() as cur:
+                sql = f'''
+                    UPDATE {table_name} AS t
+                    SET {entry['column']} = v.embedding
+                    FROM (VALUES %s) AS v({primary_key}, embedding)
+                    WHERE t.{primary_key} = v.{primary_key}::{primary_key_type}
+                        AND t.{entry['column']} IS NULL
+                        {changed_since}
+                    RETURNING t.{primary_key}
+                '''
+                written = {jsonable_key(row[0]) for row in execute_values(cur, sql, entry['rows'], template="(%s, %s)", fetch=True)}
+
+                chunks = [c for c in entry['chunks'] if c[0] in written]
+                if chunks:
+                    keys = sorted({c[0] for c in chunks}, key=str)
+                    placeholders = ','.join([f'%s::{primary_key_type}'] * len(keys))
+                    cur.execute(
+                        f'''
+                            DELETE FROM {chunk_table}
+                            WHERE {primary_key} IN ({placeholders})
+                        ''', keys)
+
+                    sql = f'''
+                        INSERT INTO {chunk_table} ({primary_key}, chunk_no, chunk_start, chunk_end, embedding)
+                        VALUES %s
+                    '''
+                    execute_values(cur, sql, chunks, template=f"(%s::{primary_key_type}, %s, %s, %s, %s)")
+            conn.commit()
+            break
+        except Exception as e:
+            written = set()
+            if conn is not None:
+                if conn.closed:
+                    pool.putconn(conn, close=True)
+                    conn = None
+                else:
+                    conn.rollback()
+
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            if attempt < max_retries:
+                warnings.append(f"[{timestamp}] [WARN] Retry {attempt}/{max_retries} replaying the spool after failure: {e}")
+                time.sleep(0.5 * attempt + random.uniform(0, 0.3))
+            else:
+                errors.append(f"[{timestamp}] [ERROR] Failed to replay the spool after {max_retries} retries: {e}")
+
+    if conn is not None:
+        pool.putconn(conn)
+
+    if verbose and not errors and len(written) < len(entry['rows']):
+        print(f"[INFO] Skipped {len(entry['rows']) - len(written)} spooled rows changed since they were read")
+
+    return written, errors, warnings
+
+
+
+def replay_spool(pool, spool: Spool, schema_name=None, table_name=None, output_column=None, verbose=False) -> tuple[int, set]:
+    """Writes the pending batches of the spool (only those of one column if
+    table_name is given), oldest first, until one fails.
+
+    Returns:
+        The number of rows written, and their keys.
+    """
+    replayed = set()
+
+    for entry in spool.pending(schema_name, table_name, output_column):
+        written, errors, warnings = write_spooled(pool, entry, verbose)
+
+        for msg in warnings + errors:
+            print(msg, flush=True)
+
+        if errors:
+            # Still failing: keep the rest for later
+            break
+
+        spool.done(entry['id'])
+        replayed.update(written)
+
+    if replayed:
+        print(f"[INFO] Replayed {len(replayed)} spooled rows", flush=True)
+
+    return len(replayed), replayed
+
+
+
+def run_replay_spool(args: dict):
+    conn_pool = SimpleConnectionPool(minconn=0, maxconn=1, **build_conn_kwargs(args['url']))
+    atexit.register(conn_pool.closeall)
+
+    spool = Spool(args['spool'])
+    batches = spool.pending_count()
+    if not batches:
+        print(f"[INFO] Nothing to replay in {args['spool']}")
+        return
+
+    print(f"[INFO] Replaying {batches} batches from {args['spool']}")
+    replay_spool(conn_pool, spool, verbose=args['verbose'])
+
+    left = spool.pending_count()
+    if left:
+        spool.compact()
+        print(f"[WARN] {left} batches could not be written, and are kept in {args['spool']}")
+
+    spool.close()
+
+
+
+def cached_range_boundaries(pool, schema_name, table_name) -> list:
+    """The table's range boundaries, refreshed every RANGE_BOUNDARIES_TTL
+    seconds. Stale boundaries only cost a group that spans two ranges.
+    """
+    key = (schema_name, table_name)
+    fetched, boundaries = _RANGE_BOUNDARIES.get(key, (0, None))
+
+    if boundaries is None or time.time() - fetched > RANGE_BOUNDARIES_TTL:
+        try:
+            boundaries = get_range_boundaries(pool, schema_name, table_name)
+        except Exception as e:
+            print(f"[WARN] Could not read the range boundaries: {e}", flush=True)
+            boundaries = boundaries or []
+        _RANGE_BOUNDARIES[key] = (time.time(), boundaries)
+
+    return boundaries
+
+
+
+def group_by_range(values, boundaries) -> list[list]:
+    """Splits [row_id, embedding] pairs by the range their row lives in."""
+    if not boundaries:
+        return [values]
+
+    groups = {}
+    try:
+        for row in values:
+            groups.setdefault(bisect.bisect_right(boundaries, row[0]), []).append(row)
+    except TypeError:
+        # The key type doesn't compare with the parsed boundaries
+        return [values]
+
+    return list(groups.values())
+
+
+
+def batch_update_by_range(
+                pool, schema_name, table_name, output_column,
+                primary_key, primary_key_type,
+                values,
+                dry_run, verbose, batch_index=0
+                ):
+    """batch_update(), split into one small transaction per range.
+
+    The groups are committed concurrently, and each one retries on its own:
+    a conflict in one range doesn't redo the writes to the others.
+    """
+    groups = group_by_range(values, cached_range_boundaries(pool, schema_name, table_name))
+
+    if len(groups) == 1:
+        return batch_update(
+            pool, schema_name, table_name, output_column,
+            primary_key, primary_key_type,
+            values,
+            dry_run, verbose, batch_index
+        )
+
+    if verbose:
+        print(f"[INFO] (batch {batch_index}) Writing {len(values)} rows as {len(groups)} range groups")
+
+    update_count = 0
+    errors = []
+    warnings = []
+
+    with ThreadPoolExecutor(max_workers=min(_RANGE_WRITERS, len(groups)), thread_name_prefix="writer") as writers:
+        futures = [
+            writers.submit(
+                batch_update,
+                pool, schema_name, table_name, output_column,
+                primary_key, primary_key_type,
+                group,
+                dry_run, verbose, batch_index
+            )
+            for group in groups
+        ]
+
+        for fut in as_completed(futures):
+            group_count, group_errors, group_warnings = fut.result()
+            update_count += group_count
+            errors.extend(group_errors)
+            warnings.extend(group_warnings)
+
+    return update_count, errors, warnings
+
+
+
+def dequeue(pool, schema_name, table_name, output_column, primary_key, primary_key_type, ids, read_at, verbose=False) -> int:
+    """Deletes the rows embedded from the queue table of output_column.
+
+    Only the entries not written since read_at (a cluster timestamp) go: a
+    row whose input changed after the batch read it is queued again by the
+    trigger, and stays.
+    Returns the rows deleted.
+    """
+    if not ids:
+        return 0
+
+    queue_table = queue_table_name(table_name, output_column)
+    if schema_name is not None:
+        queue_table = f"{schema_name}.{queue_table}"
+
+    keys = sorted(set(ids), key=str)
+    placeholders = ','.join([f'%s::{primary_key_type}'] * len(keys))
+
+    conn = None
+    try:
+        conn = healthy_get_conn(pool)
+        with conn.cursor() as cur:
+            # MVCC timestamps are in nanoseconds
+            cur.execute(
+                f'''
+                    DELETE FROM {queue_table}
+                    WHERE {primary_key} IN ({placeholders})
+                        AND crdb_internal_mvcc_timestamp < {read_at}
+                ''', keys)
+            deleted = cur.rowcount
+        conn.commit()
+    except Exception as e:
+        # Still queued: embedded again by a later batch
+        print(f"[WARN] Failed to dequeue {len(keys)} rows from {queue_table}: {e}", flush=True)
+        deleted = 0
+    finally:
+        if conn is not None:
+            pool.putconn(conn, close=conn.closed != 0)
+
+    if verbose and deleted < len(keys):
+        print(f"[INFO] {len(keys) - deleted} rows changed while they were embedded, left in {queue_table}")
+
+    return deleted
 
 
 
@@ -180,11 +1003,34 @@ def process_single_batch(
     batch_counter: int,
     verbose: bool = False,
     progress: bool = False,
-    dry_run: bool = False
+    dry_run: bool = False,
+    on_done = None,
+    controller: BatchSizeController | None = None
 ):
 
+    read_at = None
+    replayed_count = 0
+
+    # Write what an earlier failure left in the spool first, and don't embed
+    # those rows again
+    if _SPOOL is not None and not dry_run and _SPOOL.pending_count():
+        replayed_count, replayed = replay_spool(conn_pool, _SPOOL, schema, _VECTOR_TABLE or table, vector_column, verbose)
+        ids = [row_id for row_id in ids if jsonable_key(row_id) not in replayed]
+
     chunk_size = int(0.5 + len(ids) / workers)
+    if controller is not None:
+        chunk_size = controller.chunk_size
+
+    # Fewer, larger chunks keep fewer workers busy while the cluster is
+    # loaded
+    if _THROTTLE is not None and ids:
+        concurrency = _THROTTLE.admit(len(ids), workers)
+        chunk_size = max(chunk_size, -(-len(ids) // concurrency))
+    chunk_size = max(1, chunk_size)
+
     futures = []
+    submitted = {}
+    offsets = {}
 
     # Run one batch (via pool for per-process model reuse)
     if verbose:
@@ -199,29 +1045,169 @@ def process_single_batch(
         # idle_wait = max(0.001, float(args['min_idle']))
         # idle_spent = 0.0
 
+        # The chunk's rows of the shared memory, if they are free
+        ring, offset = None, None
+        if _RESULT_RING is not None:
+            offset = _RESULT_RING.reserve(len(id_chunk))
+            if offset is not None:
+                ring = (_RESULT_RING.name, _RESULT_RING.rows, _RESULT_RING.dim, offset)
+            elif verbose:
+                print(f"[INFO] (batch {batch_counter}) No room for {len(id_chunk)} rows in the shared memory: returning them through the pipe")
+
         fut = executor.submit(
             batch_embed,
             url,
             schema, table, source_column,
             primary_key, id_chunk,
-            dry_run, verbose, batch_counter
+            dry_run, verbose, batch_counter,
+            _CHUNKING,
+            _MAX_INPUT_CHARS,
+            _FETCH_ROWS,
+            [(spec['input'], spec['output'], spec['model']) for spec in _SPECS],
+            _MODEL_NAME,
+            ring
         )
 
-        if progress:
-            fut.add_done_callback(_on_done_embed)
+        if progress and on_done is not None:
+            fut.add_done_callback(on_done)
         
         futures.append(fut)
-        
-    for fut in as_completed(futures):
-        embeddings.extend(fut.result())
-
-    update_count, worker_errors, worker_warnings = batch_update(
-        conn_pool, schema, table, vector_column,
-        primary_key, primary_key_type,
-        embeddings,
-        dry_run, verbose, batch_counter
+        submitted[fut] = time.time()
+        offsets[fut] = offset
+
+    labels = dict(
+        table = metrics.table_label(schema, table),
+        column = vector_column
     )
 
+    failed = []
+    text_chunks = []
+
+    # Slowest chunk, from submission to its result landing here
+    encode_secs = 0.0
+    try:
+        for fut in as_completed(futures):
+            chunk_values, chunk_failed, chunk_texts, chunk_read_at = fut.result()
+            # The earliest read of the batch: the rows changed since any of
+            # them was read are left alone
+            if chunk_read_at is not None and (read_at is None or chunk_read_at < read_at):
+                read_at = chunk_read_at
+            if offsets[fut] is not None:
+                # The row IDs, their vectors read in place
+                vectors = _RESULT_RING.read(offsets[fut], len(chunk_values))
+                chunk_values = [[row_id, vectors[k]] for k, row_id in enumerate(chunk_values)]
+            embeddings.extend(chunk_values)
+            failed.extend(chunk_failed)
+            text_chunks.extend(chunk_texts)
+            chunk_secs = time.time() - submitted[fut]
+            encode_secs = max(encode_secs, chunk_secs)
+            metrics.STAGE_SECONDS.observe(chunk_secs, stage="encode", **labels)
+
+        # The vectors go to the side table, if any, leaving the source rows alone
+        write_table = _VECTOR_TABLE or table
+
+        # Not into another model's column
+        check_column_model(conn_pool, schema, write_table, vector_column)
+
+        # A queued column's rows stay in its queue until they are written:
+        # they are embedded again if the write fails, and not spooled
+        spool_id = None
+        if _SPOOL is not None and _QUEUE_TABLE is None and not dry_run and embeddings:
+            spool_id = _SPOOL.put(
+                schema, write_table, vector_column,
+                primary_key, primary_key_type,
+                embeddings, text_chunks,
+                None if read_at is None else str(read_at)
+            )
+
+        update_start = time.time()
+        writer = batch_update_by_range if _RANGE_WRITERS > 0 else batch_update
+
+        with profile.span("update", batch=batch_counter, rows=len(embeddings)):
+            chunk_errors, chunk_warnings = [], []
+            if _CHUNKING is not None:
+                chunk_errors, chunk_warnings = batch_update_chunks(
+                    conn_pool, schema, table, vector_column,
+                    primary_key, primary_key_type,
+                    embeddings, text_chunks,
+                    dry_run, verbose, batch_counter
+                )
+
+            if chunk_errors:
+                # Leave the parent vectors NULL: the rows are picked up again
+                update_count, worker_errors, worker_warnings = 0, chunk_errors, chunk_warnings
+            else:
+                update_count, worker_errors, worker_warnings = writer(
+                    conn_pool, schema, write_table, vector_column,
+                    primary_key, primary_key_type,
+                    embeddings,
+                    dry_run, verbose, batch_counter
+                )
+                worker_warnings = chunk_warnings + worker_warnings
+
+            # The writers warn once per attempt they retry, and about nothing
+            # else: the spool and failed rows are only reported below
+            retries = len(worker_warnings)
+    finally:
+        # Written, spooled or failed: the rows of the shared memory are
+        # reused, once no worker is left writing to them
+        wait(futures)
+        for offset in offsets.values():
+            if offset is not None:
+                _RESULT_RING.release(offset)
+
+    update_secs = time.time() - update_start
+
+    if spool_id is not None:
+        if worker_errors:
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            worker_warnings.append(
+                f"[{timestamp}] [WARN] (batch {batch_counter}) {len(embeddings)} vectors kept in {_SPOOL.path}, "
+                f"to be written without re-embedding"
+            )
+        else:
+            _SPOOL.done(spool_id)
+
+    update_count += replayed_count
+
+    # The rows written leave the queue, the ones that failed stay in it
+    if _QUEUE_TABLE is not None and not dry_run and not worker_errors:
+        dequeue(
+            conn_pool, schema, table, vector_column,
+            primary_key, primary_key_type,
+            [row[0] for row in embeddings],
+            read_at,
+            verbose
+        )
+
+    metrics.STAGE_SECONDS.observe(update_secs, stage="update", **labels)
+    global _UPDATE_RETRIES
+    with _UPDATE_RETRIES_LOCK:
+        _UPDATE_RETRIES += retries
+    metrics.UPDATE_RETRIES.inc(retries, **labels)
+    metrics.UPDATE_ERRORS.inc(len(worker_errors), **labels)
+    if not dry_run:
+        metrics.ROWS_EMBEDDED.inc(update_count, **labels)
+    metrics.sample_rss()
+
+    if failed:
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for row_id, error in failed:
+            worker_warnings.append(f"[{timestamp}] [WARN] (batch {batch_counter}) Row {row_id} failed to embed: {error[:200]}")
+        metrics.ROWS_FAILED.inc(len(failed), **labels)
+
+        if _QUARANTINE is not None and not dry_run:
+            worker_warnings.extend(_QUARANTINE.record(failed, batch_counter))
+
+    if controller is not None:
+        controller.observe(
+            len(embeddings),
+            encode_secs,
+            update_secs,
+            retries,
+            len(worker_errors)
+        )
+
     return  update_count, worker_errors, worker_warnings
 
 
@@ -235,7 +1221,8 @@ def run_embed_follow(
     batch_size,
     workers: int,
     min_idle: int, max_idle: int,
-    verbose: bool = False
+    verbose: bool = False,
+    controller: BatchSizeController | None = None
 ):
     # Backoff state
     idle_wait = 0
@@ -244,7 +1231,17 @@ def run_embed_follow(
     
     batch_counter = 1
         
+    labels = dict(
+        table = metrics.table_label(schema, table),
+        column = vector_column
+    )
+
     while True:
+        if controller is not None:
+            batch_size = controller.batch_size
+
+        metrics.refresh_backlog(conn_pool, schema, table, primary_key, vector_column, scan_table=_VECTOR_TABLE, queue_table=_QUEUE_TABLE)
+
         # Fetch one batchfull of IDs (no wait on start or after successful work)
         ids = fetch_null_vector_ids(conn_pool, schema, table, vector_column, primary_key, batch_size)
 
@@ -252,6 +1249,8 @@ def run_embed_follow(
             # Got work!!! Reset the current idle_time
             idle_wait = 0
             to_sleep = 1
+            metrics.IDLE_SECONDS.set(idle_wait, **labels)
+            metrics.IDLE_SLEEP_SECONDS.set(0, **labels)
 
             update_count, worker_errors, worker_warnings = process_single_batch(
                 executor,
@@ -264,7 +1263,8 @@ def run_embed_follow(
                 batch_counter,
                 verbose,
                 False,
-                False
+                False,
+                controller=controller
             )
 
             # Increment counters
@@ -286,6 +1286,10 @@ def run_embed_follow(
 
                     print(f"[INFO] {msg} Sleeping for {to_sleep} secs...")
 
+                metrics.IDLE_SECONDS.set(idle_wait, **labels)
+                metrics.IDLE_SLEEP_SECONDS.set(to_sleep, **labels)
+                metrics.sample_rss()
+
                 time.sleep(to_sleep)
                 idle_wait += to_sleep
                 to_sleep *= 2
@@ -305,7 +1309,8 @@ def run_embed_n_batches(
     workers: int,
     verbose: bool = False,
     progress: bool = False,
-    dry_run: bool = False
+    dry_run: bool = False,
+    controller: BatchSizeController | None = None
 ):
     pbar = None
 
@@ -320,21 +1325,32 @@ def run_embed_n_batches(
                     smoothing=0.01
                 )
 
-        def _on_done_embed(fut):
-            try:
-                embeddings = fut.result()
-            except Exception:
-                return
-            if embeddings:
-                pbar.update(len(embeddings))
+    # Only attached to the chunks with the progress bar on
+    def _on_done_embed(fut):
+        try:
+            embeddings = fut.result()[0]
+        except Exception:
+            return
+        if embeddings:
+            pbar.update(len(embeddings))
 
 
     warnings = []
     errors = []
 
+    ids = []
+    rows = 0
+    batch_seconds = []
+    retries_before = _UPDATE_RETRIES
+
     start = time.time()
 
     for batch in range(1, num_batches+1):
+        if controller is not None:
+            batch_size = controller.batch_size
+
+        batch_start = time.time()
+
         # Fetch one batchfull of IDs (no wait on start or after successful work)
         ids = fetch_null_vector_ids(conn_pool, schema, table, vector_column, primary_key, batch_size)
 
@@ -356,16 +1372,22 @@ def run_embed_n_batches(
                 batch,
                 verbose,
                 progress,
-                dry_run
+                dry_run,
+                _on_done_embed,
+                controller
             )
             
             errors.extend(worker_errors)
             warnings.extend(worker_warnings)
 
+            rows += update_count
+            batch_seconds.append(time.time() - batch_start)
+
     # end for
 
+    elapsed = time.time() - start
 
-    print("Done in", time.time() - start, "seconds")
+    print("Done in", elapsed, "seconds")
     if verbose and ids:
         print("[INFO] Embedding complete.")
 
@@ -387,6 +1409,14 @@ def run_embed_n_batches(
                 f.write(w + "\n")
         print(f"Total errors: {len(errors)}")
 
+    return {
+        "rows": rows,
+        "batches": len(batch_seconds),
+        "seconds": elapsed,
+        "batch_seconds": batch_seconds,
+        "retries": _UPDATE_RETRIES - retries_before,
+        "errors": len(errors)
+    }
 
 
 
@@ -396,31 +1426,70 @@ def run_embed(args):
     if not is_valid_model(args['model']):
         raise RuntimeError(f"Invalid embedding model {args['model']}")
 
+    profile_settings = None
+    if args['profile']:
+        profile_settings = profile.enable(args['cprofile'])
+
     global model
-    model = importlib.import_module(
-                f"{__name__.split(".")[0]}.models.{args['model']}",
-                package = __name__.split(".")[0]
-            )
+    with profile.span("model_load", model=args['model']):
+        model = importlib.import_module(
+                    f"{__name__.split(".")[0]}.models.{args['model']}",
+                    package = __name__.split(".")[0]
+                )
+
+    global _RANGE_WRITERS
+    _RANGE_WRITERS = args['range_writes']
+
+    # The range groups are written from several threads. The writes are
+    # spread over the gateways too, a connection on each in turn.
+    if _RANGE_WRITERS > 0:
+        conn_pool = ThreadedSpreadConnectionPool(0, args['workers'] + _RANGE_WRITERS, args['url'])
+    else:
+        conn_pool = SpreadConnectionPool(0, args['workers'], args['url'])
+    atexit.register(conn_pool.closeall)
+
+    # Spread the workers across the gateways: either the nodes listed in
+    # the URL or the live nodes discovered from the cluster itself.
+    gateways = parse_gateways(args['url'])
+    preferred = len(gateways)
+    if args['discover'] or args['locality']:
+        gateways, preferred = discover_gateways(conn_pool, args['locality'])
+        if not gateways:
+            raise RuntimeError("No live gateway nodes found")
+        conn_pool.spread_over(gateways, preferred)
+
+    if args['verbose'] and len(gateways) > 1:
+        for i, (host, port) in enumerate(gateways):
+            marker = "*" if i < preferred else " "
+            print(f"[INFO] Gateway {marker} {host}:{port}")
 
     executor = ProcessPoolExecutor(
         max_workers=min(args['workers'], multiprocessing.cpu_count()),
-        initializer=worker_init, initargs=(args['url'],)
+        initializer=worker_init,
+        initargs=(args['url'], gateways, preferred, multiprocessing.Value('i', 0), profile_settings)
     )
-    
-    conn_pool = SimpleConnectionPool(minconn=0, maxconn=args['workers'], **build_conn_kwargs(args['url']))
-    atexit.register(conn_pool.closeall)
 
-    primary_key, primary_key_type = get_primary_key_column(conn_pool, args['schema'], args['table'])
-
-    # Check if the specified vector column exist.
-    # If it doesn't, recommend running "instrument"
-    if not is_vector_column(
-                    conn_pool,
-                    args['schema'], args['table'],
-                    args['output'],
-                    model.embedding_dim(),
-                    not args['progress']
-            ):
+    global _VECTOR_TABLE
+    with profile.span("catalog"):
+        primary_key, primary_key_type = get_primary_key_column(conn_pool, args['schema'], args['table'])
+
+        vector_table = vector_table_name(conn_pool, args['schema'], args['table'], args['output'])
+        if vector_table != args['table']:
+            _VECTOR_TABLE = vector_table
+            if args['verbose']:
+                print(f"[INFO] Vectors stored in the side table {vector_table}")
+
+        # Check if the specified vector column exist.
+        # If it doesn't, recommend running "instrument"
+        vector_column_ok = is_vector_column(
+                        conn_pool,
+                        args['schema'], vector_table,
+                        args['output'],
+                        model.embedding_dim(),
+                        not args['progress']
+                )
+
+    if not vector_column_ok:
         ctx = click.get_current_context()
         msg = f"""
             Column {args['output']} doesn't exist.
@@ -433,10 +1502,150 @@ def run_embed(args):
         print(textwrap.dedent(msg))
         return
 
+    # migrate-model swaps in a column of another model, maybe of the same
+    # dimension
+    recorded_model = vector_column_model(conn_pool, args['schema'], vector_table, args['output'])
+    if recorded_model is not None and recorded_model != args['model']:
+        raise RuntimeError(f"Column {args['output']} is embedded with {recorded_model}, not {args['model']}")
+
+    global _COLUMN_MODEL
+    _COLUMN_MODEL = args['model']
+
+
+    if args['specs']:
+        if args['changefeed'] or args['quarantine'] or args['spool']:
+            raise RuntimeError("--spec is not supported with --changefeed, --quarantine, or --spool")
+
+        specs = [(args['input'], args['output'], args['model'])] + list(args['specs'])
+        if len({output_column for _, output_column, _ in specs}) < len(specs):
+            raise RuntimeError("Each --spec needs its own output column")
+
+        _MODELS[args['model']] = model
+        for input_column, output_column, model_name in specs:
+            if model_name not in _MODELS:
+                if not is_valid_model(model_name):
+                    raise RuntimeError(f"Invalid embedding model {model_name}")
+                _MODELS[model_name] = importlib.import_module(f"{__package__.split('.')[0]}.models.{model_name}")
+
+            # One UPDATE of the table's rows writes all the columns
+            if vector_table_name(conn_pool, args['schema'], args['table'], output_column) != args['table'] \
+                    or is_chunked(conn_pool, args['schema'], args['table'], output_column):
+                raise RuntimeError(f"--spec is not supported with side table or chunked columns ({output_column})")
+
+            dim = _MODELS[model_name].embedding_dim()
+            if not is_vector_column(conn_pool, args['schema'], args['table'], output_column, dim):
+                raise RuntimeError(f"Column {output_column} doesn't exist. Run 'instrument' first.")
+
+            _SPECS.append({"input": input_column, "output": output_column, "model": model_name, "dim": dim})
+
+        if args['verbose']:
+            for spec in _SPECS:
+                print(f"[INFO] Embedding {spec['input']} into {spec['output']} with {spec['model']}")
+
+
+    global _HASH_BUCKETS
+    _HASH_BUCKETS = vector_index_buckets(conn_pool, args['schema'], vector_table, primary_key, args['output'])
+    if args['verbose'] and _HASH_BUCKETS:
+        print(f"[INFO] Scanning the {_HASH_BUCKETS} buckets of the NULL index from random starts")
+
+    global _QUEUE_TABLE
+    if not _SPECS and _VECTOR_TABLE is None and is_queued(conn_pool, args['schema'], args['table'], args['output']):
+        # The queued rows keep their vector: the changefeed only sees the
+        # NULL ones
+        if args['changefeed']:
+            raise RuntimeError("--changefeed is not supported with a queued column")
+        _QUEUE_TABLE = queue_table_name(args['table'], args['output'])
+        if args['verbose']:
+            print(f"[INFO] Embedding the rows queued in {_QUEUE_TABLE}")
+
+    global _CHUNKING
+    if is_chunked(conn_pool, args['schema'], args['table'], args['output']):
+        _CHUNKING = {
+            "max_tokens": args['chunk_tokens'] or model_max_tokens(model),
+            "overlap_tokens": args['chunk_overlap']
+        }
+        if args['verbose']:
+            print(f"[INFO] Chunked column: {_CHUNKING['max_tokens']} tokens per chunk, {_CHUNKING['overlap_tokens']} overlap")
+
+    global _MAX_INPUT_CHARS, _FETCH_ROWS
+    _FETCH_ROWS = args['fetch_rows']
+    if _CHUNKING is None and not _SPECS:
+        _MAX_INPUT_CHARS = input_char_limit(conn_pool, args['schema'], args['table'], args['input'], args['max_input_chars'])
+        if args['verbose'] and _MAX_INPUT_CHARS:
+            print(f"[INFO] Fetching the first {_MAX_INPUT_CHARS} characters of {args['input']}")
+
+    global _RESULT_RING
+    if args['shm']:
+        if _SPECS or _CHUNKING is not None:
+            raise RuntimeError("--shm is not supported with --spec or chunked columns")
+
+        # Room for the largest batch
+        rows = args['max_batch_size'] if args['adaptive'] else args['batch_size']
+        _RESULT_RING = ResultRing(max(1, rows), model.embedding_dim())
+        atexit.register(_RESULT_RING.close)
+        if args['verbose']:
+            print(f"[INFO] Workers write the vectors to shared memory {_RESULT_RING.name} ({_RESULT_RING.rows * _RESULT_RING.dim * 4 / 2**20:.1f} MiB)")
+
+    global _SPOOL
+    if args['spool'] and not args['dry_run']:
+        _SPOOL = Spool(args['spool'])
+        if _SPOOL.pending_count():
+            print(f"[INFO] Replaying the vectors left in {args['spool']}")
+            replay_spool(conn_pool, _SPOOL, args['schema'], vector_table, args['output'], args['verbose'])
+
+    global _QUARANTINE
+    if args['quarantine'] > 0:
+        _QUARANTINE = Quarantine(
+            conn_pool,
+            args['schema'], args['table'],
+            primary_key, primary_key_type,
+            args['input'], args['output'],
+            args['quarantine'],
+            args['quarantine_table']
+        )
+
+    global _CHANGED_COLUMN
+    if not _SPECS and _VECTOR_TABLE is None and is_change_tracked(conn_pool, args['schema'], args['table'], args['output']):
+        _CHANGED_COLUMN = change_column_name(args['output'])
+        if args['verbose']:
+            print(f"[INFO] Embedding the rows changed since {_CHANGED_COLUMN} first")
 
+    global _THROTTLE
+    _THROTTLE = throttle_from_args(conn_pool, args)
+
+    if args['metrics_port']:
+        metrics.start_metrics_server(args['metrics_port'])
+        if args['verbose']:
+            print(f"[INFO] Serving metrics on :{args['metrics_port']}/metrics")
+
+    controller = None
+    if args['adaptive']:
+        controller = BatchSizeController(
+            args['batch_size'],
+            args['workers'],
+            args['min_batch_size'],
+            args['max_batch_size'],
+            log = not args['progress']
+        )
 
     # Call the correct mode depending on batch run or daemon
-    if args['follow']:
+    if args['follow'] and args['changefeed']:
+        run_embed_changefeed(
+            executor,
+            conn_pool,
+            args['url'], args['schema'], args['table'],
+            primary_key, primary_key_type,
+            args['input'], args['output'],
+            args['batch_size'],
+            args['workers'],
+            args['max_idle'],
+            args['checkpoint'],
+            args['resolved'],
+            args['verbose'],
+            controller
+        )
+
+    elif args['follow']:
         run_embed_follow(
             executor,
             conn_pool,
@@ -446,7 +1655,8 @@ def run_embed(args):
             args['batch_size'],
             args['workers'],
             args['min_idle'], args['max_idle'],
-            args['verbose']
+            args['verbose'],
+            controller
         )
     
     else:
@@ -460,9 +1670,12 @@ def run_embed(args):
             args['workers'],
             args['verbose'],
             args['progress'],
-            args['dry_run']
+            args['dry_run'],
+            controller
         )
 
+    profile.finish("embed", args['trace'], args['otel'])
+
 
 
 
@@ -1,6 +1,9 @@
-from psycopg2.pool import SimpleConnectionPool
+import psycopg2
+from psycopg2.pool import SimpleConnectionPool, ThreadedConnectionPool
 import importlib
 import re
+import time
+import threading
 import json
 import textwrap
 from jinja2 import Template
@@ -10,8 +13,13 @@ from .common import (
     build_conn_kwargs,
     main_get_conn,
     get_primary_key_column,
-    get_column_type
+    get_column_type,
+    get_column_families,
+    get_table_id,
+    get_index_bucket_count
 )
+from .chunking import chunk_table_name
+from .quarantine import quarantine_trigger_name
 
 
 model = None
@@ -52,54 +60,354 @@ def is_vector_column(pool, schema_name, table_name, vector_column, vector_dim, v
 
 
 
-def ensure_vector_column(pool, schema_name, table_name, pk, output_column, dry_run=False, verbose=False):
+def vector_family_name(output_column: str) -> str:
+    """The column family holding output_column on its own."""
+    return f"{output_column}_fam"
+
+
+
+def has_own_family(pool, schema_name, table_name, column) -> bool:
+    """True if the column is alone in its column family: writing it doesn't
+    rewrite the rest of the row, and the other columns' writes don't
+    rewrite it.
+    """
+    for columns in get_column_families(pool, schema_name, table_name).values():
+        if column in columns:
+            # The change timestamp is written along with the vector
+            return [c for c in columns if c != change_column_name(column)] == [column]
+    return False
+
+
+
+def change_column_name(output_column: str) -> str:
+    """The column the update trigger stamps with the time the input changed,
+    with instrument --track-changes.
+    """
+    return f"{output_column}_changed"
+
+
+
+def is_change_tracked(pool, schema_name, table_name, output_column) -> bool:
+    return get_column_type(pool, schema_name, table_name, change_column_name(output_column)) is not None
+
+
+
+def ensure_change_column(pool, schema_name, table_name, output_column, dry_run=False, verbose=False, hash_buckets=None):
+    """Adds the change timestamp of output_column, and the index of the
+    changed rows waiting for their vector, oldest first.
+
+    The timestamp is in the vector's column family: the trigger's reset of
+    the vector and the stamp are a single write. New rows are stamped with
+    their insert time; the rows already there are left NULL, as the cold
+    backlog. The index is hash-sharded like the vector's NULL index, or
+    with hash_buckets.
+    """
+    changed_column = change_column_name(output_column)
+
+    if hash_buckets is None:
+        pk, _ = get_primary_key_column(pool, schema_name, table_name)
+        hash_buckets = vector_index_buckets(pool, schema_name, table_name, pk, output_column)
+    using_hash = hash_clause(pool, schema_name, table_name, f"{changed_column}_idx", hash_buckets)
+
+    family_clause = ""
+    if has_own_family(pool, schema_name, table_name, output_column):
+        for family, columns in get_column_families(pool, schema_name, table_name).items():
+            if output_column in columns:
+                family_clause = f'FAMILY "{family}"'
+
+    if schema_name is not None:
+        table_name = f"{schema_name}.{table_name}"
+
+    sql = [
+        (
+            f"[INFO] Adding column {changed_column} TIMESTAMPTZ",
+            f"""
+                ALTER TABLE {table_name}
+                ADD COLUMN IF NOT EXISTS "{changed_column}" TIMESTAMPTZ {family_clause}
+            """
+        ),
+        (
+            "[INFO] Stamping new rows with their insert time",
+            f"""
+                ALTER TABLE {table_name}
+                ALTER COLUMN "{changed_column}" SET DEFAULT now()
+            """
+        ),
+        (
+            "[INFO] Creating index to locate the changed rows with no embeddings",
+            f'''
+                CREATE INDEX IF NOT EXISTS {changed_column}_idx
+                ON {table_name} ("{changed_column}" ASC) {using_hash}
+                WHERE "{output_column}" IS NULL AND "{changed_column}" IS NOT NULL
+            '''
+        )
+    ]
+
+    conn = main_get_conn(pool)
+
+    for stmt in sql:
+        with conn.cursor() as cur:
+            print(stmt[0])
+            if dry_run:
+                print(f"[DRY RUN] Would execute: {stmt[1]}")
+            else:
+                cur.execute(stmt[1])
+
+    pool.putconn(conn)
+
+
+
+# The vector column's comment names its model, for embed --all-instrumented
+MODEL_COMMENT_PREFIX = "vectorize model="
+
+
+def set_vector_model(pool, schema_name, table_name, output_column, model_name, dry_run=False):
+    """Records the column's model in its comment."""
+    if schema_name is not None:
+        table_name = f"{schema_name}.{table_name}"
+
+    stmt = f"COMMENT ON COLUMN {table_name}.{output_column} IS '{MODEL_COMMENT_PREFIX}{model_name}'"
+    print(f"[INFO] Recording model {model_name} for {output_column}")
+    if dry_run:
+        print(f"[DRY RUN] Would execute: {stmt}")
+        return
+
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        cur.execute(stmt)
+    pool.putconn(conn)
+
+
+
+def vector_column_model(pool, schema_name, table_name, output_column) -> str | None:
+    """The model recorded by set_vector_model(), None if there is none."""
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT col_description(c.oid, a.attnum)
+            FROM pg_attribute a
+            JOIN pg_class c ON a.attrelid = c.oid
+            JOIN pg_namespace n ON c.relnamespace = n.oid
+            WHERE {"n.nspname = %s AND" if schema_name is not None else ""}
+                c.relname = %s AND
+                a.attname = %s
+        """, tuple(p for p in (schema_name, table_name, output_column) if p is not None))
+        result = cur.fetchone()
+    pool.putconn(conn)
+
+    comment = result[0] if result else None
+    if not comment or not comment.startswith(MODEL_COMMENT_PREFIX):
+        return None
+
+    return comment[len(MODEL_COMMENT_PREFIX):].strip()
+
+
+
+def resolve_vector_model(pool, schema_name, table_name, output_column, model_name=None) -> str:
+    """The model to encode queries of the column with: the one recorded for
+    it, which migrate-model changes, else model_name.
+    """
+    recorded = vector_column_model(pool, schema_name, table_name, output_column)
+
+    if recorded is None:
+        if model_name is None:
+            raise RuntimeError(f"No model recorded for {output_column}: use -m")
+        return model_name
+
+    if model_name is not None and model_name != recorded:
+        print(f"[WARN] {output_column} is embedded with {recorded}, not {model_name}: using {recorded}")
+
+    return recorded
+
+
+
+# Suffix of the column migrate-model re-embeds a vector column into
+MODEL_SHADOW_SUFFIX = "_next"
+
+
+def shadow_column_name(output_column: str) -> str:
+    return f"{output_column}{MODEL_SHADOW_SUFFIX}"
+
+
+
+def list_instrumented_tables(pool) -> list[tuple[str | None, str]]:
+    """The (schema, table) pairs with an update trigger installed by
+    instrument. The schema is None where instrument was given no schema,
+    as in the trigger's name.
+    """
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT DISTINCT tg.tgname, n.nspname, c.relname
+            FROM pg_catalog.pg_trigger tg
+            JOIN pg_catalog.pg_class c ON c.oid = tg.tgrelid
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            WHERE tg.tgname LIKE 'clear_vector_on_update_%'
+        """)
+        triggers = cur.fetchall()
+    pool.putconn(conn)
+
+    tables = []
+    for trigger_name, schema_name, table_name in triggers:
+        if trigger_name == f"clear_vector_on_update_{table_name}":
+            tables.append((None, table_name))
+        elif trigger_name == f"clear_vector_on_update_{schema_name}_{table_name}":
+            tables.append((schema_name, table_name))
+
+    return sorted(tables, key=lambda t: (t[0] or "", t[1]))
+
+
+
+def vector_index_buckets(pool, schema_name, table_name, pk, output_column) -> int:
+    """The bucket count of the column's hash-sharded auxiliary indexes, read
+    from its NULL index. 0 if they aren't sharded.
+    """
+    return get_index_bucket_count(pool, schema_name, table_name, f"{output_column}_{pk}_null_idx") or 0
+
+
+
+def hash_clause(pool, schema_name, table_name, index_name, hash_buckets) -> str:
+    """The USING HASH clause of an auxiliary index, empty if it isn't
+    sharded. An existing index keeps its sharding: it can't be changed in
+    place.
+    """
+    existing = get_index_bucket_count(pool, schema_name, table_name, index_name)
+    if existing is not None and existing != hash_buckets:
+        print(
+            f"[WARN] Index {index_name} exists with {existing or 'no'} hash buckets, not {hash_buckets or 'none'}: "
+            f"drop it and run 'instrument' again to rebuild it"
+        )
+
+    return f"USING HASH WITH (bucket_count = {int(hash_buckets)})" if hash_buckets else ""
+
+
+
+def ensure_vector_column(pool, schema_name, table_name, pk, output_column, dry_run=False, verbose=False, family=True, defer_index=False, hash_buckets=None):
+    """Adds the vector column, and its vector and auxiliary indexes.
+
+    With hash_buckets, the auxiliary partial indexes are hash-sharded on the
+    primary key: with sequential keys, the new NULL rows spread over as many
+    ranges instead of landing in one. None keeps the sharding of the
+    existing indexes.
+    """
     sql = []
     vector_dim = model.embedding_dim()
 
+    column_exists = is_vector_column(pool, schema_name, table_name, output_column, vector_dim, verbose)
+
+    if hash_buckets is None:
+        hash_buckets = vector_index_buckets(pool, schema_name, table_name, pk, output_column)
+
+    null_hash = hash_clause(pool, schema_name, table_name, f"{output_column}_{pk}_null_idx", hash_buckets)
+    not_null_hash = hash_clause(pool, schema_name, table_name, f"{output_column}_{pk}_not_null_idx", hash_buckets)
+
     if schema_name is not None:
         table_name = f"{schema_name}.{table_name}"
 
-    if not is_vector_column(pool, schema_name, table_name, output_column, vector_dim, verbose):
+    if not column_exists:
+        # In its own column family: an embedding write is a single KV write
+        # of the vector, instead of a rewrite of the whole row
+        family_clause = f'CREATE IF NOT EXISTS FAMILY "{vector_family_name(output_column)}"' if family else ""
         sql.append(
             (
                 f"[INFO] Adding new column {output_column} VECTOR({vector_dim})",
                 f"""
                     ALTER TABLE {table_name}
-                    ADD COLUMN "{output_column}" VECTOR({vector_dim})
+                    ADD COLUMN "{output_column}" VECTOR({vector_dim}) {family_clause}
                 """
             )
         )
 
-    sql.append(
-        (
-            f"[INFO] Creating vector index",
-            f'''
-            CREATE VECTOR INDEX IF NOT EXISTS {output_column}_idx
-            ON {table_name} ({output_column} {model.embedding_index_opclass()})
-            WHERE {output_column} IS NOT NULL
-            '''
-        )
-    )
     sql.append(
         (
             f"[INFO] Creating index to accelerate locating rows with no embeddings",
             f'''
                 CREATE INDEX IF NOT EXISTS {output_column}_{pk}_null_idx
-                ON {table_name} ("{pk}" ASC)
+                ON {table_name} ("{pk}" ASC) {null_hash}
                 WHERE "{output_column}" IS NULL
             '''
         )
     )
-    sql.append(
+
+    # The search indexes are maintained by every embedding write: with
+    # defer_index, build-index creates them in one pass after the backfill
+    if defer_index:
+        print("[INFO] Deferring the vector index: run 'build-index' once the column is embedded")
+    else:
+        sql.append(
+            (
+                f"[INFO] Creating vector index",
+                f'''
+                CREATE VECTOR INDEX IF NOT EXISTS {output_column}_idx
+                ON {table_name} ({output_column} {model.embedding_index_opclass()})
+                WHERE {output_column} IS NOT NULL
+                '''
+            )
+        )
+        sql.append(
+            (
+                f"[INFO] Creating index to rows considered in vector searches",
+                f'''
+                    CREATE INDEX IF NOT EXISTS {output_column}_{pk}_not_null_idx
+                    ON {table_name} ("{pk}" ASC) {not_null_hash}
+                    WHERE "{output_column}" IS NOT NULL
+                '''
+            )
+        )
+
+    conn = main_get_conn(pool)
+
+    for stmt in sql:
+        with conn.cursor() as cur:
+            print(stmt[0])
+            if dry_run:
+                print(f"[DRY RUN] Would execute: {stmt[1]}")
+            else:
+                cur.execute(stmt[1])
+
+    pool.putconn(conn)
+
+
+
+
+def ensure_chunk_table(pool, schema_name, table_name, pk, pk_type, output_column, dry_run=False, verbose=False, defer_index=False):
+    """Creates the child table that keeps one vector per chunk of the input
+    text, for texts longer than the model's input limit.
+    """
+    vector_dim = model.embedding_dim()
+
+    chunk_table = chunk_table_name(table_name, output_column)
+    index_name = f"{chunk_table}_idx"
+    if schema_name is not None:
+        table_name = f"{schema_name}.{table_name}"
+        chunk_table = f"{schema_name}.{chunk_table}"
+
+    sql = [
         (
-            f"[INFO] Creating index to rows considered in vector searches",
-            f'''
-                CREATE INDEX IF NOT EXISTS {output_column}_{pk}_not_null_idx
-                ON {table_name} ("{pk}" ASC)
-                WHERE "{output_column}" IS NOT NULL
-            '''
+            f"[INFO] Creating chunk table {chunk_table}",
+            f"""
+                CREATE TABLE IF NOT EXISTS {chunk_table} (
+                    "{pk}" {pk_type} NOT NULL REFERENCES {table_name} ("{pk}") ON DELETE CASCADE,
+                    chunk_no INT4 NOT NULL,
+                    chunk_start INT4 NOT NULL,
+                    chunk_end INT4 NOT NULL,
+                    embedding VECTOR({vector_dim}) NOT NULL,
+                    PRIMARY KEY ("{pk}", chunk_no)
+                )
+            """
+        )
+    ]
+
+    if not defer_index:
+        sql.append(
+            (
+                f"[INFO] Creating chunk vector index",
+                f"""
+                    CREATE VECTOR INDEX IF NOT EXISTS {index_name}
+                    ON {chunk_table} (embedding {model.embedding_index_opclass()})
+                """
+            )
         )
-    )
 
     conn = main_get_conn(pool)
 
@@ -115,6 +423,144 @@ def ensure_vector_column(pool, schema_name, table_name, pk, output_column, dry_r
 
 
 
+def is_chunked(pool, schema_name, table_name, output_column) -> bool:
+    return get_table_id(pool, schema_name, chunk_table_name(table_name, output_column)) is not None
+
+
+
+def side_table_name(table_name: str, output_column: str) -> str:
+    """The companion table holding table.output_column with --storage side-table.
+
+    The name is unqualified: it lives in the parent table's schema.
+    """
+    return f"{table_name}_{output_column}_side"
+
+
+
+def is_side_table(pool, schema_name, table_name, output_column) -> bool:
+    return get_table_id(pool, schema_name, side_table_name(table_name, output_column)) is not None
+
+
+
+def vector_table_name(pool, schema_name, table_name, output_column) -> str:
+    """The table the vectors of output_column are stored in: the table
+    itself, or its side table. Both have the same vector column and indexes.
+    """
+    if is_side_table(pool, schema_name, table_name, output_column):
+        return side_table_name(table_name, output_column)
+    return table_name
+
+
+
+def ensure_side_table(pool, schema_name, table_name, pk, pk_type, output_column, dry_run=False, verbose=False, defer_index=False, hash_buckets=None):
+    """Creates the side table: one row per row of the table, keyed by its
+    primary key, with the vector column and the same indexes as the column
+    storage. Embedding writes go there and never touch the table's rows.
+    """
+    side_table = side_table_name(table_name, output_column)
+    full_table_name, full_side_table = table_name, side_table
+    if schema_name is not None:
+        full_table_name = f"{schema_name}.{table_name}"
+        full_side_table = f"{schema_name}.{side_table}"
+
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        stmt = f"""
+            CREATE TABLE IF NOT EXISTS {full_side_table} (
+                "{pk}" {pk_type} PRIMARY KEY REFERENCES {full_table_name} ("{pk}") ON DELETE CASCADE
+            )
+        """
+        print(f"[INFO] Creating side table {full_side_table}")
+        if dry_run:
+            print(f"[DRY RUN] Would execute: {stmt}")
+        else:
+            cur.execute(stmt)
+    pool.putconn(conn)
+
+    # The side table's rows are only the key and the vector: one family
+    ensure_vector_column(pool, schema_name, side_table, pk, output_column, dry_run, verbose, family=False, defer_index=defer_index, hash_buckets=hash_buckets)
+
+    # The rows that exist already; the insert trigger adds the new ones
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        stmt = f"""
+            INSERT INTO {full_side_table} ("{pk}")
+            SELECT "{pk}" FROM {full_table_name}
+            ON CONFLICT ("{pk}") DO NOTHING
+        """
+        print(f"[INFO] Adding the rows of {full_table_name} to {full_side_table}")
+        if dry_run:
+            print(f"[DRY RUN] Would execute: {stmt}")
+        else:
+            cur.execute(stmt)
+    pool.putconn(conn)
+
+
+
+def queue_table_name(table_name: str, output_column: str) -> str:
+    """The work queue of table.output_column with instrument --queue.
+
+    The name is unqualified: it lives in the parent table's schema.
+    """
+    return f"{table_name}_{output_column}_queue"
+
+
+
+def is_queued(pool, schema_name, table_name, output_column) -> bool:
+    return get_table_id(pool, schema_name, queue_table_name(table_name, output_column)) is not None
+
+
+
+def ensure_queue_table(pool, schema_name, table_name, pk, pk_type, output_column, dry_run=False, verbose=False, hash_buckets=0):
+    """Creates the work queue of output_column: the keys of the rows to
+    embed, in the order they were queued. The triggers add the rows
+    inserted or whose input changed, and embed deletes them once their
+    vector is written. The rows with no vector yet are queued here.
+
+    With hash_buckets, the queue's order index is hash-sharded, so that the
+    triggers' writes don't all go to the range holding the latest time.
+    """
+    queue_table = queue_table_name(table_name, output_column)
+    full_table_name, full_queue_table = table_name, queue_table
+    if schema_name is not None:
+        full_table_name = f"{schema_name}.{table_name}"
+        full_queue_table = f"{schema_name}.{queue_table}"
+
+    sql = [
+        (
+            f"[INFO] Creating queue table {full_queue_table}",
+            f"""
+                CREATE TABLE IF NOT EXISTS {full_queue_table} (
+                    "{pk}" {pk_type} PRIMARY KEY REFERENCES {full_table_name} ("{pk}") ON DELETE CASCADE,
+                    queued_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    INDEX {queue_table}_queued_at_idx (queued_at ASC) {f"USING HASH WITH (bucket_count = {int(hash_buckets)})" if hash_buckets else ""}
+                )
+            """
+        ),
+        (
+            f"[INFO] Queueing the rows of {full_table_name} with no embeddings",
+            f"""
+                INSERT INTO {full_queue_table} ("{pk}")
+                SELECT "{pk}" FROM {full_table_name}
+                WHERE "{output_column}" IS NULL
+                ON CONFLICT ("{pk}") DO NOTHING
+            """
+        )
+    ]
+
+    conn = main_get_conn(pool)
+
+    for stmt in sql:
+        with conn.cursor() as cur:
+            print(stmt[0])
+            if dry_run:
+                print(f"[DRY RUN] Would execute: {stmt[1]}")
+            else:
+                cur.execute(stmt[1])
+
+    pool.putconn(conn)
+
+
 
 def drop_vector_column(
             pool, schema_name, table_name, pk, output_column,
@@ -124,10 +570,26 @@ def drop_vector_column(
     sql = []
     vector_dim = model.embedding_dim()
 
+    # The indexes live with the vectors: on the side table, if any
+    side_table = None
+    if is_side_table(pool, schema_name, table_name, output_column):
+        side_table = side_table_name(table_name, output_column)
+        if schema_name is not None:
+            side_table = f"{schema_name}.{side_table}"
+
+    queue_table = None
+    if is_queued(pool, schema_name, table_name, output_column):
+        queue_table = queue_table_name(table_name, output_column)
+        if schema_name is not None:
+            queue_table = f"{schema_name}.{queue_table}"
+
     table_name_orig = table_name
     if schema_name is not None:
         table_name = f"{schema_name}.{table_name}"
 
+    if side_table is not None:
+        table_name = side_table
+
     if green_idx:
         sql.append(
             (
@@ -153,9 +615,79 @@ def drop_vector_column(
                 '''
             )
         )
+        sql.append(
+            (
+                "[INFO] Dropping index to locate the changed rows with no embeddings",
+                f'''
+                DROP INDEX IF EXISTS {table_name}@{change_column_name(output_column)}_idx
+                '''
+            )
+        )
 
     if green_embed:
-        if is_vector_column(pool, schema_name, table_name_orig, output_column, vector_dim, verbose):
+        # Left by embed --quarantine, if it ran
+        base_table = table_name_orig if schema_name is None else f"{schema_name}.{table_name_orig}"
+        quarantine_trigger = quarantine_trigger_name(base_table, output_column)
+        sql.append(
+            (
+                f"[INFO] Dropping trigger {quarantine_trigger}",
+                f"""
+                DROP TRIGGER IF EXISTS {quarantine_trigger} ON {base_table}
+                """
+            )
+        )
+        sql.append(
+            (
+                f"[INFO] Dropping function {quarantine_trigger}",
+                f"""
+                DROP FUNCTION IF EXISTS {quarantine_trigger}
+                """
+            )
+        )
+
+        if is_chunked(pool, schema_name, table_name_orig, output_column):
+            chunk_table = chunk_table_name(table_name_orig, output_column)
+            if schema_name is not None:
+                chunk_table = f"{schema_name}.{chunk_table}"
+            sql.append(
+                (
+                    f"[INFO] Dropping chunk table {chunk_table}",
+                    f"""
+                    DROP TABLE IF EXISTS {chunk_table}
+                    """
+                )
+            )
+
+        if queue_table is not None:
+            sql.append(
+                (
+                    f"[INFO] Dropping queue table {queue_table}",
+                    f"""
+                    DROP TABLE IF EXISTS {queue_table}
+                    """
+                )
+            )
+
+        if side_table is not None:
+            sql.append(
+                (
+                    f"[INFO] Dropping side table {side_table}",
+                    f"""
+                    DROP TABLE IF EXISTS {side_table}
+                    """
+                )
+            )
+
+        elif is_vector_column(pool, schema_name, table_name_orig, output_column, vector_dim, verbose):
+            if is_change_tracked(pool, schema_name, table_name_orig, output_column):
+                sql.append(
+                    (
+                        f"[INFO] Dropping column {change_column_name(output_column)}",
+                        f"""
+                        ALTER TABLE {table_name} DROP COLUMN {change_column_name(output_column)}
+                        """
+                    )
+                )
             sql.append(
                 (
                     f"[INFO] Dropping vector column {output_column} VECTOR({vector_dim})",
@@ -180,6 +712,155 @@ def drop_vector_column(
 
 
 
+# Rows copied per transaction by migrate_vector_family()
+MIGRATE_BATCH_SIZE = 1000
+
+
+def _copy_vectors(
+            pool, table_name, pk, pk_type, from_column, to_column,
+            only_missing=False, dry_run=False, verbose=False
+        ) -> int:
+    """Copies from_column into to_column in primary key order, one batch
+    per transaction. Returns the number of rows copied.
+    """
+    conditions = [f'"{from_column}" IS NOT NULL']
+    if only_missing:
+        conditions.append(f'"{to_column}" IS NULL')
+
+    def _stmt(after):
+        return f"""
+            UPDATE {table_name} SET "{to_column}" = "{from_column}"
+            WHERE {' AND '.join(conditions + after)}
+            ORDER BY "{pk}"
+            LIMIT {MIGRATE_BATCH_SIZE}
+            RETURNING "{pk}"
+        """
+
+    if dry_run:
+        print(f"[DRY RUN] Would execute, until no row is left: {_stmt([])}")
+        return 0
+
+    copied = 0
+    after = None
+
+    conn = main_get_conn(pool)
+    while True:
+        with conn.cursor() as cur:
+            if after is None:
+                cur.execute(_stmt([]))
+            else:
+                cur.execute(_stmt([f'"{pk}" > %s::{pk_type}']), (after,))
+            keys = [r[0] for r in cur.fetchall()]
+
+        if not keys:
+            break
+
+        copied += len(keys)
+        after = max(keys)
+
+        if verbose:
+            print(f"[INFO] Copied {copied} vectors")
+    pool.putconn(conn)
+
+    return copied
+
+
+
+def migrate_vector_family(pool, schema_name, table_name, pk, pk_type, source_column, output_column, dry_run=False, verbose=False, defer_index=False):
+    """Moves an existing vector column into its own column family.
+
+    A column can't change family in place: the vectors are copied to a new
+    column created in the family, which then replaces the old one. The
+    update trigger resets both columns while the vectors are copied.
+    """
+    if has_own_family(pool, schema_name, table_name, output_column):
+        print(f"[INFO] Column {output_column} already has its own column family")
+        return
+
+    vector_dim = model.embedding_dim()
+    new_column = f"{output_column}_migrating"
+
+    # The indexes are built again as they are
+    hash_buckets = vector_index_buckets(pool, schema_name, table_name, pk, output_column)
+
+    full_table_name = table_name
+    if schema_name is not None:
+        full_table_name = f"{schema_name}.{table_name}"
+
+    # The trigger entry of the column, which may differ from -i
+    config = read_trigger_function(pool, schema_name, table_name)
+    inputs = [c['input'] for c in config if output_column in c['output'] + c.get('queue', [])]
+    if inputs:
+        source_column = inputs[0]
+
+    def _execute(msg, stmt):
+        print(msg)
+        if dry_run:
+            print(f"[DRY RUN] Would execute: {stmt}")
+            return
+        conn = main_get_conn(pool)
+        with conn.cursor() as cur:
+            cur.execute(stmt)
+        pool.putconn(conn)
+
+    def _install(config, drop=False):
+        if dry_run:
+            print(f"[DRY RUN] Would update the trigger to reset: {config}")
+            return
+        install_trigger(pool, update_trigger_sql(config, schema_name, table_name, pk, drop=drop))
+
+    print(f"[WARN] Stop 'embed' on {full_table_name}.{output_column} until the migration is done")
+
+    # 1. The new column, reset by the trigger along with the old one
+    config = update_trigger_func_add_column(config, source_column, new_column)
+    _install(config)
+
+    _execute(
+        f"[INFO] Adding column {new_column} VECTOR({vector_dim}) in family {vector_family_name(output_column)}",
+        f"""
+            ALTER TABLE {full_table_name}
+            ADD COLUMN IF NOT EXISTS "{new_column}" VECTOR({vector_dim})
+            CREATE IF NOT EXISTS FAMILY "{vector_family_name(output_column)}"
+        """
+    )
+
+    # 2. The vectors, then the ones written or reset while they were copied
+    copied = _copy_vectors(pool, full_table_name, pk, pk_type, output_column, new_column, False, dry_run, verbose)
+    copied += _copy_vectors(pool, full_table_name, pk, pk_type, output_column, new_column, True, dry_run, verbose)
+    print(f"[INFO] Copied {copied} vectors to {new_column}")
+
+    # 3. Only the new column is reset from now on: drop the old one
+    config = update_trigger_func_drop_column(config, source_column, output_column)
+    _install(config)
+
+    drop_vector_column(pool, schema_name, table_name, pk, output_column, True, False, dry_run, verbose)
+    _execute(
+        f"[INFO] Dropping column {output_column}",
+        f"ALTER TABLE {full_table_name} DROP COLUMN \"{output_column}\""
+    )
+
+    # 4. The column under its name, reset by the trigger throughout
+    changed = is_change_tracked(pool, schema_name, table_name, output_column)
+    queued = is_queued(pool, schema_name, table_name, output_column)
+    detached = update_trigger_func_drop_column(config, source_column, new_column)
+    config = update_trigger_func_add_column(detached, source_column, output_column, changed=changed, queue=queued)
+
+    print(f"[INFO] Renaming column {new_column} to {output_column}")
+    rename_under_trigger(
+        pool, schema_name, table_name, pk,
+        [f"ALTER TABLE {full_table_name} RENAME COLUMN \"{new_column}\" TO \"{output_column}\""],
+        detached, config,
+        [(output_column, changed, queued)],
+        dry_run
+    )
+
+    # 5. The indexes, on the column in its family
+    ensure_vector_column(pool, schema_name, table_name, pk, output_column, dry_run, verbose, defer_index=defer_index, hash_buckets=hash_buckets)
+    if changed:
+        ensure_change_column(pool, schema_name, table_name, output_column, dry_run, verbose, hash_buckets=hash_buckets)
+
+
+
 
 def run_instrument(args: dict):
     global model
@@ -189,22 +870,231 @@ def run_instrument(args: dict):
     atexit.register(conn_pool.closeall)
 
     primary_key, primary_key_type = get_primary_key_column(conn_pool, args['schema'], args['table'])
-    ensure_vector_column(
+
+    side = args['storage'] == "side-table"
+    if side and args['chunked']:
+        raise RuntimeError("--chunked is not supported with --storage side-table")
+    if side and args['track_changes']:
+        raise RuntimeError("--track-changes is not supported with --storage side-table")
+    if args['queue'] and (side or args['track_changes']):
+        raise RuntimeError("--queue is not supported with --storage side-table or --track-changes")
+
+    # One storage per vector column
+    if side and is_vector_column(conn_pool, args['schema'], args['table'], args['embedding'], model.embedding_dim()):
+        raise RuntimeError(f"Column {args['embedding']} already exists in {args['table']}: it can't be moved to a side table")
+    if not side and is_side_table(conn_pool, args['schema'], args['table'], args['embedding']):
+        raise RuntimeError(f"{args['embedding']} is stored in the side table {side_table_name(args['table'], args['embedding'])}")
+
+    if side:
+        ensure_side_table(
+            conn_pool,
+            args['schema'],
+            args['table'],
+            primary_key, primary_key_type,
+            args['embedding'],
+            False,
+            args['verbose'],
+            defer_index=args['defer_index'],
+            hash_buckets=args['hash_buckets']
+        )
+    else:
+        if is_vector_column(conn_pool, args['schema'], args['table'], args['embedding'], model.embedding_dim()) \
+                and not has_own_family(conn_pool, args['schema'], args['table'], args['embedding']):
+            if args['migrate_family']:
+                migrate_vector_family(
+                    conn_pool,
+                    args['schema'],
+                    args['table'],
+                    primary_key, primary_key_type,
+                    args['source'],
+                    args['embedding'],
+                    False,
+                    args['verbose'],
+                    defer_index=args['defer_index']
+                )
+            else:
+                print(
+                    f"[WARN] Column {args['embedding']} shares its column family with other columns: "
+                    f"every vector write rewrites the row. Run 'instrument --migrate-family' to move it."
+                )
+
+        ensure_vector_column(
+            conn_pool,
+            args['schema'],
+            args['table'],
+            primary_key,
+            args['embedding'],
+            False,
+            args['verbose'],
+            defer_index=args['defer_index'],
+            hash_buckets=args['hash_buckets']
+        )
+
+        if args['track_changes']:
+            ensure_change_column(
+                conn_pool,
+                args['schema'],
+                args['table'],
+                args['embedding'],
+                False,
+                args['verbose'],
+                hash_buckets=args['hash_buckets']
+            )
+
+        if args['queue']:
+            ensure_queue_table(
+                conn_pool,
+                args['schema'],
+                args['table'],
+                primary_key, primary_key_type,
+                args['embedding'],
+                False,
+                args['verbose'],
+                hash_buckets=args['hash_buckets'] or 0
+            )
+
+    if args['chunked']:
+        ensure_chunk_table(
+            conn_pool,
+            args['schema'],
+            args['table'],
+            primary_key, primary_key_type,
+            args['embedding'],
+            False,
+            args['verbose'],
+            defer_index=args['defer_index']
+        )
+
+    set_vector_model(
         conn_pool,
         args['schema'],
-        args['table'],
-        primary_key,
+        side_table_name(args['table'], args['embedding']) if side else args['table'],
         args['embedding'],
-        False,
-        args['verbose']
+        args['model']
     )
 
     trigger_config = read_trigger_function(conn_pool, args['schema'], args['table'])
 
-    config = update_trigger_func_add_column(trigger_config, args['source'], args['embedding'])
-    trg_func_sql = update_trigger_sql(config, args['schema'], args['table'])
+    changed = not side and is_change_tracked(conn_pool, args['schema'], args['table'], args['embedding'])
+    queued = not side and is_queued(conn_pool, args['schema'], args['table'], args['embedding'])
+    config = update_trigger_func_add_column(trigger_config, args['source'], args['embedding'], side, changed, queued)
+
+    if args['trigger_strategy'] is not None:
+        config = set_trigger_strategy(config, args['trigger_strategy'])
+
+    trg_func_sql = update_trigger_sql(config, args['schema'], args['table'], primary_key)
     install_trigger(conn_pool, trg_func_sql)
 
+    if side or queued:
+        trg_func_sql = insert_trigger_sql(config, args['schema'], args['table'], primary_key)
+        install_trigger(conn_pool, trg_func_sql)
+
+    return None
+
+
+
+def index_coverage(pool, schema_name, table_name, output_column) -> tuple[int, int]:
+    """(embedded rows, rows) of the column. Read at a follower read
+    timestamp, so that polling doesn't contend with the backfill.
+    """
+    if schema_name is not None:
+        table_name = f"{schema_name}.{table_name}"
+
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT count("{output_column}"), count(*)
+            FROM {table_name} AS OF SYSTEM TIME follower_read_timestamp()
+        """)
+        embedded, total = cur.fetchone()
+    pool.putconn(conn)
+
+    return embedded, total
+
+
+
+def index_build_jobs(pool, index_names) -> list[tuple[str, float]]:
+    """The schema change jobs building one of the indexes, as
+    (description, fraction completed).
+    """
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT description, coalesce(fraction_completed, 0)
+            FROM crdb_internal.jobs
+            WHERE job_type IN ('SCHEMA CHANGE', 'NEW SCHEMA CHANGE')
+                AND status IN ('pending', 'running')
+        """)
+        jobs = cur.fetchall()
+    pool.putconn(conn)
+
+    return [(d, f) for d, f in jobs if any(name in d for name in index_names)]
+
+
+
+def run_build_index(args: dict):
+    global model
+    model = importlib.import_module(f"{__package__.split('.')[0]}.models.{args['model']}")
+
+    # The build runs in a thread, while the main one polls its progress
+    conn_pool = ThreadedConnectionPool(minconn=1, maxconn=3, **build_conn_kwargs(args['url']))
+    atexit.register(conn_pool.closeall)
+
+    schema_name, table_name, output_column = args['schema'], args['table'], args['embedding']
+
+    primary_key, primary_key_type = get_primary_key_column(conn_pool, schema_name, table_name)
+
+    vector_table = vector_table_name(conn_pool, schema_name, table_name, output_column)
+    if not is_vector_column(conn_pool, schema_name, vector_table, output_column, model.embedding_dim(), args['verbose']):
+        raise RuntimeError(f"Column {output_column} doesn't exist. Run 'instrument' first.")
+
+    # The index is built once the backfill is (nearly) done: the rows
+    # embedded after that pay the incremental index maintenance
+    while True:
+        embedded, total = index_coverage(conn_pool, schema_name, vector_table, output_column)
+        coverage = float(embedded) / total if total else 1.0
+        print(f"[INFO] {embedded}/{total} rows embedded ({coverage:.1%})", flush=True)
+
+        if coverage >= args['min_coverage']:
+            break
+
+        if not args['wait']:
+            print(f"[WARN] Below --min-coverage {args['min_coverage']:.0%}: run 'embed' or 'backfill' first, or use --wait")
+            return None
+
+        time.sleep(args['poll_interval'])
+
+    chunked = is_chunked(conn_pool, schema_name, table_name, output_column)
+
+    index_names = [f"{output_column}_idx", f"{output_column}_{primary_key}_not_null_idx"]
+    if chunked:
+        index_names.append(f"{chunk_table_name(table_name, output_column)}_idx")
+
+    errors = []
+
+    def _build():
+        try:
+            ensure_vector_column(conn_pool, schema_name, vector_table, primary_key, output_column, False, args['verbose'])
+            if chunked:
+                ensure_chunk_table(conn_pool, schema_name, table_name, primary_key, primary_key_type, output_column, False, args['verbose'])
+        except Exception as e:
+            errors.append(e)
+
+    start = time.time()
+    builder = threading.Thread(target=_build, name="build-index", daemon=True)
+    builder.start()
+
+    while builder.is_alive():
+        builder.join(args['poll_interval'])
+        if builder.is_alive():
+            for description, fraction in index_build_jobs(conn_pool, index_names):
+                print(f"[INFO] {fraction:.0%} {textwrap.shorten(description, 100)}", flush=True)
+
+    if errors:
+        raise errors[0]
+
+    print(f"[INFO] Indexes built in {time.time() - start:.1f} seconds")
+
     return None
 
 
@@ -221,16 +1111,22 @@ def run_cleanup(args: dict):
     conn_pool = SimpleConnectionPool(minconn=1, maxconn=2, **build_conn_kwargs(args['url']))
     atexit.register(conn_pool.closeall)
 
+    primary_key, primary_key_type = get_primary_key_column(conn_pool, args['schema'], args['table'])
+
     trigger_config = read_trigger_function(conn_pool, args['schema'], args['table'])
+    had_insert_trigger = any(args['embedding'] in c.get('side', []) + c.get('queue', []) for c in trigger_config)
     config = update_trigger_func_drop_column(
                                                 trigger_config,
                                                 args['source'], args['embedding']
                                             )
     
-    trg_func_sql = update_trigger_sql(config, args['schema'], args['table'], drop=True)
+    trg_func_sql = update_trigger_sql(config, args['schema'], args['table'], primary_key, drop=True)
     install_trigger(conn_pool, trg_func_sql)
 
-    primary_key, primary_key_type = get_primary_key_column(conn_pool, args['schema'], args['table'])
+    # Keeps the insert trigger if other side or queue tables still need it
+    if had_insert_trigger:
+        trg_func_sql = insert_trigger_sql(config, args['schema'], args['table'], primary_key)
+        install_trigger(conn_pool, trg_func_sql)
     drop_vector_column(
         conn_pool,
         args['schema'],
@@ -279,34 +1175,165 @@ def cleanup_confirm(schema_name, table_name, source_col, vector_col):
 
 
 
+# How the update trigger detects a change of the input:
+#   neq:      (NEW).input <> (OLD).input, in the function only (the original
+#             trigger, and the default: a NULL input on either side is no
+#             change)
+#   distinct: (NEW).input IS DISTINCT FROM (OLD).input, also as the trigger's
+#             WHEN condition: updates that leave the inputs alone don't call
+#             the function at all, and a NULL old or new input is a change
+TRIGGER_STRATEGIES = ("neq", "distinct")
+DEFAULT_TRIGGER_STRATEGY = "neq"
+
+
+def set_trigger_strategy(config, strategy):
+    """Sets the change detection of all the inputs: the WHEN condition
+    covers the whole trigger, so they all use the same.
+    """
+    for c in config:
+        c['strategy'] = strategy
+    return config
+
+
+
+def execute_trigger_sql(cur, sql):
+    cur.execute(sql[0])
+    if cur.fetchone()[0]:
+        print("[INFO] Dropping trigger...")
+        cur.execute(sql[1])
+
+    if sql[2]:
+        print("[INFO] Updating trigger function...")
+        cur.execute(sql[2])
+
+    if sql[3]:
+        print("[INFO] Creating trigger...")
+        cur.execute(sql[3])
+
+
+
 def install_trigger(pool, sql):
     conn = main_get_conn(pool)
 
     with conn.cursor() as cur:
-        cur.execute(sql[0])
-        if cur.fetchone()[0]:
-            print(f"[INFO] Dropping trigger...")
-            cur.execute(sql[1])
+        execute_trigger_sql(cur, sql)
 
-        if sql[2]:
-            print(f"[INFO] Updating trigger function...")
-            cur.execute(sql[2])
+    pool.putconn(conn)
 
-        if sql[3]:
-            print(f"[INFO] Creating trigger...")
-            cur.execute(sql[3])
 
 
+def reset_rows_written(pool, schema_name, table_name, pk, output_column, since, until, changed=False, queued=False) -> int:
+    """Resets the vector of the rows written between the cluster timestamps
+    since and until, while the trigger may have been missing: their input
+    may have changed without the vector being reset. A queued column gets
+    the rows queued again instead. Returns the rows reset.
+    """
+    full_table_name = table_name
+    queue_table = queue_table_name(table_name, output_column)
+    if schema_name is not None:
+        full_table_name = f"{schema_name}.{table_name}"
+        queue_table = f"{schema_name}.{queue_table}"
+
+    window = f"crdb_internal_mvcc_timestamp > {since} AND crdb_internal_mvcc_timestamp <= {until}"
+
+    if queued:
+        stmt = f"""
+            INSERT INTO {queue_table} ("{pk}")
+            SELECT "{pk}" FROM {full_table_name} WHERE {window}
+            ON CONFLICT ("{pk}") DO NOTHING
+        """
+    else:
+        set_clause = f'"{output_column}" = NULL'
+        if changed:
+            set_clause += f', "{change_column_name(output_column)}" = now()'
+        stmt = f"""
+            UPDATE {full_table_name} SET {set_clause}
+            WHERE "{output_column}" IS NOT NULL AND {window}
+        """
+
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        cur.execute(stmt)
+        count = cur.rowcount
+    pool.putconn(conn)
+
+    if count > 0:
+        print(f"[INFO] Reset {count} rows of {output_column} written while the trigger was being updated")
+
+    return count
+
+
+
+def rename_under_trigger(pool, schema_name, table_name, pk, renames, detached, attached, resets, dry_run=False):
+    """Runs the renames of columns the trigger refers to.
+
+    The trigger can't refer to a column while it's renamed: it's installed
+    with the detached config, the columns renamed, and installed again with
+    the attached one, in one transaction. An update of the input sees the
+    trigger as it was before or after, never without the columns.
+
+    If the transaction is refused, the steps run one by one, and the rows
+    written in between get reset_rows_written() for each (output column,
+    changed, queued) of resets.
+    """
+    if dry_run:
+        print(f"[DRY RUN] Would update the trigger to reset: {detached}")
+        for stmt in renames:
+            print(f"[DRY RUN] Would execute: {stmt}")
+        print(f"[DRY RUN] Would update the trigger to reset: {attached}")
+        return
+
+    conn = main_get_conn(pool)
+    with conn.cursor() as cur:
+        cur.execute("BEGIN")
+        try:
+            execute_trigger_sql(cur, update_trigger_sql(detached, schema_name, table_name, pk, drop=True))
+            for stmt in renames:
+                cur.execute(stmt)
+            execute_trigger_sql(cur, update_trigger_sql(attached, schema_name, table_name, pk))
+            cur.execute("COMMIT")
+            pool.putconn(conn)
+            return
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK")
+            print(f"[WARN] Can't rename the columns and update the trigger in one transaction: {str(e).strip()}")
+
+        cur.execute("SELECT cluster_logical_timestamp()")
+        since = cur.fetchone()[0]
+
+        execute_trigger_sql(cur, update_trigger_sql(detached, schema_name, table_name, pk, drop=True))
+        try:
+            cur.execute("BEGIN")
+            try:
+                for stmt in renames:
+                    cur.execute(stmt)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        finally:
+            # Whichever columns now have the names are reset again
+            execute_trigger_sql(cur, update_trigger_sql(attached, schema_name, table_name, pk))
+
+        cur.execute("SELECT cluster_logical_timestamp()")
+        until = cur.fetchone()[0]
     pool.putconn(conn)
 
+    for output_column, changed, queued in resets:
+        reset_rows_written(pool, schema_name, table_name, pk, output_column, since, until, changed, queued)
 
 
-def update_trigger_sql(config, schema_name, table_name, drop = False):
+
+def update_trigger_sql(config, schema_name, table_name, primary_key, drop = False):
     if schema_name is not None:
         trigger_name = f"clear_vector_on_update_{schema_name}_{table_name}"
+        side_tables = {out: f"{schema_name}.{side_table_name(table_name, out)}" for c in config for out in c.get('side', [])}
+        queue_tables = {out: f"{schema_name}.{queue_table_name(table_name, out)}" for c in config for out in c.get('queue', [])}
         table_name = f"{schema_name}.{table_name}"
     else:
         trigger_name = f"clear_vector_on_update_{table_name}"
+        side_tables = {out: side_table_name(table_name, out) for c in config for out in c.get('side', [])}
+        queue_tables = {out: queue_table_name(table_name, out) for c in config for out in c.get('queue', [])}
 
 
     sql_tmpl = [
@@ -330,8 +1357,11 @@ def update_trigger_sql(config, schema_name, table_name, drop = False):
 
                 BEGIN
                     {% for item in config %}
-                    IF (NEW).{{ item.input }} <> (OLD).{{ item.input }} THEN
+                    IF {% if item.strategy == 'neq' %}(NEW).{{ item.input }} <> (OLD).{{ item.input }}{% else %}(NEW).{{ item.input }} IS DISTINCT FROM (OLD).{{ item.input }}{% endif %} THEN
                         {% for out in item.output %}NEW.{{ out }} := NULL;
+                        {% if out in item.changed %}NEW.{{ out }}_changed := now();
+                        {% endif %}{% endfor %}{% for out in item.side %}INSERT INTO {{ side_tables[out] }} ({{ primary_key }}, {{ out }}) VALUES ((NEW).{{ primary_key }}, NULL) ON CONFLICT ({{ primary_key }}) DO UPDATE SET {{ out }} = NULL;
+                        {% endfor %}{% for out in item.queue %}INSERT INTO {{ queue_tables[out] }} AS q ({{ primary_key }}) VALUES ((NEW).{{ primary_key }}) ON CONFLICT ({{ primary_key }}) DO UPDATE SET queued_at = q.queued_at;
                         {% endfor %}
                     END IF;
 
@@ -349,19 +1379,32 @@ def update_trigger_sql(config, schema_name, table_name, drop = False):
         )
 
     
-    if not drop:
+    # Cleaning up one column keeps the trigger for the others
+    if not drop or config:
         sql_tmpl.append(
             """
                 CREATE TRIGGER {{ trigger_name }}
                 BEFORE UPDATE ON {{ table_name }}
                 FOR EACH ROW
-                EXECUTE FUNCTION {{ trigger_name }}();
+                {% if when %}WHEN ({% for item in config %}{% if not loop.first %} OR {% endif %}OLD.{{ item.input }} IS DISTINCT FROM NEW.{{ item.input }}{% endfor %})
+                {% endif %}EXECUTE FUNCTION {{ trigger_name }}();
             """
         )
     else:
         sql_tmpl.append(None)
     
 
+    config = [
+        dict(
+            c,
+            side=c.get('side', []),
+            changed=c.get('changed', []),
+            queue=c.get('queue', []),
+            strategy=c.get('strategy', DEFAULT_TRIGGER_STRATEGY)
+        )
+        for c in config
+    ]
+
     sql = []
     for tmpl in sql_tmpl:
         if tmpl is not None:
@@ -371,7 +1414,11 @@ def update_trigger_sql(config, schema_name, table_name, drop = False):
                     template.render(
                         trigger_name=trigger_name,
                         table_name=table_name, 
-                        config=config
+                        config=config,
+                        primary_key=primary_key,
+                        side_tables=side_tables,
+                        queue_tables=queue_tables,
+                        when=bool(config) and all(c['strategy'] == 'distinct' for c in config)
                     )
                 )
             )
@@ -382,24 +1429,116 @@ def update_trigger_sql(config, schema_name, table_name, drop = False):
 
 
 
+def insert_trigger_sql(config, schema_name, table_name, primary_key):
+    """The trigger that adds a row to the side tables, and queues it in the
+    queue tables, for each new row of the table. Dropped when the table has
+    neither left.
+    """
+    side_tables = [side_table_name(table_name, out) for c in config for out in c.get('side', [])]
+    queue_tables = [queue_table_name(table_name, out) for c in config for out in c.get('queue', [])]
+
+    if schema_name is not None:
+        trigger_name = f"create_vector_rows_on_insert_{schema_name}_{table_name}"
+        side_tables = [f"{schema_name}.{t}" for t in side_tables]
+        queue_tables = [f"{schema_name}.{t}" for t in queue_tables]
+        table_name = f"{schema_name}.{table_name}"
+    else:
+        trigger_name = f"create_vector_rows_on_insert_{table_name}"
+
+    sql_tmpl = [
+        """
+            SELECT count(*) FROM pg_catalog.pg_trigger
+            WHERE tgname='{{ trigger_name }}'; 
+        """,
+        """
+            DROP TRIGGER IF EXISTS {{ trigger_name }}
+            ON {{ table_name }};
+        """
+    ]
+
+    if side_tables or queue_tables:
+        sql_tmpl += [
+            """
+                CREATE OR REPLACE FUNCTION {{ trigger_name }}()
+                RETURNS trigger
+                LANGUAGE plpgsql
+                AS $$
 
-def update_trigger_func_add_column(config, source_column, vector_column):
+                BEGIN
+                    {% for side_table in side_tables %}INSERT INTO {{ side_table }} ({{ primary_key }}) VALUES ((NEW).{{ primary_key }}) ON CONFLICT ({{ primary_key }}) DO NOTHING;
+                    {% endfor %}{% for queue_table in queue_tables %}INSERT INTO {{ queue_table }} ({{ primary_key }}) VALUES ((NEW).{{ primary_key }}) ON CONFLICT ({{ primary_key }}) DO NOTHING;
+                    {% endfor %}
+                    RETURN NEW;
+                END;
+                $$;
+            """,
+            """
+                CREATE TRIGGER {{ trigger_name }}
+                AFTER INSERT ON {{ table_name }}
+                FOR EACH ROW
+                EXECUTE FUNCTION {{ trigger_name }}();
+            """
+        ]
+    else:
+        sql_tmpl += [
+            """
+                DROP FUNCTION IF EXISTS {{ trigger_name }}
+            """,
+            None
+        ]
+
+    return [
+        textwrap.dedent(
+            Template(tmpl).render(
+                trigger_name=trigger_name,
+                table_name=table_name,
+                side_tables=side_tables,
+                queue_tables=queue_tables,
+                primary_key=primary_key
+            )
+        ) if tmpl is not None else None
+        for tmpl in sql_tmpl
+    ]
+
+
+
+
+def update_trigger_func_add_column(config, source_column, vector_column, side=False, changed=False, queue=False):
     new_config = config
 
+    # Side table outputs are reset in their side table, queued outputs keep
+    # their vector and are queued instead
+    key = 'side' if side else 'queue' if queue else 'output'
+
     match_source = [(i, c) for i, c in enumerate(config) if c['input'] == source_column]
 
     if match_source:
         i, c = match_source[0]
-        output = c['output']
+        for other in ('output', 'queue'):
+            if other != key and vector_column in c.get(other, []):
+                new_config[i][other] = [o for o in c[other] if o != vector_column]
+
+        output = c.get(key, [])
         if not vector_column in output:
             output.append(vector_column)
-        new_config[i]['output'] = output
+        new_config[i][key] = output
+
+        # --track-changes: the change timestamp is stamped along
+        stamped = c.get('changed', [])
+        if changed and not vector_column in stamped:
+            stamped.append(vector_column)
+        new_config[i]['changed'] = stamped
 
     else:
+        strategies = [c['strategy'] for c in config if 'strategy' in c]
         new_config.append(
             {
+                'strategy': strategies[0] if strategies else DEFAULT_TRIGGER_STRATEGY,
                 'input': source_column,
-                'output': [vector_column]
+                'output': [vector_column] if key == 'output' else [],
+                'side': [vector_column] if side else [],
+                'queue': [vector_column] if key == 'queue' else [],
+                'changed': [vector_column] if changed else []
             }
         )        
 
@@ -416,13 +1555,25 @@ def update_trigger_func_drop_column(config, source_column, vector_column):
     if match_source:
         i, c = match_source[0]
         output = c['output']
+        side = c.get('side', [])
+        queue = c.get('queue', [])
+        stamped = c.get('changed', [])
         if vector_column in output:
             output.remove(vector_column)
-
-        if not output:
+        if vector_column in side:
+            side.remove(vector_column)
+        if vector_column in queue:
+            queue.remove(vector_column)
+        if vector_column in stamped:
+            stamped.remove(vector_column)
+
+        if not output and not side and not queue:
             del new_config[i]
         else:
             new_config[i]['output'] = output
+            new_config[i]['side'] = side
+            new_config[i]['queue'] = queue
+            new_config[i]['changed'] = stamped
 
     return new_config
 
@@ -430,6 +1581,8 @@ def update_trigger_func_drop_column(config, source_column, vector_column):
 
 
 def read_trigger_function(pool, schema_name, table_name) -> dict:
+    queue_prefix = f"{table_name}_"
+
     if schema_name is not None:
         table_name = f"{schema_name}_{table_name}"
 
@@ -477,12 +1630,31 @@ def read_trigger_function(pool, schema_name, table_name) -> dict:
             input_col = re.search(r'\(?NEW\)?\.(\w+)', condition, re.IGNORECASE)
             
             # Extract all output columns from "NEW.colname := NULL"
-            output_cols = re.findall(r'NEW\.(\w+)\s*:=', assignments, re.IGNORECASE)
-            
-            if input_col and output_cols:
+            output_cols = re.findall(r'NEW\.(\w+)\s*:=\s*NULL', assignments, re.IGNORECASE)
+
+            # And the ones stamped with "NEW.colname_changed := now()"
+            changed_cols = re.findall(r'NEW\.(\w+)_changed\s*:=\s*now\(\)', assignments, re.IGNORECASE)
+
+            # And the side table ones from "INSERT INTO side (pk, colname) ..."
+            side_cols = re.findall(
+                r'INSERT\s+INTO\s+[\w."]+\s*\(\s*"?\w+"?\s*,\s*"?(\w+)"?\s*\)',
+                assignments, re.IGNORECASE
+            )
+
+            # And the queued ones from "INSERT INTO table_colname_queue AS q ..."
+            queue_cols = re.findall(
+                rf'INSERT\s+INTO\s+(?:\w+\.)?{re.escape(queue_prefix)}(\w+)_queue\s+AS\s+q\b',
+                assignments, re.IGNORECASE
+            )
+
+            if input_col and (output_cols or side_cols or queue_cols):
                 config.append({
+                    'strategy': 'distinct' if re.search(r'IS\s+DISTINCT\s+FROM', condition, re.IGNORECASE) else 'neq',
                     'input': input_col.group(1),
-                    'output': output_cols
+                    'output': output_cols,
+                    'side': side_cols,
+                    'queue': queue_cols,
+                    'changed': [c for c in changed_cols if c in output_cols]
                 })
 
     return config
@@ -0,0 +1,328 @@
+import os
+import time
+import threading
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from .common import main_get_conn
+
+
+# Prometheus text exposition format, version 0.0.4
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_LOCK = threading.Lock()
+_REGISTRY = []
+_SERVER = None
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+
+    pairs = []
+    for n, v in zip(names, values):
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{n}="{v}"')
+
+    return "{" + ",".join(pairs) + "}"
+
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _REGISTRY.append(self)
+
+    def _key(self, labels) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}"
+        ]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _LOCK:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with _LOCK:
+            self._values[self._key(labels)] = value
+
+    def clear(self):
+        with _LOCK:
+            self._values = {}
+
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _LOCK:
+            counts, total, n = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [c + (1 if value <= b else 0) for c, b in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value, n + 1)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}"
+        ]
+        names = self.labelnames + ("le",)
+        for key, (counts, total, n) in sorted(self._values.items()):
+            for b, c in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (b,))} {c}")
+            lines.append(f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {n}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+
+ROWS_EMBEDDED = Counter(
+    "vectorize_rows_embedded_total",
+    "Rows embedded and written back",
+    ("table", "column")
+)
+STAGE_SECONDS = Histogram(
+    "vectorize_stage_seconds",
+    "Latency of the embed stages (fetch, encode, update)",
+    ("table", "column", "stage")
+)
+UPDATE_RETRIES = Counter(
+    "vectorize_update_retries_total",
+    "batch_update retries after a failed attempt",
+    ("table", "column")
+)
+UPDATE_ERRORS = Counter(
+    "vectorize_update_errors_total",
+    "batch_update calls that failed after all retries",
+    ("table", "column")
+)
+ROWS_FAILED = Counter(
+    "vectorize_rows_failed_total",
+    "Rows the model failed to embed",
+    ("table", "column")
+)
+BACKLOG_ROWS = Gauge(
+    "vectorize_backlog_rows",
+    "Rows waiting for an embedding, counted from the NULL partial index",
+    ("table", "column")
+)
+FRESHNESS_LAG_SECONDS = Gauge(
+    "vectorize_freshness_lag_seconds",
+    "Age of the oldest change waiting for its embedding (instrument --track-changes or --queue)",
+    ("table", "column")
+)
+IDLE_SECONDS = Gauge(
+    "vectorize_idle_seconds",
+    "Seconds since the last batch found work",
+    ("table", "column")
+)
+IDLE_SLEEP_SECONDS = Gauge(
+    "vectorize_idle_sleep_seconds",
+    "Current idle backoff: the next sleep between empty scans",
+    ("table", "column")
+)
+THROTTLE_WORKERS = Gauge(
+    "vectorize_throttle_workers",
+    "Workers the batches are spread over, as throttled by the cluster's load"
+)
+THROTTLE_PAUSE_SECONDS = Gauge(
+    "vectorize_throttle_pause_seconds",
+    "Pause between batches, as throttled by the cluster's load"
+)
+WORKER_RSS_BYTES = Gauge(
+    "vectorize_worker_rss_bytes",
+    "Resident set size of the embed processes",
+    ("pid", "role")
+)
+
+
+
+def render() -> str:
+    with _LOCK:
+        lines = []
+        for metric in _REGISTRY:
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would otherwise flood the daemon's log
+        pass
+
+
+
+def start_metrics_server(port: int):
+    global _SERVER
+    if _SERVER is not None:
+        return
+
+    _SERVER = ThreadingHTTPServer(("", port), _MetricsHandler)
+    thread = threading.Thread(target=_SERVER.serve_forever, name="metrics", daemon=True)
+    thread.start()
+
+
+
+def enabled() -> bool:
+    return _SERVER is not None
+
+
+
+def _rss_bytes(pid) -> int | None:
+    # Linux only; other platforms simply don't report RSS
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+
+def sample_rss():
+    """Records the RSS of this process and of the live worker processes."""
+    if not enabled():
+        return
+
+    WORKER_RSS_BYTES.clear()
+
+    rss = _rss_bytes(os.getpid())
+    if rss is not None:
+        WORKER_RSS_BYTES.set(rss, pid=os.getpid(), role="main")
+
+    for p in multiprocessing.active_children():
+        rss = _rss_bytes(p.pid)
+        if rss is not None:
+            WORKER_RSS_BYTES.set(rss, pid=p.pid, role="worker")
+
+
+
+def table_label(schema_name, table_name) -> str:
+    # The "table" label of all the metrics: the table embedded, as named on
+    # the command line, never its side or queue table
+    return table_name if schema_name is None else f"{schema_name}.{table_name}"
+
+
+
+# Rows counted exactly; past that, the backlog is taken from the table
+# statistics
+BACKLOG_COUNT_LIMIT = 100000
+
+def count_backlog(cur, scan_table, primary_key, output_column, queued=False, limit=BACKLOG_COUNT_LIMIT) -> int:
+    """The rows waiting for an embedding in scan_table: its NULL partial
+    index, or its rows for a queue table, as a follower read.
+
+    The count stops at limit rows, so a large backlog doesn't scan the
+    whole index. Beyond it, the estimate of the latest table statistics is
+    used (NULL vectors, or queued rows), if it is higher.
+    """
+    source = f"{scan_table}@{output_column}_{primary_key}_null_idx WHERE {output_column} IS NULL"
+    if queued:
+        source = scan_table
+
+    cur.execute(f"""
+        SELECT count(*)
+        FROM (SELECT 1 FROM {source} LIMIT {int(limit)}) AS b
+        AS OF SYSTEM TIME follower_read_timestamp()
+    """)
+    count = cur.fetchone()[0]
+
+    if count >= limit:
+        column = primary_key if queued else output_column
+        cur.execute(f"""
+            SELECT {"row_count" if queued else "null_count"}
+            FROM [SHOW STATISTICS FOR TABLE {scan_table}]
+            WHERE column_names = ARRAY['{column}']
+            ORDER BY created DESC
+            LIMIT 1
+        """)
+        row = cur.fetchone()
+        if row is not None and row[0] is not None:
+            count = max(count, row[0])
+
+    return count
+
+
+
+_BACKLOG_CHECKED = {}
+
+def refresh_backlog(
+        pool,
+        schema_name, table_name,
+        primary_key, output_column,
+        interval: float = 30,
+        scan_table: str | None = None,
+        queue_table: str | None = None
+    ):
+    """Counts the NULL partial index, at most once per interval (see
+    count_backlog()).
+
+    scan_table is the table the index is on, when it's not table_name (side
+    table storage). With a queue_table (instrument --queue), its rows are
+    counted instead.
+    """
+    if not enabled():
+        return
+
+    now = time.time()
+    if now - _BACKLOG_CHECKED.get((table_name, output_column), 0) < interval:
+        return
+    _BACKLOG_CHECKED[(table_name, output_column)] = now
+
+    full_scan_table = queue_table or scan_table or table_name
+    if schema_name is not None:
+        full_scan_table = f"{schema_name}.{full_scan_table}"
+
+    conn = main_get_conn(pool)
+    try:
+        with conn.cursor() as cur:
+            backlog = count_backlog(cur, full_scan_table, primary_key, output_column, queued=queue_table is not None)
+            BACKLOG_ROWS.set(backlog, table=table_label(schema_name, table_name), column=output_column)
+    except Exception as e:
+        print(f"[WARN] Backlog estimate failed: {e}", flush=True)
+    finally:
+        pool.putconn(conn)
@@ -0,0 +1,293 @@
+import time
+import atexit
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from psycopg2.pool import SimpleConnectionPool
+from .model import is_valid_model
+from .common import (
+    build_conn_kwargs,
+    parse_gateways,
+    main_get_conn,
+    get_primary_key_column,
+    get_column_families
+)
+from .instrument import (
+    is_vector_column,
+    is_side_table,
+    is_chunked,
+    vector_family_name,
+    vector_index_buckets,
+    vector_column_model,
+    set_vector_model,
+    shadow_column_name,
+    change_column_name,
+    is_change_tracked,
+    ensure_change_column,
+    is_queued,
+    ensure_vector_column,
+    drop_vector_column,
+    read_trigger_function,
+    update_trigger_sql,
+    update_trigger_func_add_column,
+    update_trigger_func_drop_column,
+    install_trigger,
+    rename_under_trigger
+)
+from .throttle import RowRateLimiter
+from . import instrument
+from . import embed
+
+
+
+def free_family_name(pool, schema_name, table_name, column) -> str:
+    """A column family name for the column that no family of the table uses
+    yet. A swapped column keeps its family, named after the shadow column.
+    """
+    families = get_column_families(pool, schema_name, table_name)
+
+    name, n = vector_family_name(column), 2
+    while name in families:
+        name = f"{vector_family_name(column)}_{n}"
+        n += 1
+
+    return name
+
+
+
+def reembed(
+        executor,
+        pool,
+        url, schema_name, table_name,
+        primary_key, primary_key_type,
+        input_column, output_column,
+        batch_size, workers,
+        rate: int = 0,
+        verbose: bool = False
+    ) -> int:
+    """Embeds the NULL rows of output_column until there are none left, at
+    most rate rows per second (0: no limit). Returns the rows embedded.
+    """
+    embedded = 0
+    batch_counter = 1
+    start = time.time()
+
+    limiter = RowRateLimiter(rate) if rate > 0 else None
+
+    while True:
+        ids = embed.fetch_null_vector_ids(pool, schema_name, table_name, output_column, primary_key, batch_size)
+        if not ids:
+            break
+
+        if limiter is not None:
+            limiter.acquire(len(ids))
+
+        update_count, worker_errors, worker_warnings = embed.process_single_batch(
+            executor,
+            pool,
+            url, schema_name, table_name,
+            primary_key, primary_key_type,
+            input_column, output_column,
+            ids,
+            workers,
+            batch_counter,
+            verbose
+        )
+
+        for msg in worker_warnings + worker_errors:
+            print(msg, flush=True)
+
+        # Only rows that fail to embed are left
+        if update_count == 0:
+            raise RuntimeError(f"{len(ids)} rows of {output_column} fail to embed: fix them and run 'migrate-model' again")
+
+        embedded += update_count
+        batch_counter += 1
+
+        if verbose:
+            print(f"[INFO] Embedded {embedded} rows into {output_column} ({embedded / (time.time() - start):.0f} rows/sec)", flush=True)
+
+    return embedded
+
+
+
+def swap_vector_columns(pool, schema_name, table_name, pk, source_column, output_column, shadow_column, config) -> str:
+    """Puts the shadow column and its indexes in place of output_column and
+    its indexes, in one transaction with the trigger update: a query sees
+    either column under the name, never none, and an update of the input
+    resets whichever has it. The old column is renamed, and its name
+    returned.
+    """
+    old_column = f"{output_column}_prev"
+
+    full_table_name = table_name
+    if schema_name is not None:
+        full_table_name = f"{schema_name}.{table_name}"
+
+    def _renames(from_column, to_column):
+        return [
+            f"ALTER TABLE {full_table_name} RENAME COLUMN \"{from_column}\" TO \"{to_column}\"",
+            f"ALTER INDEX IF EXISTS {full_table_name}@{from_column}_idx RENAME TO {to_column}_idx",
+            f"ALTER INDEX IF EXISTS {full_table_name}@{from_column}_{pk}_null_idx RENAME TO {to_column}_{pk}_null_idx",
+            f"ALTER INDEX IF EXISTS {full_table_name}@{from_column}_{pk}_not_null_idx RENAME TO {to_column}_{pk}_not_null_idx"
+        ]
+
+    # The trigger can't refer to the columns while they're renamed
+    detached = update_trigger_func_drop_column(config, source_column, output_column)
+    detached = update_trigger_func_drop_column(detached, source_column, shadow_column)
+
+    changed = is_change_tracked(pool, schema_name, table_name, output_column)
+    attached = update_trigger_func_add_column(detached, source_column, output_column, changed=changed)
+
+    print(f"[INFO] Swapping {shadow_column} in place of {output_column}")
+    rename_under_trigger(
+        pool, schema_name, table_name, pk,
+        _renames(output_column, old_column) + _renames(shadow_column, output_column),
+        detached, attached,
+        [(output_column, changed, False)]
+    )
+
+    return old_column
+
+
+
+def run_migrate_model(args: dict):
+    if not is_valid_model(args['model']):
+        raise RuntimeError(f"Invalid embedding model {args['model']}")
+
+    schema_name, table_name = args['schema'], args['table']
+    output_column = args['output']
+    shadow_column = shadow_column_name(output_column)
+
+    conn_pool = SimpleConnectionPool(minconn=1, maxconn=max(2, args['workers']), **build_conn_kwargs(args['url']))
+    atexit.register(conn_pool.closeall)
+
+    primary_key, primary_key_type = get_primary_key_column(conn_pool, schema_name, table_name)
+
+    if is_side_table(conn_pool, schema_name, table_name, output_column) \
+            or is_chunked(conn_pool, schema_name, table_name, output_column) \
+            or is_queued(conn_pool, schema_name, table_name, output_column):
+        raise RuntimeError("migrate-model is not supported with side table, chunked, or queued columns")
+
+    current_model = vector_column_model(conn_pool, schema_name, table_name, output_column)
+    if current_model == args['model']:
+        print(f"[INFO] {output_column} is already embedded with {args['model']}")
+        return None
+
+    # The input column, from the column's trigger entry
+    config = read_trigger_function(conn_pool, schema_name, table_name)
+    inputs = [c['input'] for c in config if output_column in c['output']]
+    if not inputs:
+        raise RuntimeError(f"Column {output_column} isn't instrumented. Run 'instrument' first.")
+    input_column = inputs[0]
+
+    shadow_model = vector_column_model(conn_pool, schema_name, table_name, shadow_column)
+    if shadow_model is not None and shadow_model != args['model']:
+        raise RuntimeError(
+            f"{output_column} is being migrated to {shadow_model}: finish that migration, "
+            f"or 'cleanup' {shadow_column} first"
+        )
+
+    # The forked workers inherit the model loaded here
+    new_model = importlib.import_module(f"{__package__.split('.')[0]}.models.{args['model']}")
+    instrument.model = new_model
+    embed.model = new_model
+
+    full_table_name = table_name
+    if schema_name is not None:
+        full_table_name = f"{schema_name}.{table_name}"
+
+    print(f"[INFO] Migrating {full_table_name}.{output_column} from {current_model or 'its model'} to {args['model']}")
+
+    # 1. The shadow column, in a family of its own, reset by the trigger
+    # along with the column. Its vector index is built once it's embedded.
+    if not is_vector_column(conn_pool, schema_name, table_name, shadow_column, new_model.embedding_dim()):
+        family = free_family_name(conn_pool, schema_name, table_name, shadow_column)
+        print(f"[INFO] Adding column {shadow_column} VECTOR({new_model.embedding_dim()}) in family {family}")
+        conn = main_get_conn(conn_pool)
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                ALTER TABLE {full_table_name}
+                ADD COLUMN IF NOT EXISTS "{shadow_column}" VECTOR({new_model.embedding_dim()})
+                CREATE IF NOT EXISTS FAMILY "{family}"
+            """)
+        conn_pool.putconn(conn)
+
+    # Its indexes are sharded like the column's
+    hash_buckets = vector_index_buckets(conn_pool, schema_name, table_name, primary_key, output_column)
+    ensure_vector_column(conn_pool, schema_name, table_name, primary_key, shadow_column, verbose=args['verbose'], defer_index=True, hash_buckets=hash_buckets)
+    set_vector_model(conn_pool, schema_name, table_name, shadow_column, args['model'])
+
+    config = update_trigger_func_add_column(config, input_column, shadow_column)
+    install_trigger(conn_pool, update_trigger_sql(config, schema_name, table_name, primary_key))
+
+    # 2. The vectors of the new model, at the given rate
+    embed._MAX_INPUT_CHARS = embed.input_char_limit(conn_pool, schema_name, table_name, input_column)
+
+    gateways = parse_gateways(args['url'])
+    executor = ProcessPoolExecutor(
+        max_workers=min(args['workers'], multiprocessing.cpu_count()),
+        initializer=embed.worker_init,
+        initargs=(args['url'], gateways, len(gateways), multiprocessing.Value('i', 0), None)
+    )
+
+    start = time.time()
+    try:
+        def _reembed():
+            return reembed(
+                executor,
+                conn_pool,
+                args['url'], schema_name, table_name,
+                primary_key, primary_key_type,
+                input_column, shadow_column,
+                args['batch_size'], args['workers'],
+                args['rate'],
+                args['verbose']
+            )
+
+        embedded = _reembed()
+        print(f"[INFO] Embedded {embedded} rows into {shadow_column} in {time.time() - start:.1f} seconds")
+
+        # 3. The search indexes, in one pass, then the rows updated meanwhile
+        ensure_vector_column(conn_pool, schema_name, table_name, primary_key, shadow_column, verbose=args['verbose'], hash_buckets=hash_buckets)
+        embedded = _reembed()
+        if embedded:
+            print(f"[INFO] Embedded {embedded} rows updated while the indexes were built")
+
+    finally:
+        executor.shutdown(wait=True)
+
+    if args['no_swap']:
+        print(f"[INFO] {shadow_column} is embedded: search it with -o {shadow_column}, and run 'migrate-model' again to swap")
+        return None
+
+    # 4. Searches now read the new column, with the model recorded in its
+    # comment. Rows updated since the last pass are embedded by 'embed'.
+    config = read_trigger_function(conn_pool, schema_name, table_name)
+    old_column = swap_vector_columns(
+        conn_pool,
+        schema_name, table_name,
+        primary_key,
+        input_column, output_column, shadow_column,
+        config
+    )
+
+    # 5. The old vectors. The index of the changed rows refers to the old
+    # column: it's built again on the new one.
+    changed = is_change_tracked(conn_pool, schema_name, table_name, output_column)
+
+    drop_vector_column(conn_pool, schema_name, table_name, primary_key, old_column, True, False, False, args['verbose'])
+    print(f"[INFO] Dropping column {old_column}")
+    conn = main_get_conn(conn_pool)
+    with conn.cursor() as cur:
+        if changed:
+            cur.execute(f"DROP INDEX IF EXISTS {full_table_name}@{change_column_name(output_column)}_idx")
+        cur.execute(f"ALTER TABLE {full_table_name} DROP COLUMN IF EXISTS \"{old_column}\"")
+    conn_pool.putconn(conn)
+
+    if changed:
+        ensure_change_column(conn_pool, schema_name, table_name, output_column, verbose=args['verbose'])
+
+    print(f"[INFO] {output_column} is now embedded with {args['model']}: restart 'embed' on it with -m {args['model']}")
+
+    return None
@@ -0,0 +1,452 @@
+import time
+import atexit
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .model import is_valid_model
+from .common import (
+    parse_gateways,
+    discover_gateways,
+    main_get_conn,
+    get_primary_key_column,
+    SpreadConnectionPool,
+    ThreadedSpreadConnectionPool
+)
+from .instrument import (
+    list_instrumented_tables,
+    read_trigger_function,
+    vector_column_model,
+    vector_table_name,
+    shadow_column_name,
+    change_column_name,
+    is_change_tracked,
+    queue_table_name,
+    is_queued,
+    vector_index_buckets,
+    is_vector_column,
+    is_chunked
+)
+from .chunking import model_max_tokens
+from .adaptive import BatchSizeController
+from .quarantine import Quarantine
+from .spool import Spool
+from .throttle import throttle_from_args
+from . import embed
+from . import metrics
+from . import profile
+
+
+# Seconds between two counts of the backlogs, and between two discoveries of
+# the instrumented columns
+BACKLOG_INTERVAL = 30
+DISCOVERY_INTERVAL = 300
+
+
+
+class Target:
+    """An instrumented column, and the settings embed needs for it."""
+
+    def __init__(
+        self,
+        schema_name, table_name,
+        primary_key, primary_key_type,
+        input_column, output_column,
+        model_name,
+        vector_table,
+        chunking, max_input_chars,
+        changed_column, queue_table,
+        hash_buckets,
+        quarantine, controller
+    ):
+        self.schema_name = schema_name
+        self.table_name = table_name
+        self.primary_key = primary_key
+        self.primary_key_type = primary_key_type
+        self.input_column = input_column
+        self.output_column = output_column
+        self.model_name = model_name
+        self.vector_table = vector_table
+        self.chunking = chunking
+        self.max_input_chars = max_input_chars
+        self.changed_column = changed_column
+        self.queue_table = queue_table
+        self.hash_buckets = hash_buckets
+        self.quarantine = quarantine
+        self.controller = controller
+
+        self.backlog = 0
+        self.rows = 0
+
+        # Smooth weighted round robin state
+        self.current = 0
+
+    @property
+    def name(self) -> str:
+        table_name = self.table_name if self.schema_name is None else f"{self.schema_name}.{self.table_name}"
+        return f"{table_name}.{self.output_column}"
+
+
+
+def load_model(model_name: str):
+    """The model plugin, loaded once per process and shared by all the
+    columns that use it.
+    """
+    if model_name not in embed._MODELS:
+        embed._MODELS[model_name] = importlib.import_module(f"{__package__.split('.')[0]}.models.{model_name}")
+    return embed._MODELS[model_name]
+
+
+
+def discover_targets(pool, targets: dict, args: dict) -> list[str]:
+    """Adds the instrumented columns not in targets yet, keyed by
+    (schema, table, output).
+
+    The model of a column is the one instrument recorded in its comment, or
+    -m for the columns instrumented before that.
+
+    Returns:
+        The models loaded for the new columns.
+    """
+    loaded = []
+
+    for schema_name, table_name in list_instrumented_tables(pool):
+        try:
+            primary_key, primary_key_type = get_primary_key_column(pool, schema_name, table_name)
+            config = read_trigger_function(pool, schema_name, table_name)
+        except Exception as e:
+            print(f"[WARN] Skipping {table_name}: {e}", flush=True)
+            continue
+
+        for item in config:
+            for output_column in item['output'] + item.get('side', []) + item.get('queue', []):
+                # The shadow column of a migrate-model run, which embeds it
+                # at its own rate
+                if any(shadow_column_name(o) == output_column for o in item['output']):
+                    continue
+
+                key = (schema_name, table_name, output_column)
+                if key in targets:
+                    # A migrate-model swap changes the column's model
+                    target = targets[key]
+                    model_name = vector_column_model(pool, schema_name, target.vector_table, output_column)
+                    if model_name is None or model_name == target.model_name:
+                        continue
+                    print(f"[INFO] {target.name} is now embedded with {model_name}", flush=True)
+                    del targets[key]
+
+                try:
+                    vector_table = vector_table_name(pool, schema_name, table_name, output_column)
+                    model_name = vector_column_model(pool, schema_name, vector_table, output_column) or args['model']
+
+                    if model_name is None:
+                        raise RuntimeError("no model recorded, re-run 'instrument' or use -m")
+                    if not is_valid_model(model_name):
+                        raise RuntimeError(f"invalid embedding model {model_name}")
+
+                    if model_name not in embed._MODELS:
+                        loaded.append(model_name)
+                    model = load_model(model_name)
+
+                    if not is_vector_column(pool, schema_name, vector_table, output_column, model.embedding_dim()):
+                        raise RuntimeError("the vector column doesn't exist")
+
+                    chunking, max_input_chars = None, None
+                    if is_chunked(pool, schema_name, table_name, output_column):
+                        chunking = {
+                            "max_tokens": args['chunk_tokens'] or model_max_tokens(model),
+                            "overlap_tokens": args['chunk_overlap']
+                        }
+                    else:
+                        # The model's input limit hint
+                        embed.model = model
+                        max_input_chars = embed.input_char_limit(
+                            pool, schema_name, table_name, item['input'], args['max_input_chars']
+                        )
+
+                    changed_column, queue_table = None, None
+                    if vector_table == table_name and is_change_tracked(pool, schema_name, table_name, output_column):
+                        changed_column = change_column_name(output_column)
+                    if vector_table == table_name and is_queued(pool, schema_name, table_name, output_column):
+                        queue_table = queue_table_name(table_name, output_column)
+
+                    hash_buckets = vector_index_buckets(pool, schema_name, vector_table, primary_key, output_column)
+
+                    quarantine = None
+                    if args['quarantine'] > 0:
+                        quarantine = Quarantine(
+                            pool,
+                            schema_name, table_name,
+                            primary_key, primary_key_type,
+                            item['input'], output_column,
+                            args['quarantine'],
+                            args['quarantine_table']
+                        )
+
+                    controller = None
+                    if args['adaptive']:
+                        controller = BatchSizeController(
+                            args['batch_size'],
+                            args['workers'],
+                            args['min_batch_size'],
+                            args['max_batch_size'],
+                            log = args['verbose']
+                        )
+
+                except Exception as e:
+                    print(f"[WARN] Skipping {table_name}.{output_column}: {e}", flush=True)
+                    continue
+
+                target = Target(
+                    schema_name, table_name,
+                    primary_key, primary_key_type,
+                    item['input'], output_column,
+                    model_name,
+                    vector_table,
+                    chunking, max_input_chars,
+                    changed_column, queue_table,
+                    hash_buckets,
+                    quarantine, controller
+                )
+                targets[key] = target
+                print(f"[INFO] Embedding {target.name} from {item['input']} with {model_name}", flush=True)
+
+    return loaded
+
+
+
+def count_backlog(pool, target: Target) -> int:
+    """The target's NULL rows, from its NULL partial index, or its queued
+    rows (see metrics.count_backlog()). The last count if this one fails.
+    """
+    scan_table = target.queue_table or target.vector_table
+    if target.schema_name is not None:
+        scan_table = f"{target.schema_name}.{scan_table}"
+
+    conn = main_get_conn(pool)
+    try:
+        with conn.cursor() as cur:
+            return metrics.count_backlog(cur, scan_table, target.primary_key, target.output_column, queued=target.queue_table is not None)
+    except Exception as e:
+        print(f"[WARN] Backlog count failed for {target.name}: {e}", flush=True)
+        return target.backlog
+    finally:
+        pool.putconn(conn)
+
+
+
+def pick_target(targets: list[Target], batch_size: int) -> Target | None:
+    """Smooth weighted round robin over the targets with a backlog.
+
+    A target's weight is its backlog, so the columns furthest behind get
+    the most batches, interleaved with the others rather than in a burst. A
+    backlog smaller than a batch weighs a full batch: small tables are
+    not starved by large ones.
+    """
+    ready = [t for t in targets if t.backlog > 0]
+    if not ready:
+        return None
+
+    weights = {id(t): max(t.backlog, batch_size) for t in ready}
+    total = sum(weights.values())
+
+    for t in ready:
+        t.current += weights[id(t)]
+
+    best = max(ready, key=lambda t: t.current)
+    best.current -= total
+
+    return best
+
+
+
+def activate(target: Target):
+    """Points the embed settings at the target, for the next batch."""
+    embed.model = embed._MODELS[target.model_name]
+    embed._MODEL_NAME = target.model_name
+    embed._COLUMN_MODEL = target.model_name
+    embed._VECTOR_TABLE = target.vector_table if target.vector_table != target.table_name else None
+    embed._CHUNKING = target.chunking
+    embed._MAX_INPUT_CHARS = target.max_input_chars
+    embed._CHANGED_COLUMN = target.changed_column
+    embed._QUEUE_TABLE = target.queue_table
+    embed._HASH_BUCKETS = target.hash_buckets
+    embed._QUARANTINE = target.quarantine
+
+
+
+def run_embed_all(args: dict):
+    if args['model'] is not None and not is_valid_model(args['model']):
+        raise RuntimeError(f"Invalid embedding model {args['model']}")
+
+    profile_settings = None
+    if args['profile']:
+        profile_settings = profile.enable(args['cprofile'])
+
+    embed._RANGE_WRITERS = args['range_writes']
+    embed._FETCH_ROWS = args['fetch_rows']
+
+    # One pool for all the columns, spread over the gateways
+    if args['range_writes'] > 0:
+        conn_pool = ThreadedSpreadConnectionPool(0, args['workers'] + args['range_writes'], args['url'])
+    else:
+        conn_pool = SpreadConnectionPool(0, args['workers'], args['url'])
+    atexit.register(conn_pool.closeall)
+
+    gateways = parse_gateways(args['url'])
+    preferred = len(gateways)
+    if args['discover'] or args['locality']:
+        gateways, preferred = discover_gateways(conn_pool, args['locality'])
+        if not gateways:
+            raise RuntimeError("No live gateway nodes found")
+        conn_pool.spread_over(gateways, preferred)
+
+    def _executor():
+        # The workers fork with the models loaded so far
+        return ProcessPoolExecutor(
+            max_workers=min(args['workers'], multiprocessing.cpu_count()),
+            initializer=embed.worker_init,
+            initargs=(args['url'], gateways, preferred, multiprocessing.Value('i', 0), profile_settings)
+        )
+
+    if args['spool'] and not args['dry_run']:
+        embed._SPOOL = Spool(args['spool'])
+
+    embed._THROTTLE = throttle_from_args(conn_pool, args)
+
+    if args['metrics_port']:
+        metrics.start_metrics_server(args['metrics_port'])
+        if args['verbose']:
+            print(f"[INFO] Serving metrics on :{args['metrics_port']}/metrics")
+
+    targets = {}
+    executor = None
+
+    last_discovery = 0
+    last_backlog = 0
+
+    batch_counter = 1
+    idle_wait = 0
+    to_sleep = 1
+    max_idle_secs = args['max_idle'] * 60
+
+    start = time.time()
+
+    try:
+        while True:
+            if time.time() - last_discovery >= DISCOVERY_INTERVAL:
+                loaded = discover_targets(conn_pool, targets, args)
+                last_discovery = time.time()
+
+                if not targets:
+                    raise RuntimeError("No instrumented column found. Run 'instrument' first.")
+
+                if loaded and executor is not None:
+                    print(f"[INFO] Restarting the workers to load {', '.join(loaded)}", flush=True)
+                    executor.shutdown(wait=True)
+                    executor = None
+
+            if executor is None:
+                executor = _executor()
+
+                # Vectors left by a failed write, of any column
+                if embed._SPOOL is not None and embed._SPOOL.pending_count():
+                    print(f"[INFO] Replaying the vectors left in {args['spool']}")
+                    embed.replay_spool(conn_pool, embed._SPOOL, verbose=args['verbose'])
+
+            if time.time() - last_backlog >= BACKLOG_INTERVAL:
+                for target in targets.values():
+                    target.backlog = count_backlog(conn_pool, target)
+                    metrics.BACKLOG_ROWS.set(target.backlog, table=metrics.table_label(target.schema_name, target.table_name), column=target.output_column)
+                    if args['verbose']:
+                        print(f"[INFO] Backlog {target.name}: {target.backlog} rows")
+                last_backlog = time.time()
+
+            target = pick_target(targets.values(), args['batch_size'])
+
+            if target is None:
+                if time.time() - last_backlog > 1:
+                    # The backlogs are estimates: count again before idling
+                    last_backlog = 0
+                    continue
+
+                if not args['follow']:
+                    if args['verbose']:
+                        print("[INFO] No work found. Exiting... ")
+                    break
+
+                if idle_wait >= max_idle_secs:
+                    if args['verbose']:
+                        print(f"[INFO] Max idle reached ({args['max_idle']} minutes). Exiting.")
+                    break
+
+                if args['verbose']:
+                    print(f"[INFO] No work found. Sleeping for {to_sleep} secs...")
+
+                time.sleep(to_sleep)
+                idle_wait += to_sleep
+                to_sleep = min(to_sleep * 2, BACKLOG_INTERVAL)
+                continue
+
+            idle_wait = 0
+            to_sleep = 1
+
+            activate(target)
+
+            batch_size = args['batch_size']
+            if target.controller is not None:
+                batch_size = target.controller.batch_size
+
+            ids = embed.fetch_null_vector_ids(
+                conn_pool, target.schema_name, target.table_name,
+                target.output_column, target.primary_key, batch_size
+            )
+            if not ids:
+                target.backlog = 0
+                continue
+
+            try:
+                update_count, worker_errors, worker_warnings = embed.process_single_batch(
+                    executor,
+                    conn_pool,
+                    args['url'], target.schema_name, target.table_name,
+                    target.primary_key, target.primary_key_type,
+                    target.input_column, target.output_column,
+                    ids,
+                    args['workers'],
+                    batch_counter,
+                    args['verbose'],
+                    False,
+                    args['dry_run'],
+                    controller=target.controller
+                )
+            except embed.ColumnModelChanged as e:
+                # Swapped by migrate-model: the target is loaded again with
+                # its new model
+                print(f"[INFO] {e}", flush=True)
+                last_discovery = 0
+                continue
+
+            for msg in worker_warnings + worker_errors:
+                print(msg, flush=True)
+
+            # Until the next count
+            target.backlog = max(0, target.backlog - len(ids))
+            target.rows += update_count
+
+            if args['verbose']:
+                print(f"[INFO] Batch {batch_counter}: {update_count} rows of {target.name}", flush=True)
+
+            batch_counter += 1
+            if args['num_batches'] and batch_counter > args['num_batches']:
+                break
+
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    print(f"Done in {time.time() - start:.1f} seconds")
+    for target in targets.values():
+        if target.rows:
+            print(f"[INFO] {target.name}: {target.rows} rows embedded")
+
+    profile.finish("embed", args['trace'], args['otel'])
@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import time
+import glob
+import shutil
+import cProfile
+import tempfile
+import threading
+import contextlib
+from rich.console import Console
+from rich.table import Table
+
+
+# Per-process profiler. None unless --profile (or one of the options that
+# imply it) is in effect, in which case span() is a no-op.
+_PROFILER = None
+
+
+class Profiler:
+    """Records wall and CPU time per stage.
+
+    Spans are kept as Chrome trace events ('X' complete events, times in
+    microseconds). Worker processes append their events to a file in a
+    directory shared with the main process, which merges them at the end.
+    """
+
+    def __init__(self, parts_dir: str, role: str = "main", cprofile_dir: str | None = None):
+        self.parts_dir = parts_dir
+        self.role = role
+        self.cprofile_dir = cprofile_dir
+        self.events = []
+        self._cprofile = None
+
+        if cprofile_dir:
+            os.makedirs(cprofile_dir, exist_ok=True)
+            self._cprofile = cProfile.Profile()
+
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args):
+        wall = time.time()
+        cpu = time.process_time()
+        try:
+            yield args
+        finally:
+            self.events.append({
+                "name": name,
+                "cat": self.role,
+                "ph": "X",
+                "ts": round(wall * 1e6),
+                "dur": round((time.time() - wall) * 1e6),
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": dict(args, cpu_ms=round((time.process_time() - cpu) * 1e3, 3))
+            })
+
+
+    @contextlib.contextmanager
+    def cprofile(self):
+        if self._cprofile is None:
+            yield
+            return
+
+        self._cprofile.enable()
+        try:
+            yield
+        finally:
+            self._cprofile.disable()
+
+
+    def flush(self):
+        """Appends the recorded events to this process' part file."""
+        if self.events:
+            path = os.path.join(self.parts_dir, f"{self.role}-{os.getpid()}.jsonl")
+            with open(path, "a") as f:
+                for e in self.events:
+                    f.write(json.dumps(e) + "\n")
+            self.events = []
+
+        # Cumulative, rewritten after every call: workers are not shut down
+        # cleanly enough to rely on an exit hook.
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(os.path.join(self.cprofile_dir, f"{self.role}-{os.getpid()}.prof"))
+
+
+
+def enable(cprofile_dir: str | None = None) -> dict:
+    """Enables profiling in the main process.
+
+    Returns the settings to pass on to the worker processes.
+    """
+    global _PROFILER
+    parts_dir = tempfile.mkdtemp(prefix="vectorize-profile-")
+    _PROFILER = Profiler(parts_dir, "main", cprofile_dir)
+    if _PROFILER._cprofile is not None:
+        _PROFILER._cprofile.enable()
+
+    return {"parts_dir": parts_dir, "cprofile_dir": cprofile_dir}
+
+
+
+def worker_enable(settings: dict | None):
+    global _PROFILER
+
+    # A forked worker inherits the main process' profiler (and its cProfile
+    # hook): replace it with the worker's own.
+    sys.setprofile(None)
+    _PROFILER = None
+
+    if settings:
+        _PROFILER = Profiler(settings['parts_dir'], "worker", settings['cprofile_dir'])
+
+
+
+def enabled() -> bool:
+    return _PROFILER is not None
+
+
+
+def span(name: str, **args):
+    if _PROFILER is None:
+        return contextlib.nullcontext(args)
+    return _PROFILER.span(name, **args)
+
+
+
+def worker_cprofile():
+    if _PROFILER is None:
+        return contextlib.nullcontext()
+    return _PROFILER.cprofile()
+
+
+
+def worker_flush():
+    if _PROFILER is not None:
+        _PROFILER.flush()
+
+
+
+def _load_events() -> list[dict]:
+    _PROFILER.flush()
+
+    events = []
+    for path in sorted(glob.glob(os.path.join(_PROFILER.parts_dir, "*.jsonl"))):
+        with open(path, "r") as f:
+            events.extend(json.loads(line) for line in f if line.strip())
+
+    return sorted(events, key=lambda e: e['ts'])
+
+
+
+def print_summary(events: list[dict]):
+    stages = {}
+    for e in events:
+        count, wall, cpu, rows = stages.get(e['name'], (0, 0.0, 0.0, 0))
+        stages[e['name']] = (
+            count + 1,
+            wall + e['dur'] / 1e3,
+            cpu + e['args'].get('cpu_ms', 0.0),
+            rows + e['args'].get('rows', 0)
+        )
+
+    report = Table(title="Profile (per stage)", show_lines=False)
+    report.add_column("Stage")
+    report.add_column("Calls", justify="right")
+    report.add_column("Rows", justify="right")
+    report.add_column("Wall total (ms)", justify="right")
+    report.add_column("Wall mean (ms)", justify="right")
+    report.add_column("CPU total (ms)", justify="right")
+
+    for name, (count, wall, cpu, rows) in sorted(stages.items(), key=lambda s: -s[1][1]):
+        report.add_row(
+            name,
+            str(count),
+            str(rows) if rows else "",
+            f"{wall:.1f}",
+            f"{wall / count:.1f}",
+            f"{cpu:.1f}"
+        )
+
+    Console().print(report)
+
+
+
+def write_chrome_trace(events: list[dict], path: str):
+    """Writes a trace that chrome://tracing and https://ui.perfetto.dev load."""
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+
+def emit_otel(events: list[dict], root_name: str):
+    """Exports the spans over OTLP/HTTP.
+
+    The exporter reads the standard OTEL_EXPORTER_OTLP_* environment
+    variables (endpoint, headers, ...).
+    """
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        raise RuntimeError(
+            "--otel requires the OpenTelemetry SDK: "
+            "pip install opentelemetry-sdk opentelemetry-exporter-otlp-proto-http"
+        )
+
+    provider = TracerProvider(resource=Resource.create({"service.name": "vectorize"}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    tracer = provider.get_tracer("cockroachdb_vectors")
+
+    if not events:
+        return
+
+    start = min(e['ts'] for e in events)
+    end = max(e['ts'] + e['dur'] for e in events)
+
+    root = tracer.start_span(root_name, start_time=start * 1000)
+    ctx = trace.set_span_in_context(root)
+
+    for e in events:
+        attributes = {k: v for k, v in e['args'].items() if isinstance(v, (str, int, float, bool))}
+        attributes.update({"process.role": e['cat'], "process.pid": e['pid']})
+        span = tracer.start_span(e['name'], context=ctx, start_time=e['ts'] * 1000, attributes=attributes)
+        span.end(end_time=(e['ts'] + e['dur']) * 1000)
+
+    root.end(end_time=end * 1000)
+    provider.shutdown()
+
+
+
+def finish(root_name: str, trace_path: str | None = None, otel: bool = False):
+    """Merges the worker events, prints the per-stage summary, and writes the
+    requested trace outputs.
+    """
+    global _PROFILER
+    if _PROFILER is None:
+        return
+
+    if _PROFILER._cprofile is not None:
+        _PROFILER._cprofile.disable()
+
+    events = _load_events()
+
+    print_summary(events)
+
+    if trace_path:
+        write_chrome_trace(events, trace_path)
+        print(f"[INFO] Chrome trace written to {trace_path}")
+
+    if otel:
+        emit_otel(events, root_name)
+        print(f"[INFO] {len(events)} spans exported over OTLP")
+
+    if _PROFILER.cprofile_dir:
+        print(f"[INFO] cProfile output written to {_PROFILER.cprofile_dir}")
+
+    shutil.rmtree(_PROFILER.parts_dir, ignore_errors=True)
+    _PROFILER = None
@@ -0,0 +1,141 @@
+from datetime import datetime
+from .common import main_get_conn, healthy_get_conn
+
+
+DEFAULT_QUARANTINE_TABLE = "vectorize_quarantine"
+
+
+def quarantine_trigger_name(table_name: str, output_column: str) -> str:
+    # One per output column: each has its own entries
+    return f"clear_quarantine_on_update_{table_name.replace('.', '_')}_{output_column}"
+
+
+class Quarantine:
+    """Tracks the rows the model fails on, in a table of the database.
+
+    A row is quarantined once it has failed max_failures times with the same
+    input: the NULL scans skip it from then on, by its primary key. Changing
+    the row's input deletes its entry (a trigger on the table does it), and
+    the row is embedded again.
+    """
+
+    def __init__(
+        self,
+        pool,
+        schema_name: str | None, table_name: str,
+        primary_key: str, primary_key_type: str,
+        input_column: str, output_column: str,
+        max_failures: int,
+        quarantine_table: str = DEFAULT_QUARANTINE_TABLE
+    ):
+        self.pool = pool
+        self.table_name = table_name if schema_name is None else f"{schema_name}.{table_name}"
+        self.primary_key = primary_key
+        self.primary_key_type = primary_key_type
+        self.input_column = input_column
+        self.output_column = output_column
+        self.max_failures = max_failures
+        self.quarantine_table = quarantine_table
+
+        conn = main_get_conn(pool)
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {quarantine_table} (
+                    table_name STRING NOT NULL,
+                    column_name STRING NOT NULL,
+                    row_id STRING NOT NULL,
+                    input_md5 STRING NOT NULL,
+                    failures INT8 NOT NULL DEFAULT 1,
+                    last_error STRING,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (table_name, column_name, row_id)
+                )
+            """)
+
+            trigger_name = quarantine_trigger_name(self.table_name, output_column)
+            cur.execute(f"SELECT count(*) FROM pg_catalog.pg_trigger WHERE tgname = '{trigger_name}'")
+            if not cur.fetchone()[0]:
+                cur.execute(f"""
+                    CREATE OR REPLACE FUNCTION {trigger_name}()
+                    RETURNS trigger
+                    LANGUAGE plpgsql
+                    AS $$
+                    BEGIN
+                        DELETE FROM {quarantine_table}
+                        WHERE table_name = '{self.table_name}'
+                            AND column_name = '{output_column}'
+                            AND row_id = (NEW).{primary_key}::STRING;
+                        RETURN NEW;
+                    END;
+                    $$
+                """)
+                cur.execute(f"""
+                    CREATE TRIGGER {trigger_name}
+                    AFTER UPDATE ON {self.table_name}
+                    FOR EACH ROW
+                    WHEN (OLD.{input_column} IS DISTINCT FROM NEW.{input_column})
+                    EXECUTE FUNCTION {trigger_name}()
+                """)
+        pool.putconn(conn)
+
+
+    def exclude_sql(self, scan_table: str | None = None) -> str:
+        """A WHERE clause condition that skips the quarantined rows of the
+        target table, for a scan of scan_table (the target table by default,
+        or its side table).
+        """
+        scan_table = scan_table or self.table_name
+
+        # By key only: the entries of the rows whose input changed are gone,
+        # the candidates' inputs are not read
+        return f"""
+            NOT EXISTS (
+                SELECT 1 FROM {self.quarantine_table} q
+                WHERE q.table_name = '{self.table_name}'
+                    AND q.column_name = '{self.output_column}'
+                    AND q.row_id = {scan_table}.{self.primary_key}::STRING
+                    AND q.failures >= {self.max_failures}
+            )
+        """
+
+
+    def record(self, failed: list, batch_index: int = 0) -> list[str]:
+        """Counts a failure for each (row_id, error) pair. The input's md5
+        restarts the count of a row whose input changed while the trigger
+        wasn't there.
+
+        Returns a warning for each row that is now quarantined.
+        """
+        warnings = []
+
+        conn = healthy_get_conn(self.pool)
+        with conn.cursor() as cur:
+            for row_id, error in failed:
+                cur.execute(f"""
+                    INSERT INTO {self.quarantine_table}
+                        (table_name, column_name, row_id, input_md5, failures, last_error, updated_at)
+                    SELECT %s, %s, t.{self.primary_key}::STRING, md5(t.{self.input_column}::STRING), 1, %s, now()
+                    FROM {self.table_name} AS t
+                    WHERE t.{self.primary_key} = %s::{self.primary_key_type}
+                    ON CONFLICT (table_name, column_name, row_id) DO UPDATE SET
+                        failures = CASE
+                            WHEN {self.quarantine_table}.input_md5 = excluded.input_md5
+                            THEN {self.quarantine_table}.failures + 1
+                            ELSE 1
+                        END,
+                        input_md5 = excluded.input_md5,
+                        last_error = excluded.last_error,
+                        updated_at = now()
+                    RETURNING failures
+                """, (self.table_name, self.output_column, error[:1000], row_id))
+
+                result = cur.fetchone()
+                if result and result[0] == self.max_failures:
+                    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    warnings.append(
+                        f"[{timestamp}] [WARN] (batch {batch_index}) Row {row_id} quarantined "
+                        f"after {self.max_failures} failures: {error[:200]}"
+                    )
+        self.pool.putconn(conn)
+
+        return warnings
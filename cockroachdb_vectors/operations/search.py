@@ -5,6 +5,9 @@ from jinja2 import Template
 from psycopg2.pool import SimpleConnectionPool
 from .model import is_valid_model
 from .common import build_conn_kwargs, main_get_conn, get_primary_key_column
+from .chunking import chunk_table_name
+from .instrument import vector_table_name, resolve_vector_model
+from . import profile
 
 model = None
 
@@ -22,6 +25,66 @@ search_tmpl = \
     """
 search_tmpl = textwrap.dedent(search_tmpl).strip()
 
+# Side table storage: the top-k is found in the side table, and only those
+# rows are read from the source table. Same parameters as search_tmpl.
+side_search_tmpl = \
+    """
+        SELECT
+            t.{{ primary_key }},
+            t.{{ source }},
+            s.distance
+        FROM (
+            SELECT
+                {{ primary_key }},
+                ROUND({{ embedding }} {{ idxop }} {{ query }}::VECTOR({{ vector_dim }}), 6) AS distance
+            FROM {{ vector_table }}
+            WHERE {{ embedding }} IS NOT NULL
+            ORDER BY {{ embedding }} {{ idxop }} {{ query }}::VECTOR({{ vector_dim }})
+            LIMIT {{ limit }}
+        ) AS s
+        JOIN {{ table }} AS t ON t.{{ primary_key }} = s.{{ primary_key }}
+        AS OF SYSTEM TIME follower_read_timestamp()
+        ORDER BY s.distance
+    """
+side_search_tmpl = textwrap.dedent(side_search_tmpl).strip()
+
+# --chunked: the nearest chunks, aggregated back to their parent rows. Rows
+# being re-embedded (NULL parent vector) are left out, their chunks are stale.
+chunk_search_tmpl = \
+    """
+        SELECT
+            t.{{ primary_key }},
+            t.{{ source }},
+            ROUND({{ aggregate }}(c.similarity), 6) AS score,
+            count(*) AS chunks
+        FROM (
+            SELECT
+                {{ primary_key }},
+                {{ similarity }} AS similarity
+            FROM {{ chunk_table }}
+            ORDER BY embedding {{ idxop }} {{ query }}::VECTOR({{ vector_dim }})
+            LIMIT {{ fanout }}
+        ) AS c
+        JOIN {{ table }} AS t ON t.{{ primary_key }} = c.{{ primary_key }}
+        AS OF SYSTEM TIME follower_read_timestamp()
+        WHERE t.{{ embedding }} IS NOT NULL
+        GROUP BY t.{{ primary_key }}, t.{{ source }}
+        ORDER BY score DESC
+        LIMIT {{ limit }}
+    """
+chunk_search_tmpl = textwrap.dedent(chunk_search_tmpl).strip()
+
+# Chunks fetched per parent row asked for: a long text can take several of
+# the nearest chunks
+CHUNK_FANOUT = 10
+
+# Chunk distance to similarity, higher is closer, per index operator
+_SIMILARITY = {
+    "<=>": "1 - (embedding <=> {q})",       # cosine distance
+    "<#>": "-(embedding <#> {q})",          # negative inner product
+    "<->": "1 / (1 + (embedding <-> {q}))"  # L2 distance
+}
+
 emit_note = \
     """
         Note:
@@ -39,55 +102,91 @@ def run_search(args: dict):
 
     schema_name, table_name = args['schema'], args['table']
 
-    if not is_valid_model(args['model']):
+    if args['model'] is not None and not is_valid_model(args['model']):
         raise RuntimeError(f"Invalid embedding model {args['model']}")
 
-    global model
-    model = importlib.import_module(f"{__package__.split('.')[0]}.models.{args['model']}")
+    if args['profile']:
+        profile.enable(args['cprofile'])
 
-    conn_pool = SimpleConnectionPool(minconn=1, maxconn=2, **build_conn_kwargs(args['url']))
-    atexit.register(conn_pool.closeall)
+    with profile.span("connect"):
+        conn_pool = SimpleConnectionPool(minconn=1, maxconn=2, **build_conn_kwargs(args['url']))
+        atexit.register(conn_pool.closeall)
+
+    with profile.span("catalog"):
+        primary_key, primary_key_type = get_primary_key_column(conn_pool, schema_name, table_name)
+        vector_table = vector_table_name(conn_pool, schema_name, table_name, args['embedding'])
+
+        # The column's model, which migrate-model may have changed
+        model_name = resolve_vector_model(conn_pool, schema_name, vector_table, args['embedding'], args['model'])
+        if not is_valid_model(model_name):
+            raise RuntimeError(f"Invalid embedding model {model_name}")
+
+    global model
+    with profile.span("model_load", model=model_name):
+        model = importlib.import_module(f"{__package__.split('.')[0]}.models.{model_name}")
 
-    primary_key, primary_key_type = get_primary_key_column(conn_pool, schema_name, table_name)
     if verbose:
         print(f"[INFO] PK: {primary_key} ({primary_key_type})\n")
 
-    vector = model.embedding_encode(args['text'], args['verbose'])
-    vector_dim = model.embedding_dim()
+    with profile.span("encode", rows=1):
+        vector = model.embedding_encode(args['text'], args['verbose'])
+        vector_dim = model.embedding_dim()
     vector_param = "[" + ",".join(str(x) for x in vector) + "]"
     idxop = model.embedding_index_operator()
 
-    query_tmpl = search_tmpl.replace("{{ limit }}", "%s")
-    query_tmpl = query_tmpl.replace("{{ query }}", "%s")
-
+    chunk_table = chunk_table_name(table_name, args['embedding'])
+    tmpl = search_tmpl if vector_table == table_name else side_search_tmpl
     if schema_name is not None:
         table_name = f"{schema_name}.{table_name}"
+        chunk_table = f"{schema_name}.{chunk_table}"
+        vector_table = f"{schema_name}.{vector_table}"
+
+    if args['chunked']:
+        query_tmpl = chunk_search_tmpl.replace("{{ limit }}", "%s")
+        query_tmpl = query_tmpl.replace("{{ fanout }}", "%s")
+        query_tmpl = query_tmpl.replace("{{ query }}", "%s")
+        params = (vector_param, vector_param, args['limit'] * CHUNK_FANOUT, args['limit'])
+    else:
+        query_tmpl = tmpl.replace("{{ limit }}", "%s")
+        query_tmpl = query_tmpl.replace("{{ query }}", "%s")
+        params = (vector_param, vector_param, args['limit'])
 
     template = Template(query_tmpl)
     query = textwrap.dedent(
         template.render(
             table = table_name,
+            vector_table = vector_table,
+            chunk_table = chunk_table,
             primary_key = primary_key,
             source = args['source'],
             embedding = args['embedding'],
             vector_dim = vector_dim,
-            idxop = idxop
+            idxop = idxop,
+            similarity = _SIMILARITY[idxop].format(q=f"%s::VECTOR({vector_dim})"),
+            aggregate = args['aggregate'].upper()
         )
     )
 
     conn = main_get_conn(conn_pool)
-    with conn.cursor() as cur:
-        cur.execute(query, (vector_param, vector_param, args['limit']))
+    with conn.cursor() as cur, profile.span("query", limit=args['limit']) as span_args:
+        cur.execute(query, params)
         result = cur.fetchall()
+        span_args['rows'] = len(result)
 
     for r in result:
-        pk, src, dist = r
-        print(f"{dist} --> {pk}")
+        if args['chunked']:
+            pk, src, score, chunks = r
+            print(f"{score} --> {pk} ({chunks} chunks)")
+        else:
+            pk, src, dist = r
+            print(f"{dist} --> {pk}")
         print(f"{src}")
         print()
 
     conn_pool.putconn(conn)
 
+    profile.finish("search", args['trace'], args['otel'])
+
     return None
 
 
@@ -97,16 +196,22 @@ def run_emit(args: dict):
     sample = args['sample']
     schema_name, table_name = args['schema'], args['table']
 
-    if not is_valid_model(args['model']):
+    if args['model'] is not None and not is_valid_model(args['model']):
         raise RuntimeError(f"Invalid embedding model {args['model']}")
 
-    global model
-    model = importlib.import_module(f"{__name__.split(".")[0]}.models.{args['model']}")
-
     conn_pool = SimpleConnectionPool(minconn=1, maxconn=2, **build_conn_kwargs(args['url']))
     atexit.register(conn_pool.closeall)
 
     primary_key, primary_key_type = get_primary_key_column(conn_pool, schema_name, table_name )
+    vector_table = vector_table_name(conn_pool, schema_name, table_name, args['embedding'])
+
+    model_name = resolve_vector_model(conn_pool, schema_name, vector_table, args['embedding'], args['model'])
+    if not is_valid_model(model_name):
+        raise RuntimeError(f"Invalid embedding model {model_name}")
+
+    global model
+    model = importlib.import_module(f"{__name__.split(".")[0]}.models.{model_name}")
+    tmpl = search_tmpl if vector_table == table_name else side_search_tmpl
 
     vector_param = None
     if sample:
@@ -117,19 +222,21 @@ def run_emit(args: dict):
     idxop = model.embedding_index_operator()
 
     if sample:
-        query_tmpl = search_tmpl.replace("{{ query }}", f"'{str(vector_param)}'")
+        query_tmpl = tmpl.replace("{{ query }}", f"'{str(vector_param)}'")
         query_tmpl = query_tmpl.replace("{{ limit }}", str(args['limit']))
     else:
-        query_tmpl = search_tmpl.replace("{{ limit }}", "%s")
+        query_tmpl = tmpl.replace("{{ limit }}", "%s")
         query_tmpl = query_tmpl.replace("{{ query }}", "%s")
 
     if schema_name is not None:
         table_name = f"{schema_name}.{table_name}"
+        vector_table = f"{schema_name}.{vector_table}"
 
     template = Template(query_tmpl)
     query = textwrap.dedent(
         template.render(
             table = table_name,
+            vector_table = vector_table,
             primary_key = primary_key,
             source = args['source'],
             embedding = args['embedding'],
@@ -0,0 +1,106 @@
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from psycopg2.extensions import AsIs
+
+
+
+def adapt_vector(vector):
+    # A row read from the shared memory goes in as a VECTOR literal, built
+    # from the array: no list of floats is kept per row. Other embeddings
+    # are passed as they are.
+    if isinstance(vector, np.ndarray):
+        return AsIs("'[" + ",".join(map(repr, vector.tolist())) + "]'::VECTOR")
+    return vector
+
+
+
+class ResultRing:
+    """Shared memory ring of float32 vectors, rows x dim, that the workers
+    write their results to.
+
+    The main process reserves a slice of rows for each chunk it submits, and
+    passes its offset along with the row IDs. The worker writes the vectors
+    there and only returns the IDs of the rows it embedded: the vectors are
+    neither turned into float lists nor pickled. The main process reads
+    them in place, and releases the slice once they are written.
+    """
+
+    def __init__(self, rows: int, dim: int, name: str | None = None):
+        self.rows = rows
+        self.dim = dim
+        self.owner = name is None
+
+        if self.owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=rows * dim * 4)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            # Attaching registers the segment with the worker's resource
+            # tracker too, which would unlink it, and warn about a leak,
+            # when the worker exits. The main process owns it.
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+
+        self.name = self._shm.name
+        self.vectors = np.ndarray((rows, dim), dtype=np.float32, buffer=self._shm.buf)
+
+        # main process: the offset and row count of the slices in use
+        self._head = 0
+        self._live = {}
+
+
+    def reserve(self, count: int) -> int | None:
+        """The offset of count free rows, after the last slice reserved or
+        back at the start. None if they aren't free: the chunk's vectors
+        then go through the pipe.
+        """
+        if count > self.rows:
+            return None
+
+        if not self._live:
+            self._head = 0
+
+        offset = self._head
+        if offset + count > self.rows:
+            offset = 0
+
+        for start, used in self._live.items():
+            if offset < start + used and start < offset + count:
+                return None
+
+        self._live[offset] = count
+        self._head = offset + count
+
+        return offset
+
+
+    def release(self, offset: int):
+        self._live.pop(offset, None)
+
+
+    def write(self, offset: int, vectors: list) -> int:
+        """Copies the vectors to the rows from offset, in order. Returns the
+        rows written.
+        """
+        view = self.vectors[offset : offset + len(vectors)]
+        for k, vector in enumerate(vectors):
+            view[k] = vector
+
+        return len(vectors)
+
+
+    def read(self, offset: int, count: int) -> np.ndarray:
+        """The count vectors from offset, without a copy: valid until the
+        slice is released.
+        """
+        return self.vectors[offset : offset + count]
+
+
+    def close(self):
+        # The arrays must not outlive the mapping
+        self.vectors = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # Vectors still referenced: unmapped when the process exits
+            pass
+        if self.owner:
+            self._shm.unlink()
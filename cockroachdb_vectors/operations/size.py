@@ -17,8 +17,10 @@ from .common import (
     get_table_id,
     get_index_id,
     get_column_type,
-    get_primary_key_column
+    get_primary_key_column,
+    get_primary_index_id
 )
+from .instrument import is_side_table, has_own_family
 
 
 
@@ -35,8 +37,13 @@ def run_size(args: dict):
 
     primary_key, primary_key_type = get_primary_key_column(conn_pool, schema_name, table_name) 
 
+    if is_side_table(conn_pool, schema_name, table_name, args['embedding']):
+        raise RuntimeError(f"{args['embedding']} is stored in a side table: size only estimates vector columns")
+
     index_vector_name = f"{args['embedding']}_idx"
     index_vector_id = get_index_id(conn_pool, schema_name, table_name, index_vector_name)
+    if index_vector_id is None:
+        raise RuntimeError(f"{index_vector_name} doesn't exist. Run 'build-index' first.")
 \
     index_pk_null_name = f"{args['embedding']}_{primary_key}_null_idx"
     index_pk_null_id = get_index_id(conn_pool, schema_name, table_name, index_pk_null_name)
@@ -91,6 +98,16 @@ def run_size(args: dict):
     # Vector space as a percentage of the initial table space
     vector_space_increase_ration = float(vector_space) / float(table_space)
 
+    # Logical bytes rewritten per write. In the row's column family, an
+    # embedding write rewrites the whole row, and so does any update of the
+    # row. In its own family, each only writes its own columns.
+    primary_index_id = get_primary_index_id(conn_pool, schema_name, table_name)
+    row_bytes = index_space.get(primary_index_id, 0) * compress_rate / repl_factor / max(row_total, 1)
+    vector_bytes = vector_dim * 4
+    other_bytes = max(row_bytes - vector_bytes * row_cnt / max(row_total, 1), 0)
+
+    own_family = has_own_family(conn_pool, schema_name, table_name, args['embedding'])
+
     display_results(
         (
             table_name,                                                     # table name
@@ -113,12 +130,31 @@ def run_size(args: dict):
             f"{float(vector_space) / float(table_space):.1%}",
             f"{float(index_space[index_pk_null_id] + index_space[index_pk_not_null_id]) / float(table_space):.1%}",
         ),
-        compress_rate, repl_factor, float(row_cnt) / row_total
+        compress_rate, repl_factor, float(row_cnt) / row_total,
+        (
+            "own" if own_family else "shared with the row",
+            write_amplification(vector_bytes, other_bytes + vector_bytes, own_family),
+            write_amplification(other_bytes, other_bytes + vector_bytes, own_family)
+        )
     )
     return
 
 
 
+def write_amplification(own_bytes: float, shared_bytes: float, own_family: bool) -> str:
+    """Bytes per write as it is, and as it would be with the other family
+    placement.
+    """
+    own = humanize.naturalsize(own_bytes, gnu=True)
+    shared = humanize.naturalsize(shared_bytes, gnu=True)
+    saved = 1.0 - own_bytes / shared_bytes if shared_bytes else 0.0
+
+    if own_family:
+        return f"{own} (-{saved:.0%} vs {shared})"
+    return f"{shared} -> {own} (-{saved:.0%})"
+
+
+
 def display_results(
                         table: Tuple[str, str, str],
                         vector: Tuple[str, str, str, str],
@@ -126,7 +162,8 @@ def display_results(
                         overhead: Tuple[str, str],
                         compress_rate: float,
                         repl_factor: int,
-                        rows_embedded: float
+                        rows_embedded: float,
+                        writes: Tuple[str, str, str]
                     ):
 
     console = Console()
@@ -197,6 +234,21 @@ def display_results(
                     Padding(Align("Toolkit storage overhead", align="right"), (0, 1, 0, 1)),
                     Padding(overhead[1], (0, 0, 0, 6))
                 )
+    report.add_row(
+                    Padding(Align(">>>", align="right") , (0, 1, 0, 1)),
+                    Padding(Align("Vector column family", align="right"), (0, 1, 0, 1)),
+                    Padding(writes[0], (0, 0, 0, 6))
+                )
+    report.add_row(
+                    Padding(Align(">>>", align="right") , (0, 1, 0, 1)),
+                    Padding(Align("Bytes per embedding write", align="right"), (0, 1, 0, 1)),
+                    Padding(writes[1], (0, 0, 0, 6))
+                )
+    report.add_row(
+                    Padding(Align(">>>", align="right") , (0, 1, 0, 1)),
+                    Padding(Align("Bytes per row update", align="right"), (0, 1, 0, 1)),
+                    Padding(writes[2], (0, 0, 0, 6))
+                )
 
     console.print(report)
 
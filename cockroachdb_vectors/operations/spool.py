@@ -0,0 +1,180 @@
+import os
+import json
+import uuid
+import base64
+import threading
+from array import array
+
+
+def pack_vector(vector) -> str:
+    # float32, like the VECTOR column: 4 bytes per dimension, no precision lost
+    return base64.b64encode(array('f', vector).tobytes()).decode("ascii")
+
+
+def unpack_vector(data: str) -> list[float]:
+    vector = array('f')
+    vector.frombytes(base64.b64decode(data))
+    return vector.tolist()
+
+
+def jsonable_key(value):
+    # Key values come back as int, str, UUID, Decimal, ...; they are cast
+    # back to the key type by the UPDATE
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+
+
+class Spool:
+    """Local append-only log of the computed vectors, so that they survive
+    a failed write.
+
+    Each batch is appended before it is written to the database, and marked
+    done once committed. The batches never marked done are replayed later
+    without calling the model again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = {}
+
+        for entry in self._read():
+            if entry['op'] == "put":
+                self._pending[entry['id']] = entry
+            elif entry['op'] == "done":
+                self._pending.pop(entry['id'], None)
+
+        self._file = open(self.path, "a")
+        if self._file.tell() > 0 and not self._ends_with_newline():
+            # Don't append to the line a crash cut short
+            self._append_raw("\n")
+
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by a crash: its batch was never written
+                    # to the database either, and is embedded again
+                    continue
+
+
+    def _append(self, entry: dict):
+        self._append_raw(json.dumps(entry) + "\n")
+
+
+    def _append_raw(self, data: str):
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+    def put(
+            self,
+            schema_name: str | None, table_name: str, output_column: str,
+            primary_key: str, primary_key_type: str,
+            values: list,
+            chunks: list | None = None,
+            read_at: str | None = None
+        ) -> str:
+        """Appends the [row_id, embedding] pairs (and the chunks of a chunked
+        column) of a batch about to be written. read_at is the cluster
+        timestamp the rows were read at, as a string: rows changed since then
+        are not replayed.
+
+        Returns the entry id.
+        """
+        entry = {
+            "op": "put",
+            "id": uuid.uuid4().hex,
+            "schema": schema_name,
+            "table": table_name,
+            "column": output_column,
+            "primary_key": primary_key,
+            "primary_key_type": primary_key_type,
+            "read_at": read_at,
+            "rows": [[jsonable_key(row_id), pack_vector(embedding)] for row_id, embedding in values],
+            "chunks": [
+                [jsonable_key(row_id), chunk_no, start, end, pack_vector(embedding)]
+                for row_id, chunk_no, start, end, embedding in chunks or []
+            ]
+        }
+
+        with self._lock:
+            self._append(entry)
+            self._pending[entry['id']] = entry
+
+        return entry['id']
+
+
+    def done(self, entry_id: str):
+        """Marks a batch as committed."""
+        with self._lock:
+            self._append({"op": "done", "id": entry_id})
+            self._pending.pop(entry_id, None)
+
+            # Nothing left to replay: start over instead of growing forever
+            if not self._pending:
+                self._file.seek(0)
+                self._file.truncate()
+
+
+    def pending(self, schema_name=None, table_name=None, output_column=None) -> list[dict]:
+        """The batches not committed yet, oldest first, optionally only those
+        of one column. The vectors are unpacked.
+        """
+        with self._lock:
+            entries = list(self._pending.values())
+
+        return [
+            dict(
+                entry,
+                rows=[[row_id, unpack_vector(v)] for row_id, v in entry['rows']],
+                chunks=[[row_id, n, start, end, unpack_vector(v)] for row_id, n, start, end, v in entry['chunks']]
+            )
+            for entry in entries
+            if table_name is None or (
+                entry['schema'] == schema_name
+                and entry['table'] == table_name
+                and entry['column'] == output_column
+            )
+        ]
+
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+
+    def compact(self):
+        """Rewrites the spool with the pending batches only."""
+        with self._lock:
+            self._file.close()
+
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                for entry in self._pending.values():
+                    f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+            self._file = open(self.path, "a")
+
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,163 @@
+import time
+import threading
+from datetime import datetime
+from .common import main_get_conn
+from . import metrics
+
+
+# Seconds between two samples of the cluster's load
+THROTTLE_INTERVAL = 10
+
+# Pause between batches: first step when the cluster gets busy, and cap
+MIN_PAUSE = 0.5
+MAX_PAUSE = 30.0
+
+# The worst node's signals, from the metrics each node reports. Latencies
+# are in nanoseconds, the CPU is a fraction of the node's cores.
+CLUSTER_LOAD_SQL = """
+    SELECT
+        max((metrics->>'sql.service.latency-p99')::FLOAT8) / 1e6,
+        max((metrics->>'sys.cpu.combined.percent-normalized')::FLOAT8),
+        max((metrics->>'admission.wait_durations.kv-p99')::FLOAT8) / 1e6
+    FROM crdb_internal.kv_node_status
+"""
+
+
+
+class RowRateLimiter:
+    """Spaces the batches out to at most rate rows per second: each batch
+    starts once the rows of the previous ones are paid for.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, rows: int):
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now)
+            self._next = start + rows / self.rate
+
+        if start > now:
+            time.sleep(start - now)
+
+
+
+class Throttle:
+    """Slows embed down while the cluster is busy with the application's
+    traffic.
+
+    Every THROTTLE_INTERVAL seconds, the nodes' SQL p99 latency, CPU use and
+    KV admission queueing are compared to their limits (None: not checked).
+    Over any of them, the batches run on half as many workers and the pause
+    between batches doubles. Once all are under, a worker is added back and
+    the pause halves (AIMD). max_rows_per_sec caps the rate either way.
+    """
+
+    def __init__(
+        self,
+        pool,
+        workers: int,
+        max_rows_per_sec: float = 0,
+        max_latency_ms: float | None = None,
+        max_cpu: float | None = None,
+        max_queue_ms: float | None = None,
+        log: bool = True
+    ):
+        self.pool = pool
+        self.workers = max(1, workers)
+        self.concurrency = self.workers
+        self.pause = 0.0
+
+        self.limits = {
+            "SQL p99": (max_latency_ms, "ms"),
+            "CPU": (max_cpu, ""),
+            "admission p99": (max_queue_ms, "ms")
+        }
+        self.sampling = any(limit is not None for limit, _ in self.limits.values())
+        self.log = log
+
+        self.limiter = RowRateLimiter(max_rows_per_sec) if max_rows_per_sec > 0 else None
+
+        self._sampled = 0.0
+        self._lock = threading.Lock()
+
+
+    def _log(self, msg):
+        if self.log:
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            print(f"[{timestamp}] [INFO] Throttle: {msg}", flush=True)
+
+
+    def _sample(self):
+        conn = main_get_conn(self.pool)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(CLUSTER_LOAD_SQL)
+                values = cur.fetchone()
+        except Exception as e:
+            # crdb_internal.kv_node_status needs the VIEWCLUSTERMETADATA
+            # privilege
+            print(f"[WARN] Can't read the cluster's load, throttling on --max-rows-per-sec only: {e}", flush=True)
+            self.sampling = False
+            return
+        finally:
+            self.pool.putconn(conn)
+
+        over = []
+        for (name, (limit, unit)), value in zip(self.limits.items(), values):
+            if limit is not None and value is not None and value > limit:
+                over.append(f"{name} {value:.2f}{unit} > {limit}{unit}")
+
+        before = (self.concurrency, self.pause)
+        if over:
+            self.concurrency = max(1, self.concurrency // 2)
+            self.pause = min(MAX_PAUSE, max(MIN_PAUSE, self.pause * 2))
+            reason = ", ".join(over)
+        else:
+            self.concurrency = min(self.workers, self.concurrency + 1)
+            self.pause = self.pause / 2 if self.pause / 2 >= MIN_PAUSE else 0.0
+            reason = "under the limits"
+
+        if (self.concurrency, self.pause) != before:
+            self._log(f"{self.concurrency} workers, {self.pause:.1f}s between batches ({reason})")
+
+        metrics.THROTTLE_WORKERS.set(self.concurrency)
+        metrics.THROTTLE_PAUSE_SECONDS.set(self.pause)
+
+
+    def admit(self, rows: int, workers: int) -> int:
+        """Waits for the batch's turn. Returns the number of workers to
+        spread it over.
+        """
+        with self._lock:
+            if self.sampling and time.monotonic() - self._sampled >= THROTTLE_INTERVAL:
+                self._sampled = time.monotonic()
+                self._sample()
+            pause = self.pause
+            concurrency = min(workers, self.concurrency)
+
+        if pause > 0:
+            time.sleep(pause)
+
+        if self.limiter is not None:
+            self.limiter.acquire(rows)
+
+        return concurrency
+
+
+
+def throttle_from_args(pool, args: dict) -> Throttle | None:
+    """The Throttle the --throttle* and --max-rows-per-sec options ask for,
+    None if they ask for none.
+    """
+    if not args['throttle'] and not args['max_rows_per_sec']:
+        return None
+
+    limits = (None, None, None)
+    if args['throttle']:
+        limits = (args['throttle_latency_ms'], args['throttle_cpu'], args['throttle_queue_ms'])
+
+    return Throttle(pool, args['workers'], args['max_rows_per_sec'], *limits, log=not args.get('progress', False))
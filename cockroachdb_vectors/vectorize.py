@@ -1,13 +1,21 @@
 import click
 import json
+from datetime import datetime
 from cockroachdb_vectors.operations import (
     run_embed,
+    run_embed_all,
+    run_replay_spool,
     run_search,
     run_emit,
     run_model_list, run_model_desc,
     run_instrument,
+    run_build_index,
+    run_migrate_model,
     run_size,
-    run_cleanup
+    run_cleanup,
+    run_bench_embed,
+    run_bench_trigger,
+    run_backfill
 )
 
 
@@ -55,24 +63,61 @@ def cli():
 
 
 
-def common_options(f):
-    f = click.option("-u", "--url", required=True, help="CockroachDB connection URL")(f)
-    f = click.option("-t", "--table", required=True, help="Target table name")(f)
-    f = click.option("-i", "--input", "input_col", required=True, help="Column containing input text")(f)
-    f = click.option("-o", "--output", "output_col", required=True, help="Column to store the vector")(f)
-    f = click.option("-v", "--verbose", is_flag=True, help="Verbose output (used for debugging)")(f)
+def common_options(f=None, required=True):
+    # Used as @common_options, or @common_options(required=False) when the
+    # command checks -t/-i/-o itself
+    def _options(f):
+        f = click.option("-u", "--url", required=True, help="CockroachDB connection URL")(f)
+        f = click.option("-t", "--table", required=required, help="Target table name")(f)
+        f = click.option("-i", "--input", "input_col", required=required, help="Column containing input text")(f)
+        f = click.option("-o", "--output", "output_col", required=required, help="Column to store the vector")(f)
+        f = click.option("-v", "--verbose", is_flag=True, help="Verbose output (used for debugging)")(f)
+        return f
+    return _options if f is None else _options(f)
+
+def model_options(f=None, required=True):
+    def _options(f):
+        f = click.option("-m", "--model", required=required, help="Embedding model. See 'model list' for available models")(f)
+        return f
+    return _options if f is None else _options(f)
+
+def throttle_options(f):
+    f = click.option("--max-rows-per-sec", default=0, type=int,
+                     help="Embed at most this many rows per second, 0 for no limit (default: 0)")(f)
+    f = click.option("--throttle-queue-ms", default=20.0, type=float,
+                     help="Throttle when a node's KV admission p99 wait exceeds this (default: 20)")(f)
+    f = click.option("--throttle-cpu", default=0.8, type=click.FloatRange(0.0, 1.0),
+                     help="Throttle when a node's CPU use exceeds this fraction (default: 0.8)")(f)
+    f = click.option("--throttle-latency-ms", default=100.0, type=float,
+                     help="Throttle when a node's SQL p99 latency exceeds this (default: 100)")(f)
+    f = click.option("--throttle", is_flag=True,
+                     help="Use fewer workers and pause between batches while the cluster is loaded")(f)
     return f
 
-def model_options(f):
-    f = click.option("-m", "--model", required=True, help="Embedding model. See 'model list' for available models")(f)
+def profile_options(f):
+    f = click.option("--profile", "profile", is_flag=True, help="Record and print per-stage wall/CPU timings")(f)
+    f = click.option("--trace", type=click.Path(dir_okay=False),
+                     help="Write the per-stage spans to a Chrome trace JSON file (implies --profile)")(f)
+    f = click.option("--otel", is_flag=True,
+                     help="Export the per-stage spans over OTLP/HTTP (implies --profile)")(f)
+    f = click.option("--cprofile", type=click.Path(file_okay=False),
+                     help="Write cProfile output, per process, to this directory (implies --profile)")(f)
     return f
 
 
 
 @cli.command(short_help="Vectorize rows in CockroachDB using a specified encoding model.")
-@common_options
-@model_options
+@common_options(required=False)
+@model_options(required=False)
+@profile_options
+@throttle_options
 @click.option("-b", "--batch-size", default=1000, type=int, help="Rows to process per batch")
+@click.option("--adaptive", is_flag=True,
+              help="Adjust the batch and chunk sizes to the observed encode/update latency and retries")
+@click.option("--min-batch-size", default=10, type=int,
+              help="With --adaptive: smallest batch size (default: 10)")
+@click.option("--max-batch-size", default=10000, type=int,
+              help="With --adaptive: largest batch size (default: 10000)")
 @click.option("-n", "--num-batches", default=1, type=int,
               help="Number of batches to process before exiting (default: 1). 0: keep vectorizing new NULL rows indefinitely")
 @click.option("-F", "--follow", is_flag=True,
@@ -81,9 +126,43 @@ def model_options(f):
               help="Initial idle backoff between empty scans, in SECONDS (default: 15)")
 @click.option("--max-idle", default=1, type=int,
               help="Max idle time before exit, in MINUTES (default: 1)")
+@click.option("--changefeed", is_flag=True,
+              help="With --follow: embed changed rows from a changefeed instead of polling for NULL rows")
+@click.option("--checkpoint", type=click.Path(dir_okay=False),
+              help="With --changefeed: file to persist the resolved timestamp in, to resume after a restart")
+@click.option("--resolved", default=5, type=int,
+              help="With --changefeed: resolved timestamp interval, in SECONDS (default: 5)")
 @click.option("-w", "--workers", default=1, type=int,
               help="Number of parallel workders to use (default: 1)")
 @click.option("-p", "--progress", is_flag=True, help="Show progress bar")
+@click.option("--range-writes", default=0, type=int,
+              help="Split each batch's UPDATE by range and commit up to N range groups concurrently (default: 0, off)")
+@click.option("--quarantine", default=0, type=int,
+              help="Skip rows the model failed on N times, until their input changes (default: 0, off)")
+@click.option("--quarantine-table", default="vectorize_quarantine",
+              help="With --quarantine: table that tracks the failing rows (default: vectorize_quarantine)")
+@click.option("--chunk-tokens", default=0, type=int,
+              help="Chunked columns: tokens per chunk (default: 0, the model's input limit)")
+@click.option("--chunk-overlap", default=32, type=int,
+              help="Chunked columns: tokens shared by consecutive chunks (default: 32)")
+@click.option("--max-input-chars", type=int,
+              help="Fetch at most N characters of a text input column (default: the model's limit, if it has one; 0: no limit)")
+@click.option("--fetch-rows", default=0, type=int,
+              help="Stream each worker's rows through a server-side cursor, N rows at a time (default: 0, off)")
+@click.option("--shm", is_flag=True,
+              help="Return the vectors from the workers through shared memory, as float32, instead of pickled lists")
+@click.option("--spool", type=click.Path(dir_okay=False),
+              help="Log the computed vectors to this file until written, and write the ones left by a failed run first")
+@click.option("--spec", "specs", multiple=True, metavar="INPUT:OUTPUT:MODEL",
+              help="Also embed INPUT into OUTPUT with MODEL, from the same fetch of each row and in the same UPDATE (repeatable)")
+@click.option("--all-instrumented", is_flag=True,
+              help="Embed every instrumented column of the database, each with the model it was instrumented with (no -t/-i/-o)")
+@click.option("--metrics-port", type=int,
+              help="Serve Prometheus metrics on this port (e.g. 9100)")
+@click.option("--discover", is_flag=True,
+              help="Discover the live cluster nodes and spread the workers across them")
+@click.option("--locality", type=str,
+              help="Prefer gateway nodes in this locality, e.g. region=us-east1 (implies --discover)")
 @click.option("-d", "--dry-run", "dry_run", is_flag=True,
               help="Print SQL statements without executing (only valid with --verbose)")
 def embed(
@@ -93,12 +172,41 @@ def embed(
     output_col,
     model,
     batch_size,
+    adaptive,
+    min_batch_size,
+    max_batch_size,
     num_batches,
     follow,
     min_idle,
     max_idle,
+    changefeed,
+    checkpoint,
+    resolved,
     workers,
     progress,
+    range_writes,
+    quarantine,
+    quarantine_table,
+    chunk_tokens,
+    chunk_overlap,
+    max_input_chars,
+    fetch_rows,
+    shm,
+    spool,
+    specs,
+    all_instrumented,
+    throttle,
+    throttle_latency_ms,
+    throttle_cpu,
+    throttle_queue_ms,
+    max_rows_per_sec,
+    metrics_port,
+    discover,
+    locality,
+    profile,
+    trace,
+    otel,
+    cprofile,
     dry_run,
     verbose
 ):
@@ -106,12 +214,31 @@ def embed(
     if verbose and progress:
         raise click.UsageError("--verbose and --progress are mutually exclusive")
 
+    if changefeed and not follow:
+        raise click.UsageError("--changefeed requires --follow")
+
+    for spec in specs:
+        if len(spec.split(":")) != 3 or not all(spec.split(":")):
+            raise click.UsageError(f"--spec {spec}: expected INPUT:OUTPUT:MODEL")
+
+    if all_instrumented:
+        if table or input_col or output_col:
+            raise click.UsageError("--all-instrumented discovers the columns: drop -t/-i/-o")
+        if changefeed or specs or progress or shm:
+            raise click.UsageError("--all-instrumented doesn't support --changefeed, --spec, --progress, or --shm")
+    else:
+        for value, option in ((table, "-t"), (input_col, "-i"), (output_col, "-o"), (model, "-m")):
+            if value is None:
+                raise click.UsageError(f"Missing option '{option}'")
+
     if dry_run:
         workers = 1
         verbose = True
         progress = False
 
-    schema, table = parse_table_name(table)
+    schema = None
+    if table is not None:
+        schema, table = parse_table_name(table)
     
     args = {
         "url": url,
@@ -121,12 +248,40 @@ def embed(
         "output": output_col,
         "model": model,
         "batch_size": batch_size,
+        "adaptive": adaptive,
+        "min_batch_size": min_batch_size,
+        "max_batch_size": max_batch_size,
         "num_batches": num_batches,
         "follow": follow,
         "min_idle": min_idle,
         "max_idle": max_idle,
+        "changefeed": changefeed,
+        "checkpoint": checkpoint,
+        "resolved": resolved,
         "workers": workers,
         "progress": progress,
+        "range_writes": max(0, range_writes),
+        "quarantine": max(0, quarantine),
+        "quarantine_table": quarantine_table,
+        "chunk_tokens": max(0, chunk_tokens),
+        "chunk_overlap": max(0, chunk_overlap),
+        "max_input_chars": max_input_chars if max_input_chars is None else max(0, max_input_chars),
+        "fetch_rows": max(0, fetch_rows),
+        "shm": shm,
+        "spool": spool,
+        "specs": [tuple(spec.split(":")) for spec in specs],
+        "throttle": throttle,
+        "throttle_latency_ms": throttle_latency_ms,
+        "throttle_cpu": throttle_cpu,
+        "throttle_queue_ms": throttle_queue_ms,
+        "max_rows_per_sec": max(0, max_rows_per_sec),
+        "metrics_port": metrics_port,
+        "discover": discover,
+        "locality": locality,
+        "profile": profile or bool(trace or otel or cprofile),
+        "trace": trace,
+        "otel": otel,
+        "cprofile": cprofile,
         "dry_run": dry_run,
         "verbose": verbose
     }
@@ -137,13 +292,110 @@ def embed(
 
 
     # print(json.dumps(args, indent=2))
-    run_embed(args)
+    if all_instrumented:
+        run_embed_all(args)
+    else:
+        run_embed(args)
 
 
-@cli.command(short_help="Run similarity search")
+@cli.command("replay-spool", short_help="Write the vectors left in a spool file by failed writes")
+@click.option("-u", "--url", required=True, help="CockroachDB connection URL")
+@click.option("--spool", required=True, type=click.Path(dir_okay=False, exists=True),
+              help="Spool file, as given to 'embed --spool'")
+@click.option("-v", "--verbose", is_flag=True, help="Verbose output (used for debugging)")
+def replay_spool(
+        url,
+        spool,
+        verbose
+):
+
+    args = {
+        "url": url,
+        "spool": spool,
+        "verbose": verbose
+    }
+
+    run_replay_spool(args)
+
+
+
+@cli.command(short_help="Embed a large table in parallel, one lane per range, with resumable progress.")
 @common_options
 @model_options
+@click.option("-b", "--batch-size", default=1000, type=int, help="Rows to process per batch")
+@click.option("-w", "--workers", default=1, type=int,
+              help="Number of parallel workers encoding the rows (default: 1)")
+@click.option("--lanes", default=4, type=int,
+              help="Number of ranges backfilled concurrently (default: 4)")
+@click.option("--checkpoint", type=click.Path(dir_okay=False),
+              help="File to keep the progress in (default: backfill_<table>_<output>.json)")
+@click.option("--checkpoint-table", type=str,
+              help="Keep the progress in this table instead of a file, e.g. vectorize_backfill")
+@click.option("--restart", is_flag=True, help="Discard the saved progress and start over")
+@throttle_options
+@click.option("--metrics-port", type=int,
+              help="Serve Prometheus metrics on this port (e.g. 9100)")
+def backfill(
+        url,
+        table,
+        input_col,
+        output_col,
+        model,
+        batch_size,
+        workers,
+        lanes,
+        checkpoint,
+        checkpoint_table,
+        restart,
+        throttle,
+        throttle_latency_ms,
+        throttle_cpu,
+        throttle_queue_ms,
+        max_rows_per_sec,
+        metrics_port,
+        verbose
+):
+
+    if checkpoint and checkpoint_table:
+        raise click.UsageError("--checkpoint and --checkpoint-table are mutually exclusive")
+
+    schema, table = parse_table_name(table)
+
+    args = {
+        "url": url,
+        "schema": schema,
+        "table": table,
+        "input": input_col,
+        "output": output_col,
+        "model": model,
+        "batch_size": batch_size,
+        "workers": workers,
+        "lanes": max(1, lanes),
+        "checkpoint": checkpoint,
+        "checkpoint_table": checkpoint_table,
+        "restart": restart,
+        "throttle": throttle,
+        "throttle_latency_ms": throttle_latency_ms,
+        "throttle_cpu": throttle_cpu,
+        "throttle_queue_ms": throttle_queue_ms,
+        "max_rows_per_sec": max(0, max_rows_per_sec),
+        "metrics_port": metrics_port,
+        "verbose": verbose
+    }
+
+    run_backfill(args)
+
+
+
+@cli.command(short_help="Run similarity search")
+@common_options
+@model_options(required=False)
+@profile_options
 @click.option("-l", "--limit", default=10, type=int, help="Number of the closest matches (default: 10)")
+@click.option("--chunked", is_flag=True,
+              help="Search the chunks of a chunked column and rank their parent rows")
+@click.option("--aggregate", type=click.Choice(["max", "sum"]), default="max",
+              help="With --chunked: combine the similarities of a row's chunks by max or sum (default: max)")
 @click.argument("text", required=True)
 def search(
         url,
@@ -151,7 +403,13 @@ def search(
         input_col,
         output_col,
         limit,
+        chunked,
+        aggregate,
         model,
+        profile,
+        trace,
+        otel,
+        cprofile,
         verbose,
         text
 ):
@@ -165,7 +423,13 @@ def search(
         "source": input_col,
         "embedding": output_col,
         "limit": limit,
+        "chunked": chunked,
+        "aggregate": aggregate,
         "model": model,
+        "profile": profile or bool(trace or otel or cprofile),
+        "trace": trace,
+        "otel": otel,
+        "cprofile": cprofile,
         "verbose": verbose,
         "text": text
     }
@@ -176,7 +440,7 @@ def search(
 
 @cli.command(short_help="Emit SQL for integrations")
 @common_options
-@model_options
+@model_options(required=False)
 @click.option("-s", "--sample", type=str, help="Text to search for")
 @click.option("-l", "--limit", default=10, type=int, help="Number of the closest matches (default: 10)")
 def sql(
@@ -211,12 +475,40 @@ def sql(
 @cli.command(short_help="Instrument for vector search")
 @common_options
 @model_options
+@click.option("--chunked", is_flag=True,
+              help="Also keep one vector per chunk of the input, in a child table with its own vector index")
+@click.option("--storage", type=click.Choice(["column", "side-table"]), default="column",
+              help="Store the vectors in a column of the table, or in a side table keyed by its primary key (default: column)")
+@click.option("--migrate-family", is_flag=True,
+              help="Move an existing vector column out of the row's column family, into its own")
+@click.option("--defer-index", is_flag=True,
+              help="Don't create the vector index yet: 'build-index' creates it after the backfill")
+@click.option("--track-changes", is_flag=True,
+              help="Stamp the rows when their input changes, and embed those first, before the never-embedded ones")
+@click.option("--queue", is_flag=True,
+              help="Queue the rows to embed in a queue table, keeping their vector searchable until it's replaced")
+@click.option("--trigger-strategy", type=click.Choice(["neq", "distinct"]),
+              help="How the update trigger detects a change of the inputs: 'neq' (<>) or 'distinct' (IS DISTINCT FROM, "
+                   "and skips the updates that don't change them) (default: the table's current one, else neq). "
+                   "A stored content-hash column and statement-level triggers are not offered: the hash is computed "
+                   "from the whole input on every write of it, and CockroachDB has no statement-level triggers")
+@click.option("--hash-buckets", type=click.IntRange(min=0),
+              help="Hash-shard the indexes that locate the rows to embed over this many buckets, "
+                   "for sequential primary keys (default: as they are, else not sharded)")
 def instrument(
         url,
         table,
         input_col,
         output_col,
         model,
+        chunked,
+        storage,
+        migrate_family,
+        defer_index,
+        track_changes,
+        queue,
+        trigger_strategy,
+        hash_buckets,
         verbose
 ):
 
@@ -229,6 +521,14 @@ def instrument(
         "source": input_col,
         "embedding": output_col,
         "model": model,
+        "chunked": chunked,
+        "storage": storage,
+        "migrate_family": migrate_family,
+        "defer_index": defer_index,
+        "track_changes": track_changes,
+        "queue": queue,
+        "trigger_strategy": trigger_strategy,
+        "hash_buckets": hash_buckets,
         "verbose": verbose
     }
 
@@ -236,6 +536,89 @@ def instrument(
 
 
 
+@cli.command("build-index", short_help="Build the vector index deferred by 'instrument --defer-index'")
+@click.option("-u", "--url", required=True, help="CockroachDB connection URL")
+@click.option("-t", "--table", required=True, help="Target table name")
+@click.option("-o", "--output", "output_col", required=True, help="Column to store the vector")
+@model_options
+@click.option("--min-coverage", default=0.95, type=click.FloatRange(0.0, 1.0),
+              help="Fraction of the rows that must be embedded before the index is built (default: 0.95)")
+@click.option("--wait", is_flag=True, help="Wait for the coverage to be reached, instead of exiting")
+@click.option("--poll-interval", default=30, type=int, help="Seconds between coverage and build progress checks")
+@click.option("-v", "--verbose", is_flag=True, help="Verbose output (used for debugging)")
+def build_index(
+        url,
+        table,
+        output_col,
+        model,
+        min_coverage,
+        wait,
+        poll_interval,
+        verbose
+):
+
+    schema, table = parse_table_name(table)
+
+    args = {
+        "url": url,
+        "schema": schema,
+        "table": table,
+        "embedding": output_col,
+        "model": model,
+        "min_coverage": min_coverage,
+        "wait": wait,
+        "poll_interval": poll_interval,
+        "verbose": verbose
+    }
+
+    run_build_index(args)
+
+
+
+@cli.command("migrate-model", short_help="Re-embed a vector column with another model, without downtime")
+@click.option("-u", "--url", required=True, help="CockroachDB connection URL")
+@click.option("-t", "--table", required=True, help="Target table name")
+@click.option("-o", "--output", "output_col", required=True, help="Vector column to migrate")
+@click.option("-m", "--model", required=True, help="New embedding model. See 'model list' for available models")
+@click.option("-b", "--batch-size", default=1000, type=int, help="Rows to process per batch")
+@click.option("-w", "--workers", default=1, type=int,
+              help="Number of parallel worker processes to use (default: 1)")
+@click.option("--rate", default=100, type=int,
+              help="Rows re-embedded per second at most, 0 for no limit (default: 100)")
+@click.option("--no-swap", "no_swap", is_flag=True,
+              help="Stop once the new column is embedded, and keep searching the current one")
+@click.option("-v", "--verbose", is_flag=True, help="Verbose output (used for debugging)")
+def migrate_model(
+        url,
+        table,
+        output_col,
+        model,
+        batch_size,
+        workers,
+        rate,
+        no_swap,
+        verbose
+):
+
+    schema, table = parse_table_name(table)
+
+    args = {
+        "url": url,
+        "schema": schema,
+        "table": table,
+        "output": output_col,
+        "model": model,
+        "batch_size": batch_size,
+        "workers": workers,
+        "rate": max(0, rate),
+        "no_swap": no_swap,
+        "verbose": verbose
+    }
+
+    run_migrate_model(args)
+
+
+
 @cli.command(short_help="Estimate the storage footprint for a vector column")
 @common_options
 def size(
@@ -314,5 +697,160 @@ def desc(model: str):
 
 
 
+@cli.group(short_help="Run benchmarks.")
+def bench():
+    pass
+
+
+@bench.command("embed", short_help="Benchmark embed throughput over a matrix of models, batch sizes and workers.")
+@click.option("-u", "--url", required=True, help="CockroachDB connection URL (e.g. a local single-node cluster)")
+@click.option("-t", "--table", default="vectorize_bench", show_default=True,
+              help="Table to seed. It is dropped and re-created")
+@click.option("-m", "--model", "models", multiple=True, default=["hash_bench"], show_default=True,
+              help="Embedding model (repeatable)")
+@click.option("-b", "--batch-size", "batch_sizes", multiple=True, type=int, default=[100, 1000], show_default=True,
+              help="Batch size (repeatable)")
+@click.option("-w", "--workers", multiple=True, type=int, default=[1, 2], show_default=True,
+              help="Number of parallel workers (repeatable)")
+@click.option("--rows", default=10000, type=int, show_default=True, help="Number of rows to seed")
+@click.option("--text-length", default="50:2000", show_default=True,
+              help="MIN:MAX length of the seeded texts, in characters")
+@click.option("--distribution", type=click.Choice(["uniform", "lognormal"]), default="lognormal", show_default=True,
+              help="Distribution of the seeded text lengths")
+@click.option("--seed", default=42, type=int, show_default=True, help="Random seed for the seeded texts")
+@click.option("--repeat", default=1, type=int, show_default=True, help="Runs per matrix cell")
+@click.option("--reuse", is_flag=True, help="Reuse the table seeded by a previous run")
+@click.option("--keep", is_flag=True, help="Keep the seeded table when done")
+@click.option("-O", "--output", type=click.Path(dir_okay=False),
+              help="JSON results file (default: bench-embed-<timestamp>.json)")
+@click.option("-v", "--verbose", is_flag=True, help="Verbose output (used for debugging)")
+def bench_embed(
+        url,
+        table,
+        models,
+        batch_sizes,
+        workers,
+        rows,
+        text_length,
+        distribution,
+        seed,
+        repeat,
+        reuse,
+        keep,
+        output,
+        verbose
+):
+
+    try:
+        min_chars, max_chars = (int(n) for n in text_length.split(':'))
+    except ValueError:
+        raise click.BadParameter("expected MIN:MAX, e.g. 50:2000", param_hint="--text-length")
+
+    if not 0 < min_chars <= max_chars:
+        raise click.BadParameter("expected 0 < MIN <= MAX", param_hint="--text-length")
+
+    if output is None:
+        output = f"bench-embed-{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+
+    schema, table = parse_table_name(table)
+
+    args = {
+        "url": url,
+        "schema": schema,
+        "table": table,
+        "models": list(models),
+        "batch_sizes": list(batch_sizes),
+        "workers": list(workers),
+        "rows": rows,
+        "min_chars": min_chars,
+        "max_chars": max_chars,
+        "distribution": distribution,
+        "seed": seed,
+        "repeat": repeat,
+        "reuse": reuse,
+        "keep": keep,
+        "output": output,
+        "verbose": verbose
+    }
+
+    run_bench_embed(args)
+
+
+
+@bench.command("trigger", short_help="Benchmark the cost of the update trigger on the application's writes.")
+@click.option("-u", "--url", required=True, help="CockroachDB connection URL (e.g. a local single-node cluster)")
+@click.option("-t", "--table", default="vectorize_bench", show_default=True,
+              help="Table to seed. It is dropped and re-created")
+@click.option("-m", "--model", default="hash_bench", show_default=True,
+              help="Embedding model of the instrumented vector column")
+@click.option("--trigger", "triggers", multiple=True, type=click.Choice(["none", "neq", "distinct"]),
+              default=["none", "neq", "distinct"], show_default=True,
+              help="Trigger variant (repeatable): no trigger, or a --trigger-strategy")
+@click.option("--updates", default=2000, type=int, show_default=True, help="Single-row updates timed per variant and update kind")
+@click.option("--rows", default=10000, type=int, show_default=True, help="Number of rows to seed")
+@click.option("--text-length", default="50:2000", show_default=True,
+              help="MIN:MAX length of the seeded texts, in characters")
+@click.option("--distribution", type=click.Choice(["uniform", "lognormal"]), default="lognormal", show_default=True,
+              help="Distribution of the seeded text lengths")
+@click.option("--seed", default=42, type=int, show_default=True, help="Random seed for the seeded texts and updated rows")
+@click.option("--repeat", default=1, type=int, show_default=True, help="Runs per variant")
+@click.option("--reuse", is_flag=True, help="Reuse the table seeded by a previous run")
+@click.option("--keep", is_flag=True, help="Keep the seeded table when done")
+@click.option("-O", "--output", type=click.Path(dir_okay=False),
+              help="JSON results file (default: bench-trigger-<timestamp>.json)")
+@click.option("-v", "--verbose", is_flag=True, help="Verbose output (used for debugging)")
+def bench_trigger(
+        url,
+        table,
+        model,
+        triggers,
+        updates,
+        rows,
+        text_length,
+        distribution,
+        seed,
+        repeat,
+        reuse,
+        keep,
+        output,
+        verbose
+):
+
+    try:
+        min_chars, max_chars = (int(n) for n in text_length.split(':'))
+    except ValueError:
+        raise click.BadParameter("expected MIN:MAX, e.g. 50:2000", param_hint="--text-length")
+
+    if not 0 < min_chars <= max_chars:
+        raise click.BadParameter("expected 0 < MIN <= MAX", param_hint="--text-length")
+
+    if output is None:
+        output = f"bench-trigger-{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+
+    schema, table = parse_table_name(table)
+
+    args = {
+        "url": url,
+        "schema": schema,
+        "table": table,
+        "model": model,
+        "triggers": list(triggers),
+        "updates": updates,
+        "rows": rows,
+        "min_chars": min_chars,
+        "max_chars": max_chars,
+        "distribution": distribution,
+        "seed": seed,
+        "repeat": repeat,
+        "reuse": reuse,
+        "keep": keep,
+        "output": output,
+        "verbose": verbose
+    }
+
+    run_bench_trigger(args)
+
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,68 @@
+import pytest
+
+
+class FakeCursor:
+    def __init__(self, pool):
+        self.pool = pool
+        self.rows = []
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, stmt, params=None):
+        stmt = " ".join(stmt.split())
+        self.pool.log.append(stmt)
+        self.pool.params.append(params)
+        self.rows = self.pool.respond(stmt, params)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConn:
+    closed = 0
+    autocommit = True
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self):
+        return FakeCursor(self.pool)
+
+
+class FakePool:
+    """A psycopg2 pool without a database. The statements run are kept in
+    log, whitespace collapsed, and their parameters in params. respond(stmt,
+    params) returns the rows of each, or raises.
+    """
+    def __init__(self, respond=None):
+        self.respond = respond or (lambda stmt, params: [(1,)])
+        self.log = []
+        self.params = []
+        self.idle = []
+        self.closed = []
+
+    def getconn(self):
+        return self.idle.pop() if self.idle else FakeConn(self)
+
+    def putconn(self, conn, close=False):
+        if close:
+            self.closed.append(conn)
+        else:
+            self.idle.append(conn)
+
+    def closeall(self):
+        pass
+
+
+@pytest.fixture
+def fake_pool():
+    """Makes FakePools: fake_pool(respond=None)."""
+    return FakePool
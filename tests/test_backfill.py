@@ -0,0 +1,194 @@
+import json
+import pytest
+from types import SimpleNamespace
+from cockroachdb_vectors.operations import backfill
+from cockroachdb_vectors.operations import embed
+from cockroachdb_vectors.operations.backfill import FileCheckpoint, TableCheckpoint, plan_spans
+
+
+@pytest.mark.parametrize("boundaries, expected", [
+    # A single range: the whole table
+    ([], [(None, None)]),
+    ([10], [(None, 10), (10, None)]),
+    ([10, 20, 30], [(None, 10), (10, 20), (20, 30), (30, None)]),
+    (["b", "m"], [(None, "b"), ("b", "m"), ("m", None)]),
+])
+def test_plan_spans(boundaries, expected):
+    spans = plan_spans(boundaries)
+
+    assert [(s['start'], s['end']) for s in spans] == expected
+    assert all(s['after'] is None and not s['done'] and s['rows'] == 0 for s in spans)
+
+
+def test_file_checkpoint_resumes(tmp_path):
+    path = str(tmp_path / "backfill.json")
+
+    store = FileCheckpoint(path, "passage", "passage_vector")
+    assert store.load() is None
+
+    store.init(plan_spans([10]))
+    store.save(0, {"start": None, "end": 10, "after": 7, "done": False, "rows": 7})
+    store.save(1, {"start": 10, "end": None, "after": 42, "done": True, "rows": 30})
+
+    resumed = FileCheckpoint(path, "passage", "passage_vector").load()
+    assert resumed == [
+        {"start": None, "end": 10, "after": 7, "done": False, "rows": 7},
+        {"start": 10, "end": None, "after": 42, "done": True, "rows": 30},
+    ]
+
+
+def test_file_checkpoint_other_column(tmp_path):
+    path = str(tmp_path / "backfill.json")
+    FileCheckpoint(path, "passage", "passage_vector").init(plan_spans([]))
+
+    with pytest.raises(RuntimeError):
+        FileCheckpoint(path, "passage", "title_vector").load()
+
+
+def test_table_checkpoint_init_and_save(fake_pool):
+    pool = fake_pool()
+    store = TableCheckpoint(pool, "vectorize_backfill", "passage", "passage_vector")
+    pool.log.clear()
+    pool.params.clear()
+
+    store.init(plan_spans([10]))
+
+    assert pool.log[0] == "DELETE FROM vectorize_backfill WHERE table_name = %s AND column_name = %s"
+    assert pool.params[0] == ("passage", "passage_vector")
+    upserts = [params for stmt, params in zip(pool.log, pool.params) if stmt.startswith("UPSERT INTO vectorize_backfill")]
+    assert upserts == [
+        ("passage", "passage_vector", 0, "null", "10", "null", False, 0),
+        ("passage", "passage_vector", 1, "10", "null", "null", False, 0),
+    ]
+
+
+@pytest.mark.parametrize("rows, expected", [
+    ([], None),
+    (
+        [(None, 10, 7, False, 7), (10, None, None, True, 30)],
+        [
+            {"start": None, "end": 10, "after": 7, "done": False, "rows": 7},
+            {"start": 10, "end": None, "after": None, "done": True, "rows": 30},
+        ]
+    ),
+])
+def test_table_checkpoint_load(fake_pool, rows, expected):
+    pool = fake_pool(lambda stmt, params: rows)
+    store = TableCheckpoint(pool, "vectorize_backfill", "passage", "passage_vector")
+
+    assert store.load() == expected
+    assert pool.params[-1] == ("passage", "passage_vector")
+
+
+@pytest.mark.parametrize("span, conditions, params", [
+    # The whole table
+    ({"start": None, "end": None, "after": None}, "passage_vector IS NULL", [100]),
+    # From the span's start, up to its end
+    (
+        {"start": 10, "end": 20, "after": None},
+        "passage_vector IS NULL AND id >= %s::INT8 AND id < %s::INT8",
+        [10, 20, 100]
+    ),
+    # Resumed: after the last row of the checkpoint, never before it
+    (
+        {"start": 10, "end": 20, "after": 15},
+        "passage_vector IS NULL AND id > %s::INT8 AND id < %s::INT8",
+        [15, 20, 100]
+    ),
+    ({"start": None, "end": None, "after": 15}, "passage_vector IS NULL AND id > %s::INT8", [15, 100]),
+])
+def test_fetch_span_null_ids_bounds(fake_pool, span, conditions, params):
+    pool = fake_pool(lambda stmt, params: [(11,), (12,)])
+
+    ids = backfill.fetch_span_null_ids(pool, None, "passage", "passage_vector", "id", "INT8", span, 100)
+
+    assert ids == [11, 12]
+    assert f"WHERE {conditions} ORDER BY id LIMIT %s" in pool.log[-1]
+    assert pool.params[-1] == params
+
+
+ARGS = {
+    "model": "hash_bench",
+    "schema": None,
+    "table": "passage",
+    "url": "postgresql://root@localhost:26257/defaultdb",
+    "lanes": 1,
+    "input": "passage",
+    "output": "passage_vector",
+    "verbose": False,
+    "checkpoint_table": None,
+    "restart": False,
+    "workers": 1,
+    "metrics_port": 0,
+    "batch_size": 2,
+}
+
+
+@pytest.fixture
+def table(monkeypatch, fake_pool):
+    """A table with NULL vectors for ids 1-5, where the model fails on
+    id 2. Returns the batches embedded.
+    """
+    null_ids = {1, 2, 3, 4, 5}
+    batches = []
+
+    def _fetch(pool, schema, table, output, pk, pk_type, span, limit):
+        ids = sorted(i for i in null_ids if span['after'] is None or i > span['after'])
+        return ids[:limit]
+
+    def _process(executor, pool, url, schema, table, pk, pk_type, source, vector, ids, *args, **kwargs):
+        batches.append(ids)
+        written = [i for i in ids if i != 2]
+        null_ids.difference_update(written)
+        return len(written), [], [f"[WARN] Row {i} failed to embed" for i in ids if i == 2]
+
+    monkeypatch.setattr(backfill, "fetch_span_null_ids", _fetch)
+    monkeypatch.setattr(embed, "process_single_batch", _process)
+
+    # Nothing else touches the database
+    pool = fake_pool()
+    for name, value in {
+        "is_valid_model": lambda model: True,
+        "importlib": SimpleNamespace(import_module=lambda name: SimpleNamespace(embedding_dim=lambda: 2)),
+        "ThreadedSpreadConnectionPool": lambda *args, **kwargs: pool,
+        "get_primary_key_column": lambda *args: ("id", "INT8"),
+        "vector_table_name": lambda pool, schema, table, output: table,
+        "is_vector_column": lambda *args: True,
+        "vector_column_model": lambda *args: None,
+        "is_queued": lambda *args: False,
+        "is_chunked": lambda *args: False,
+        "get_range_boundaries": lambda *args: [],
+        "throttle_from_args": lambda *args: None,
+        "ProcessPoolExecutor": lambda **kwargs: SimpleNamespace(shutdown=lambda wait: None),
+    }.items():
+        monkeypatch.setattr(backfill, name, value, raising=False)
+    monkeypatch.setattr(embed, "input_char_limit", lambda *args: None, raising=False)
+    for name in ("model", "_VECTOR_TABLE", "_COLUMN_MODEL", "_QUEUE_TABLE", "_CHUNKING", "_MAX_INPUT_CHARS", "_THROTTLE"):
+        monkeypatch.setattr(embed, name, getattr(embed, name, None), raising=False)
+
+    return batches
+
+
+def test_span_cursor_passes_failed_rows(table, tmp_path):
+    checkpoint = str(tmp_path / "backfill.json")
+
+    backfill.run_backfill(dict(ARGS, checkpoint=checkpoint))
+
+    # Row 2 stays NULL behind the cursor, for a regular 'embed' run
+    assert table == [[1, 2], [3, 4], [5]]
+    with open(checkpoint) as f:
+        assert json.load(f)['spans'] == [{"start": None, "end": None, "after": 5, "done": True, "rows": 4}]
+
+
+def test_span_cursor_resumes(table, tmp_path):
+    checkpoint = str(tmp_path / "backfill.json")
+    FileCheckpoint(checkpoint, "passage", "passage_vector").init(
+        [{"start": None, "end": None, "after": 3, "done": False, "rows": 2}]
+    )
+
+    backfill.run_backfill(dict(ARGS, checkpoint=checkpoint))
+
+    assert table == [[4, 5]]
+    assert FileCheckpoint(checkpoint, "passage", "passage_vector").load() == [
+        {"start": None, "end": None, "after": 5, "done": True, "rows": 4}
+    ]
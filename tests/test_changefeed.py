@@ -0,0 +1,153 @@
+import json
+import pytest
+import psycopg2
+from cockroachdb_vectors.operations import changefeed
+from cockroachdb_vectors.operations import embed
+from cockroachdb_vectors.operations import metrics
+
+
+# passage_vector in its own family, as 'instrument' creates it
+FAMILIES = {
+    "primary": ["id", "passage"],
+    "passage_vector_fam": ["passage_vector"]
+}
+
+
+@pytest.mark.parametrize("families, column, expected", [
+    (FAMILIES, "passage", "primary"),
+    (FAMILIES, "passage_vector", "passage_vector_fam"),
+    ({}, "passage", None),
+])
+def test_source_family(monkeypatch, families, column, expected):
+    monkeypatch.setattr(changefeed, "get_column_families", lambda *args: families)
+    assert changefeed.source_family(None, None, "passage", column) == expected
+
+
+@pytest.mark.parametrize("family, target", [
+    (None, "FOR public.passage\n"),
+    ("primary", 'FOR TABLE public.passage FAMILY "primary"\n'),
+])
+def test_changefeed_statement(family, target):
+    stmt = changefeed.changefeed_statement("public.passage", "1700000000000000000.0000000000", 5, family)
+    assert target in stmt
+    assert "cursor = '1700000000000000000.0000000000'" in stmt
+    assert "resolved = '5s'" in stmt
+
+
+@pytest.mark.parametrize("after, expected", [
+    # The input's family only: a candidate, checked against the table
+    ({"id": 1, "passage": "text"}, True),
+    # Single family: NULL, or set by our own write
+    ({"id": 1, "passage": "text", "passage_vector": None}, True),
+    ({"id": 1, "passage": "text", "passage_vector": "[0.1,0.2]"}, False),
+    # Deleted
+    (None, False),
+])
+def test_needs_embedding(after, expected):
+    assert changefeed.needs_embedding(after, "passage_vector") == expected
+
+
+def test_follow_separate_family(monkeypatch, tmp_path):
+    monkeypatch.setattr(changefeed, "get_column_families", lambda *args: FAMILIES)
+
+    followed = []
+    def _events(url, schema, table, cursor, resolved, family=None):
+        followed.append((cursor, family))
+        yield 'row', [1], {"id": 1, "passage": "first"}
+        yield 'row', [2], {"id": 2, "passage": "second"}
+        yield 'row', [3], {"id": 3, "passage": "third"}
+        yield 'row', [2], None
+        yield 'resolved', "1700000001000000000.0000000000", None
+    monkeypatch.setattr(changefeed, "changefeed_events", _events)
+
+    # Row 3 was embedded by another process meanwhile
+    monkeypatch.setattr(
+        changefeed, "filter_null_vector_ids",
+        lambda pool, schema, table, output, pk, pk_type, ids, quarantine=None: [i for i in ids if i != 3]
+    )
+
+    embedded = []
+    def _process(executor, pool, url, schema, table, pk, pk_type, source, vector, ids, *args, **kwargs):
+        embedded.append(ids)
+        return len(ids), [], []
+    monkeypatch.setattr(embed, "process_single_batch", _process)
+    monkeypatch.setattr(metrics, "refresh_backlog", lambda *args, **kwargs: None)
+
+    checkpoint = tmp_path / "passage.ckpt"
+    checkpoint.write_text(json.dumps({"resolved": "1700000000000000000.0000000000"}))
+
+    changefeed.run_embed_changefeed(
+        None, None,
+        "postgresql://root@localhost:26257/defaultdb", None, "passage",
+        "id", "INT8",
+        "passage", "passage_vector",
+        100, 1,
+        0,
+        str(checkpoint),
+        5
+    )
+
+    assert followed == [("1700000000000000000.0000000000", "primary")]
+    assert embedded == [[1]]
+    assert json.loads(checkpoint.read_text()) == {"resolved": "1700000001000000000.0000000000"}
+
+
+@pytest.fixture
+def follow(monkeypatch, tmp_path):
+    """run_embed_changefeed() on a table with one family, without a database.
+    Returns the batches embedded.
+    """
+    monkeypatch.setattr(changefeed, "get_column_families", lambda *args: {})
+    monkeypatch.setattr(changefeed, "cluster_timestamp", lambda pool: "1700000000000000000.0000000000")
+    monkeypatch.setattr(
+        changefeed, "filter_null_vector_ids",
+        lambda pool, schema, table, output, pk, pk_type, ids, quarantine=None: ids
+    )
+    monkeypatch.setattr(metrics, "refresh_backlog", lambda *args, **kwargs: None)
+    monkeypatch.setattr(changefeed.time, "sleep", lambda secs: None)
+
+    def _events(url, schema, table, cursor, resolved, family=None):
+        yield 'row', [7], {"id": 7, "passage": "changed"}
+        yield 'resolved', "1700000001000000000.0000000000", None
+    monkeypatch.setattr(changefeed, "changefeed_events", _events)
+
+    embedded = []
+
+    def _run(process, null_ids=()):
+        def _process(executor, pool, url, schema, table, pk, pk_type, source, vector, ids, *args, **kwargs):
+            embedded.append(ids)
+            return process(ids)
+        monkeypatch.setattr(embed, "process_single_batch", _process)
+        monkeypatch.setattr(embed, "fetch_null_vector_ids", lambda *args: list(null_ids))
+
+        changefeed.run_embed_changefeed(
+            None, None,
+            "postgresql://root@localhost:26257/defaultdb", None, "passage",
+            "id", "INT8",
+            "passage", "passage_vector",
+            100, 1,
+            0,
+            str(tmp_path / "passage.ckpt"),
+            5
+        )
+        return embedded
+
+    return _run
+
+
+def test_backlog_stops_on_failing_rows(follow):
+    # Rows 1 and 2 stay NULL: the model fails on them
+    embedded = follow(lambda ids: (0, [], [f"[WARN] Row {i} failed to embed" for i in ids]), null_ids=[1, 2])
+
+    assert embedded == [[1, 2], [7]]
+
+
+def test_follow_retries_failed_writes(follow):
+    failures = [psycopg2.OperationalError("server closed the connection unexpectedly")]
+    def _process(ids):
+        if failures:
+            raise failures.pop()
+        return len(ids), [], []
+
+    # Replayed from the cursor after the retry
+    assert follow(_process) == [[7], [7]]
@@ -0,0 +1,117 @@
+import pytest
+from cockroachdb_vectors.operations import common
+
+
+@pytest.mark.parametrize("url, host, port", [
+    ("postgresql://root@node1:26257/defaultdb", "node1", 26257),
+    ("postgresql://root@node1:26258,node2/defaultdb", "node1,node2", "26258,26257"),
+    ("postgresql://root@[::1]:26257/defaultdb", "::1", 26257),
+    # No host: libpq's defaults
+    ("postgresql:///defaultdb?sslmode=disable", None, None),
+])
+def test_build_conn_kwargs(url, host, port):
+    kwargs = common.build_conn_kwargs(url)
+    assert kwargs.get('host') == host
+    assert kwargs.get('port') == port
+    assert kwargs['dbname'] == "defaultdb"
+
+
+def test_spread_pool_rotates_gateways(monkeypatch):
+    opened = []
+    monkeypatch.setattr(common.psycopg2, "connect", lambda **kwargs: opened.append(kwargs['host']) or object())
+
+    pool = common.SpreadConnectionPool(0, 4, "postgresql://root@a:26257,b:26257,c:26257/defaultdb")
+    for _ in range(4):
+        pool.getconn()
+    assert opened == ["a,b,c", "b,c,a", "c,a,b", "a,b,c"]
+
+    # Discovered: the preferred nodes in turn, the others for failover
+    opened.clear()
+    pool = common.SpreadConnectionPool(0, 3, "postgresql://root@a:26257/defaultdb")
+    pool.spread_over([("n1", 26257), ("n2", 26257), ("n3", 26257)], 2)
+    for _ in range(3):
+        pool.getconn()
+    assert opened == ["n1,n2,n3", "n2,n1,n3", "n1,n2,n3"]
+
+
+@pytest.mark.parametrize("idle, probe, probed", [
+    (0, False, False),
+    (common.HEALTH_CHECK_INTERVAL + 1, False, True),
+    (0, True, True),
+])
+def test_healthy_get_conn_probes(monkeypatch, fake_pool, idle, probe, probed):
+    probes = []
+    monkeypatch.setattr(common, "is_conn_healthy", lambda conn: probes.append(conn) or True)
+
+    clock = [1000.0]
+    monkeypatch.setattr(common.time, "monotonic", lambda: clock[0])
+
+    pool = fake_pool()
+    conn = common.healthy_get_conn(pool)
+    assert probes == []
+    pool.putconn(conn)
+
+    clock[0] += idle
+    assert common.healthy_get_conn(pool, probe) is conn
+    assert probes == ([conn] if probed else [])
+
+
+@pytest.mark.parametrize("direction, keys, expected", [
+    ("ASC", ["10", "20"], [10, 20]),
+    ("ASC", ['"b"', '"m"'], ["b", "m"]),
+    # Ranges in key order: above 20, (10, 20], up to 10
+    ("DESC", ["20", "10"], [11, 21]),
+    # No value right above a string
+    ("DESC", ['"m"', '"b"'], []),
+])
+def test_get_range_boundaries_direction(monkeypatch, fake_pool, direction, keys, expected):
+    monkeypatch.setattr(common, "get_table_id", lambda *args: 104)
+    monkeypatch.setattr(common, "get_primary_index_id", lambda *args: 1)
+    monkeypatch.setattr(common, "get_primary_key_direction", lambda *args: direction)
+
+    # SHOW RANGES of a table split at the keys
+    pool = fake_pool(lambda stmt, params: [(None,)] + [(f"…/1/{key}",) for key in keys])
+    assert common.get_range_boundaries(pool, None, "passage") == expected
+
+
+@pytest.mark.parametrize("key, expected", [
+    # v23.1+: shortened within the table
+    ("…/1/42", 42),
+    ("…/1/-7", -7),
+    ("…/1/1.5", 1.5),
+    ('…/1/"abc"', "abc"),
+    ('…/1/"a\\"b"', 'a"b'),
+    ("…/1/'4f3c2a10-0000-4000-8000-000000000000'", "4f3c2a10-0000-4000-8000-000000000000"),
+    # Only the first key column
+    ("…/1/42/7", 42),
+    ('…/1/"abc"/7', "abc"),
+    # Older versions, and fully qualified
+    ("/1/42", 42),
+    ("/Table/104/1/42", 42),
+    # Not a row of the primary index
+    (None, None),
+    ("", None),
+    ("/Min", None),
+    ("…/1", None),
+    ("…/2/42", None),
+    ("/Table/105/1/42", None),
+])
+def test_parse_range_key(key, expected):
+    assert common.parse_range_key(key, 104, 1) == expected
+
+
+@pytest.mark.parametrize("key", [
+    "…/1/2024-01-01T00:00:00Z",
+    "…/1/\\x0102",
+])
+def test_parse_range_key_unsupported(key):
+    with pytest.raises(ValueError):
+        common.parse_range_key(key, 104, 1)
+
+
+@pytest.mark.parametrize("column, buckets, expected", [
+    ("id", 16, "crdb_internal_id_shard_16"),
+    ("passage_id", 8, "crdb_internal_passage_id_shard_8"),
+])
+def test_shard_column_name(column, buckets, expected):
+    assert common.shard_column_name(column, buckets) == expected
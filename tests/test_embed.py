@@ -0,0 +1,156 @@
+import pytest
+from decimal import Decimal
+from concurrent.futures import Future
+from cockroachdb_vectors.operations import embed
+
+
+class DoneExecutor:
+    """Runs nothing: each chunk comes back with the rows given."""
+    def __init__(self, failed, read_at=()):
+        self.failed = failed
+        self.read_at = list(read_at)
+
+    def submit(self, fn, url, schema, table, source, pk, ids, *args):
+        fut = Future()
+        fut.set_result((
+            [[row_id, [0.0, 1.0]] for row_id in ids if row_id not in self.failed],
+            [(row_id, "ValueError: too long") for row_id in ids if row_id in self.failed],
+            [],
+            self.read_at.pop(0) if self.read_at else None
+        ))
+        return fut
+
+
+class FakeSpool:
+    path = "passage.spool"
+
+    def __init__(self):
+        self.put_read_at = []
+
+    def pending_count(self):
+        return 0
+
+    def put(self, schema, table, column, pk, pk_type, values, chunks, read_at):
+        self.put_read_at.append(read_at)
+        return "entry"
+
+    def done(self, entry_id):
+        pass
+
+
+class Controller:
+    chunk_size = 2
+
+    def observe(self, rows, encode_secs, update_secs, retries, failures=0):
+        self.observed = (rows, retries, failures)
+
+
+@pytest.mark.parametrize("writer_warnings, failed, retries", [
+    ([], [], 0),
+    (["Retry 1/10"], [], 1),
+    (["Retry 1/10", "Retry 2/10"], [], 2),
+    # Failed rows are warned about, but are no retry
+    ([], [3], 0),
+    (["Retry 1/10"], [3, 4], 1),
+])
+def test_retries_counted(monkeypatch, writer_warnings, failed, retries):
+    monkeypatch.setattr(
+        embed, "batch_update",
+        lambda pool, schema, table, output, pk, pk_type, values, *args: (len(values), [], list(writer_warnings))
+    )
+    monkeypatch.setattr(embed, "_UPDATE_RETRIES", 0)
+    controller = Controller()
+
+    _, errors, warnings = embed.process_single_batch(
+        DoneExecutor(failed), None,
+        "postgresql://root@localhost:26257/defaultdb", None, "passage",
+        "id", "INT8",
+        "passage", "passage_vector",
+        [1, 2, 3, 4], 2, 1,
+        controller=controller
+    )
+
+    assert errors == []
+    assert len(warnings) == len(writer_warnings) + len(failed)
+    assert controller.observed == (4 - len(failed), retries, 0)
+    assert embed._UPDATE_RETRIES == retries
+
+
+@pytest.mark.parametrize("queue_table, spooled", [
+    # The earliest read of the chunks
+    (None, ["1700000000000000000.0000000001"]),
+    # Queued rows stay in their queue until written
+    ("passage_passage_vector_queue", []),
+])
+def test_spool_read_at(monkeypatch, queue_table, spooled):
+    monkeypatch.setattr(
+        embed, "batch_update",
+        lambda pool, schema, table, output, pk, pk_type, values, *args: (len(values), [], [])
+    )
+    dequeued = []
+    monkeypatch.setattr(embed, "dequeue", lambda *args: dequeued.append(args[-2]))
+    spool = FakeSpool()
+    monkeypatch.setattr(embed, "_SPOOL", spool)
+    monkeypatch.setattr(embed, "_QUEUE_TABLE", queue_table)
+
+    read_at = [Decimal("1700000000000000000.0000000002"), Decimal("1700000000000000000.0000000001")]
+    embed.process_single_batch(
+        DoneExecutor([], read_at), None,
+        "postgresql://root@localhost:26257/defaultdb", None, "passage",
+        "id", "INT8",
+        "passage", "passage_vector",
+        [1, 2, 3, 4], 2, 1
+    )
+
+    assert spool.put_read_at == spooled
+    assert dequeued == ([Decimal("1700000000000000000.0000000001")] if queue_table else [])
+
+
+@pytest.mark.parametrize("keys, boundaries, expected", [
+    # No boundaries: one group
+    ([1, 15, 25], [], [[1, 15, 25]]),
+    # A boundary starts its range
+    ([1, 10, 15, 20, 25], [10, 20], [[1], [10, 15], [20, 25]]),
+    # Groups in the order of their first row
+    ([25, 1, 15, 2], [10, 20], [[25], [1, 2], [15]]),
+    (["a", "c", "n"], ["b", "m"], [["a"], ["c"], ["n"]]),
+    # Keys that don't compare with the boundaries: one group
+    (["a", "c"], [10, 20], [["a", "c"]]),
+])
+def test_group_by_range(keys, boundaries, expected):
+    values = [[key, [0.0]] for key in keys]
+    groups = embed.group_by_range(values, boundaries)
+    assert [[row[0] for row in group] for group in groups] == expected
+
+
+class PickyEncoder:
+    """Fails on any batch holding a row whose text is "bad"."""
+    def __init__(self):
+        self.calls = 0
+
+    def embedding_encode_batch(self, batch_index, batch, verbose=False):
+        self.calls += 1
+        if any(text == "bad" for _, text in batch):
+            raise ValueError("too long")
+        return [[row_id, [float(row_id)]] for row_id, _ in batch]
+
+
+@pytest.mark.parametrize("texts, failed, calls", [
+    (["a", "b", "c", "d"], [], 1),
+    (["bad"], [2], 1),
+    # Bisected down to the failing row: 1 + 2 + 2 calls
+    (["a", "b", "bad", "d"], [4], 5),
+    (["bad", "b", "c", "bad"], [2, 5], 7),
+    (["bad", "bad"], [2, 3], 3),
+])
+def test_encode_isolating(monkeypatch, texts, failed, calls):
+    batch = [(row_id, text) for row_id, text in enumerate(texts, 2)]
+    encoder = PickyEncoder()
+    monkeypatch.setattr(embed, "model", encoder)
+
+    values, errors = embed.encode_isolating(1, batch)
+
+    assert [row_id for row_id, _ in values] == [row_id for row_id, text in batch if text != "bad"]
+    assert [row_id for row_id, _ in errors] == failed
+    assert all(error == "ValueError: too long" for _, error in errors)
+    assert encoder.calls == calls
@@ -0,0 +1,59 @@
+import pytest
+from cockroachdb_vectors.operations import instrument
+
+
+def _create_trigger(config):
+    sql = instrument.update_trigger_sql(config, None, "passage", "id")
+    return " ".join(sql[3].split())
+
+
+@pytest.mark.parametrize("config, when", [
+    # distinct: the trigger only fires when an input changed
+    (
+        [{"input": "passage", "output": ["passage_vector"], "strategy": "distinct"}],
+        "WHEN (OLD.passage IS DISTINCT FROM NEW.passage)"
+    ),
+    (
+        [
+            {"input": "passage", "output": ["passage_vector"], "strategy": "distinct"},
+            {"input": "title", "output": ["title_vector"], "strategy": "distinct"}
+        ],
+        "WHEN (OLD.passage IS DISTINCT FROM NEW.passage OR OLD.title IS DISTINCT FROM NEW.title)"
+    ),
+    # The default strategy: the original trigger, unchanged
+    (
+        [{"input": "passage", "output": ["passage_vector"]}],
+        None
+    ),
+    # neq: compared in the function only
+    (
+        [{"input": "passage", "output": ["passage_vector"], "strategy": "neq"}],
+        None
+    ),
+    # Any input without the WHEN strategy: the function decides for all
+    (
+        [
+            {"input": "passage", "output": ["passage_vector"], "strategy": "distinct"},
+            {"input": "title", "output": ["title_vector"], "strategy": "neq"}
+        ],
+        None
+    ),
+])
+def test_update_trigger_when(config, when):
+    create = _create_trigger(config)
+
+    assert create.startswith("CREATE TRIGGER clear_vector_on_update_passage BEFORE UPDATE ON passage FOR EACH ROW")
+    if when is None:
+        assert "WHEN" not in create
+    else:
+        assert when in create
+    assert create.endswith("EXECUTE FUNCTION clear_vector_on_update_passage();")
+
+
+@pytest.mark.parametrize("strategy, condition", [
+    ("distinct", "IF (NEW).passage IS DISTINCT FROM (OLD).passage THEN"),
+    ("neq", "IF (NEW).passage <> (OLD).passage THEN"),
+])
+def test_update_trigger_function_condition(strategy, condition):
+    sql = instrument.update_trigger_sql([{"input": "passage", "output": ["passage_vector"], "strategy": strategy}], None, "passage", "id")
+    assert condition in " ".join(sql[2].split())
@@ -0,0 +1,45 @@
+import pytest
+from cockroachdb_vectors.operations import metrics
+
+
+def _backlog_pool(fake_pool, count, statistics):
+    def _respond(stmt, params):
+        if "SHOW STATISTICS" in stmt:
+            return [] if statistics is None else [(statistics,)]
+        return [(count,)]
+    return fake_pool(_respond)
+
+
+@pytest.mark.parametrize("schema, table, expected", [
+    (None, "passage", "passage"),
+    ("docs", "passage", "docs.passage"),
+])
+def test_table_label(schema, table, expected):
+    assert metrics.table_label(schema, table) == expected
+
+
+@pytest.mark.parametrize("count, statistics, expected", [
+    # Below the bound: exact, the statistics are not read
+    (42, 5000000, 42),
+    # At the bound: the statistics, unless they are behind
+    (1000, 5000000, 5000000),
+    (1000, 10, 1000),
+    (1000, None, 1000),
+])
+def test_count_backlog_bounded(fake_pool, count, statistics, expected):
+    pool = _backlog_pool(fake_pool, count, statistics)
+    cur = pool.getconn().cursor()
+    assert metrics.count_backlog(cur, "passage", "id", "passage_vector", limit=1000) == expected
+
+    assert "FROM (SELECT 1 FROM passage@passage_vector_id_null_idx WHERE passage_vector IS NULL LIMIT 1000)" in pool.log[0]
+    assert ("SHOW STATISTICS" in pool.log[-1]) == (count >= 1000)
+
+
+def test_count_backlog_queued(fake_pool):
+    pool = _backlog_pool(fake_pool, 1000, 2000)
+    cur = pool.getconn().cursor()
+    assert metrics.count_backlog(cur, "passage_passage_vector_queue", "id", "passage_vector", queued=True, limit=1000) == 2000
+
+    assert "FROM (SELECT 1 FROM passage_passage_vector_queue LIMIT 1000)" in pool.log[0]
+    assert "SELECT row_count" in pool.log[1]
+    assert "column_names = ARRAY['id']" in pool.log[1]
@@ -0,0 +1,89 @@
+import pytest
+import psycopg2
+from cockroachdb_vectors.operations import embed
+from cockroachdb_vectors.operations import instrument
+
+
+@pytest.fixture
+def migrate_pool(fake_pool):
+    """A pool whose statements containing fail_on fail, until a ROLLBACK."""
+    def _pool(fail_on=None):
+        def _respond(stmt, params):
+            if fail_on and fail_on in stmt and "ROLLBACK" not in pool.log:
+                raise psycopg2.errors.FeatureNotSupported("unimplemented")
+            if "cluster_logical_timestamp" in stmt:
+                return [(len(pool.log),)]
+            return [(1,)]
+        pool = fake_pool(_respond)
+        return pool
+    return _pool
+
+
+DETACHED = [{"input": "passage", "output": []}]
+ATTACHED = [{"input": "passage", "output": ["passage_vector"]}]
+RENAMES = ['ALTER TABLE passage RENAME COLUMN "passage_vector_next" TO "passage_vector"']
+
+
+def _statements(log, prefix):
+    return [s for s in log if s.startswith(prefix)]
+
+
+def test_rename_under_trigger_one_transaction(migrate_pool):
+    pool = migrate_pool()
+    log = pool.log
+    instrument.rename_under_trigger(pool, None, "passage", "id", RENAMES, DETACHED, ATTACHED, [("passage_vector", False, False)])
+
+    assert log[0] == "BEGIN"
+    assert log[-1] == "COMMIT"
+    assert _statements(log, "ALTER TABLE") == RENAMES
+    # Detached, then attached again, inside the transaction
+    functions = _statements(log, "CREATE OR REPLACE FUNCTION")
+    assert "NEW.passage_vector := NULL" not in functions[0]
+    assert "NEW.passage_vector := NULL" in functions[1]
+    assert not _statements(log, "UPDATE")
+
+
+def test_rename_under_trigger_resets_rows_written_meanwhile(migrate_pool):
+    # The trigger function can't be replaced in the transaction
+    pool = migrate_pool(fail_on="CREATE OR REPLACE FUNCTION")
+    log = pool.log
+    instrument.rename_under_trigger(
+        pool, None, "passage", "id",
+        RENAMES, DETACHED, ATTACHED, [("passage_vector", True, False)]
+    )
+
+    assert "ROLLBACK" in log
+    updates = _statements(log, "UPDATE passage")
+    assert len(updates) == 1
+    assert 'SET "passage_vector" = NULL, "passage_vector_changed" = now()' in updates[0]
+    assert "crdb_internal_mvcc_timestamp >" in updates[0]
+    assert "crdb_internal_mvcc_timestamp <=" in updates[0]
+    # After the trigger is attached again
+    assert log.index(updates[0]) > max(i for i, s in enumerate(log) if s.startswith("CREATE TRIGGER"))
+
+
+def test_reset_rows_written_queued(migrate_pool):
+    pool = migrate_pool()
+    log = pool.log
+    instrument.reset_rows_written(pool, "public", "passage", "id", "passage_vector", 10, 20, queued=True)
+    assert log == [
+        'INSERT INTO public.passage_passage_vector_queue ("id") SELECT "id" FROM public.passage '
+        'WHERE crdb_internal_mvcc_timestamp > 10 AND crdb_internal_mvcc_timestamp <= 20 ON CONFLICT ("id") DO NOTHING'
+    ]
+
+
+@pytest.mark.parametrize("expected, recorded, raises", [
+    (None, "openai_text_embed", False),
+    ("hf_st_all_minilm_l6", None, False),
+    ("hf_st_all_minilm_l6", "hf_st_all_minilm_l6", False),
+    ("hf_st_all_minilm_l6", "openai_text_embed", True),
+])
+def test_check_column_model(monkeypatch, expected, recorded, raises):
+    monkeypatch.setattr(embed, "_COLUMN_MODEL", expected)
+    monkeypatch.setattr(embed, "vector_column_model", lambda *args: recorded)
+
+    if raises:
+        with pytest.raises(embed.ColumnModelChanged):
+            embed.check_column_model(None, None, "passage", "passage_vector")
+    else:
+        embed.check_column_model(None, None, "passage", "passage_vector")
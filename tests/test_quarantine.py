@@ -0,0 +1,42 @@
+import pytest
+from cockroachdb_vectors.operations.quarantine import Quarantine, quarantine_trigger_name
+
+
+@pytest.mark.parametrize("schema, table, expected", [
+    (None, "passage", "clear_quarantine_on_update_passage_passage_vector"),
+    ("docs", "passage", "clear_quarantine_on_update_docs_passage_passage_vector"),
+])
+def test_quarantine_trigger_name(schema, table, expected):
+    table_name = table if schema is None else f"{schema}.{table}"
+    assert quarantine_trigger_name(table_name, "passage_vector") == expected
+
+
+@pytest.mark.parametrize("triggers, created", [
+    (0, True),
+    # Left by an earlier run
+    (1, False),
+])
+def test_trigger_deletes_entry_on_input_change(fake_pool, triggers, created):
+    pool = fake_pool(lambda stmt, params: [(triggers,)])
+    Quarantine(pool, None, "passage", "id", "INT8", "passage", "passage_vector", 3)
+    log = pool.log
+
+    creates = [s for s in log if s.startswith("CREATE TRIGGER")]
+    assert bool(creates) == created
+    if created:
+        assert "AFTER UPDATE ON passage" in creates[0]
+        assert "WHEN (OLD.passage IS DISTINCT FROM NEW.passage)" in creates[0]
+        function = [s for s in log if s.startswith("CREATE OR REPLACE FUNCTION")][0]
+        assert "DELETE FROM vectorize_quarantine WHERE table_name = 'passage' AND column_name = 'passage_vector' AND row_id = (NEW).id::STRING" in function
+
+
+@pytest.mark.parametrize("scan_table", [None, "passage_passage_vector"])
+def test_exclude_by_key(fake_pool, scan_table):
+    quarantine = Quarantine(fake_pool(), None, "passage", "id", "INT8", "passage", "passage_vector", 3)
+    sql = " ".join(quarantine.exclude_sql(scan_table).split())
+
+    assert f"q.row_id = {scan_table or 'passage'}.id::STRING" in sql
+    assert "q.failures >= 3" in sql
+    # The candidates' inputs are not read
+    assert "md5" not in sql
+    assert "passage::STRING" not in sql
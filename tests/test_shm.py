@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from concurrent.futures import Future
+from cockroachdb_vectors.operations import embed
+from cockroachdb_vectors.operations import shm
+from cockroachdb_vectors.operations.shm import ResultRing, adapt_vector
+
+
+@pytest.fixture
+def ring():
+    ring = ResultRing(10, 2)
+    yield ring
+    ring.close()
+
+
+@pytest.mark.parametrize("live, count, expected", [
+    # After the last slice reserved
+    ([4], 3, 4),
+    # No room left at the end: back at the start, once it's released
+    ([4, 4], 3, None),
+    ([4, 4, -1], 3, 0),
+    # Never more than the ring
+    ([], 11, None),
+    # Empty again: from the start
+    ([4, -1], 6, 0),
+])
+def test_reserve_wraps_around(ring, live, count, expected):
+    offsets = []
+    for used in live:
+        if used < 0:
+            ring.release(offsets.pop(0))
+        else:
+            offsets.append(ring.reserve(used))
+    assert ring.reserve(count) == expected
+
+
+def test_write_read(ring):
+    offset = ring.reserve(2)
+    ring.write(offset, [[1.0, 2.0], [3.0, 4.0]])
+    assert ring.read(offset, 2).tolist() == [[1.0, 2.0], [3.0, 4.0]]
+
+
+@pytest.mark.parametrize("vector, expected", [
+    (np.array([0.5, -1.0], dtype=np.float32), "'[0.5,-1.0]'::VECTOR"),
+    ([0.5, -1.0], [0.5, -1.0]),
+])
+def test_adapt_vector(vector, expected):
+    adapted = adapt_vector(vector)
+    assert (adapted.getquoted().decode() if isinstance(vector, np.ndarray) else adapted) == expected
+
+
+class FailingExecutor:
+    def submit(self, *args):
+        fut = Future()
+        fut.set_exception(RuntimeError("worker died"))
+        return fut
+
+
+def test_failed_chunk_releases_ring(monkeypatch, ring):
+    monkeypatch.setattr(embed, "_RESULT_RING", ring)
+
+    with pytest.raises(RuntimeError):
+        embed.process_single_batch(
+            FailingExecutor(), None,
+            "postgresql://root@localhost:26257/defaultdb", None, "passage",
+            "id", "INT8",
+            "passage", "passage_vector",
+            [1, 2, 3, 4], 2, 1
+        )
+
+    # Both chunks' rows are free again
+    assert ring.reserve(10) == 0
+
+
+def test_attach_leaves_segment_to_owner(monkeypatch, ring):
+    unregistered = []
+    monkeypatch.setattr(shm.resource_tracker, "unregister", lambda name, rtype: unregistered.append((name, rtype)))
+
+    attached = ResultRing(ring.rows, ring.dim, ring.name)
+    attached.write(0, [[1.0, 2.0]])
+    attached.close()
+
+    assert unregistered == [("/" + ring.name, "shared_memory")]
+    # Still there for the owner
+    assert ring.read(0, 1).tolist() == [[1.0, 2.0]]